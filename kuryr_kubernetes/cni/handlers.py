@@ -18,12 +18,12 @@ import six
 
 from os_vif import objects as obj_vif
 from oslo_log import log as logging
-from oslo_serialization import jsonutils
 
 from kuryr_kubernetes.cni.binding import base as b_base
 from kuryr_kubernetes import constants as k_const
 from kuryr_kubernetes.handlers import dispatch as k_dis
 from kuryr_kubernetes.handlers import k8s_base
+from kuryr_kubernetes import vif_annotation as vif_annot
 
 LOG = logging.getLogger(__name__)
 
@@ -54,8 +54,7 @@ class CNIHandlerBase(k8s_base.ResourceEventHandler):
             vif_annotation = annotations[k_const.K8S_ANNOTATION_VIF]
         except KeyError:
             return None
-        vif_dict = jsonutils.loads(vif_annotation)
-        vif = obj_vif.vif.VIFBase.obj_from_primitive(vif_dict)
+        vif = vif_annot.load_vif(vif_annotation, pod['metadata']['namespace'])
         LOG.debug("Got VIF from annotation: %r", vif)
         return vif
 
@@ -84,6 +84,15 @@ k8s_opts = [
                help=_("The driver that manages VIFs pools for "
                       "Kubernetes Pods."),
                default='noop'),
+    cfg.StrOpt('vif_annotation_format',
+               help=_("Format of the VIF annotation of the pods. 'full' "
+                      "keeps the whole VIF, including its network, on each "
+                      "pod, while 'compact' references the network "
+                      "definition, annotated once on the pod namespace. The "
+                      "CNI drivers must be able to read the 'compact' "
+                      "format before enabling it."),
+               choices=['full', 'compact'],
+               default='full'),
 ]
 
 neutron_defaults = [
@@ -20,11 +20,16 @@ K8S_OBJ_NAMESPACE = 'Namespace'
 K8S_OBJ_POD = 'Pod'
 K8S_OBJ_SERVICE = 'Service'
 K8S_OBJ_ENDPOINTS = 'Endpoints'
+K8S_OBJ_NODE = 'Node'
 
 K8S_POD_STATUS_PENDING = 'Pending'
 
+K8S_NODE_ADDRESS_INTERNAL_IP = 'InternalIP'
+
 K8S_ANNOTATION_PREFIX = 'openstack.org/kuryr'
 K8S_ANNOTATION_VIF = K8S_ANNOTATION_PREFIX + '-vif'
+K8S_ANNOTATION_VIF_POOL = K8S_ANNOTATION_PREFIX + '-vif-pool'
+K8S_ANNOTATION_NETWORK_PREFIX = K8S_ANNOTATION_PREFIX + '-net-'
 K8S_ANNOTATION_LBAAS_SPEC = K8S_ANNOTATION_PREFIX + '-lbaas-spec'
 K8S_ANNOTATION_LBAAS_STATE = K8S_ANNOTATION_PREFIX + '-lbaas-state'
 
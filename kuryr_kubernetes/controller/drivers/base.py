@@ -317,6 +317,30 @@ class LBaaSDriver(DriverBase):
         """
         raise NotImplementedError()
 
+    def ensure_populated_loadbalancer(self, endpoints, project_id,
+                                      subnet_id, ip, security_groups_ids,
+                                      targets):
+        """Get or create load balancer with its listeners, pools and members.
+
+        Drivers able to create a whole load balancer at once should override
+        this method, which by default creates nothing so that the load
+        balancer is created one component at a time instead.
+
+        :param endpoints: dict containing K8s Endpoints object
+        :param project_id: OpenStack project ID
+        :param subnet_id: Neutron subnet ID to host load balancer and of the
+                          targets
+        :param ip: IP of the load balancer
+        :param security_groups_ids: security groups that should be allowed
+                                    access to the load balancer
+        :param targets: dict with the targets of the listener of each
+                        (protocol, port), as dicts with the Kubernetes
+                        ObjectReference of each target keyed by (ip, port)
+        :returns: `LBaaSState` object with the load balancer components, or
+                  None if the load balancer was not created
+        """
+        return None
+
     @abc.abstractmethod
     def release_loadbalancer(self, endpoints, loadbalancer):
         """Release load balancer.
@@ -405,6 +429,40 @@ class LBaaSDriver(DriverBase):
         """
         raise NotImplementedError()
 
+    def update_members(self, endpoints, loadbalancer, pool, subnet_id,
+                       members, targets):
+        """Replaces the members of a pool by the members of the targets.
+
+        The current members of the targets are kept, members are created for
+        the rest of the targets and the members of no target are released.
+        This implementation does it one member at a time, through
+        `ensure_member` and `release_member`, and drivers able to do it in a
+        single operation should override it.
+
+        :param endpoints: dict containing K8s Endpoints object
+        :param loadbalancer: `LBaaSLoadBalancer` object
+        :param pool: `LBaaSPool` object
+        :param subnet_id: Neutron subnet ID of the targets
+        :param members: list of the current `LBaaSMember` objects of the pool
+        :param targets: dict with the Kubernetes ObjectReference of each
+                        target (e.g. Pod reference), keyed by (ip, port)
+        :returns: list of the `LBaaSMember` objects of the pool
+        """
+        pool_members = []
+        for member in members:
+            if (str(member.ip), member.port) in targets:
+                pool_members.append(member)
+            else:
+                self.release_member(endpoints, loadbalancer, member)
+
+        current_targets = {(str(m.ip), m.port) for m in pool_members}
+        for (ip, port), target_ref in targets.items():
+            if (ip, port) not in current_targets:
+                pool_members.append(self.ensure_member(
+                    endpoints, loadbalancer, pool, subnet_id, ip, port,
+                    target_ref))
+        return pool_members
+
 
 @six.add_metaclass(abc.ABCMeta)
 class VIFPoolDriver(PodVIFDriver):
@@ -420,3 +478,50 @@ class VIFPoolDriver(PodVIFDriver):
         vif resources.
         """
         raise NotImplementedError()
+
+    @abc.abstractmethod
+    def populate_pool(self, pod, project_id, subnets, security_groups):
+        """Ensures the pool for the given parameters has ports available.
+
+        Implementing drivers may use it to create ports ahead of the pods
+        that are going to need them, e.g., as soon as a node joins the
+        cluster, so that its first pod does not have to wait for them.
+
+        :param pod: dict containing a Kubernetes Pod-like object whose
+                    `status.hostIP` identifies the node of the pool
+        :param project_id: OpenStack project ID
+        :param subnets: dict containing subnet mapping as returned by
+                        `PodSubnetsDriver.get_subnets`
+        :param security_groups: list containing security groups' IDs as
+                                returned by
+                                `PodSecurityGroupsDriver.get_security_groups`
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def release_pools(self, host_addr):
+        """Releases the ports of all the pools of the given node.
+
+        It is used when the node is removed from the cluster or can no
+        longer get new pods, so that the ports, and their IPs, are not kept
+        around for it. Ports released later on by the pods of that node are
+        deleted instead of pooled, until the pools of the node are populated
+        again.
+
+        :param host_addr: IP address of the node (`status.hostIP` of its
+                          pods)
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def resume_pools(self, host_addr):
+        """Allows the pools of the given node to be used again.
+
+        It is used when the node joins the cluster, or can get new pods
+        again, so that the ports released by its pods are pooled again
+        after a previous `release_pools`.
+
+        :param host_addr: IP address of the node (`status.hostIP` of its
+                          pods)
+        """
+        raise NotImplementedError()
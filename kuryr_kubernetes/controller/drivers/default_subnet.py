@@ -13,16 +13,55 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from kuryr.lib._i18n import _
 from oslo_config import cfg
 
 from kuryr_kubernetes import clients
 from kuryr_kubernetes import config
 from kuryr_kubernetes.controller.drivers import base
+from kuryr_kubernetes.controller.drivers import utils as d_utils
 from kuryr_kubernetes import os_vif_util
 
+subnet_cache_opts = [
+    cfg.IntOpt('ttl',
+               help=_("Time (in seconds) the subnets and their networks "
+                      "information is cached for. 0 to disable caching"),
+               min=0,
+               default=600),
+    cfg.IntOpt('max_size',
+               help=_("Maximum number of subnets cached"),
+               min=1,
+               default=256),
+]
+
+cfg.CONF.register_opts(subnet_cache_opts, "subnet_cache")
+
+_subnets_cache = None
+
+
+def _get_subnets_cache():
+    global _subnets_cache
+    if _subnets_cache is None:
+        _subnets_cache = d_utils.TTLCache(
+            'subnets', _load_subnet, cfg.CONF.subnet_cache.ttl,
+            cfg.CONF.subnet_cache.max_size)
+    return _subnets_cache
+
+
+def invalidate_subnet(subnet_id=None):
+    """Removes the given subnet, or all of them, from the subnets cache."""
+    if _subnets_cache is not None:
+        _subnets_cache.invalidate(subnet_id)
+
 
 def _get_subnet(subnet_id):
-    # TODO(ivc): add caching (e.g. oslo.cache with dict backend)
+    if not cfg.CONF.subnet_cache.ttl:
+        return _load_subnet(subnet_id)
+    # The cached network is shared, so a copy is returned to the callers
+    return _get_subnets_cache().get(subnet_id).obj_clone()
+
+
+def _load_subnet(subnet_id):
     neutron = clients.get_neutron_client()
 
     n_subnet = neutron.show_subnet(subnet_id).get('subnet')
@@ -16,22 +16,75 @@
 import random
 import time
 
+from kuryr.lib._i18n import _
 from neutronclient.common import exceptions as n_exc
+from oslo_config import cfg as oslo_cfg
 from oslo_log import log as logging
 from oslo_utils import excutils
 from oslo_utils import timeutils
 
 from kuryr_kubernetes import clients
 from kuryr_kubernetes.controller.drivers import base
+from kuryr_kubernetes.controller.drivers import utils as d_utils
 from kuryr_kubernetes import exceptions as k_exc
 from kuryr_kubernetes.objects import lbaas as obj_lbaas
 
 LOG = logging.getLogger(__name__)
 _ACTIVATION_TIMEOUT = 300
+# TODO(ivc): make lb_algorithm configurable
+_LB_ALGORITHM = 'ROUND_ROBIN'
+
+lbaasv2_driver_opts = [
+    oslo_cfg.BoolOpt('batch_member_update',
+                     help=_("Replace the members of a pool with a single "
+                            "batch member update request, waiting for the "
+                            "load balancer provisioning once per pool update "
+                            "instead of once per member. Requires the load "
+                            "balancer API to support batch member updates, "
+                            "as the Octavia v2 API does"),
+                     default=False),
+    oslo_cfg.FloatOpt('provisioning_poll_interval',
+                      help=_("Interval (in seconds) between the provisioning "
+                             "status checks of the load balancers being "
+                             "waited for"),
+                      min=0.1,
+                      default=2),
+    oslo_cfg.BoolOpt('populated_loadbalancer_create',
+                     help=_("Create the load balancers of new services with "
+                            "all their listeners, pools and members in a "
+                            "single request, waiting for a single "
+                            "provisioning. Requires the load balancer API to "
+                            "support single-call creation, as the Octavia v2 "
+                            "API (or the Neutron LBaaS lb-graph extension) "
+                            "does"),
+                     default=False),
+]
+
+oslo_cfg.CONF.register_opts(lbaasv2_driver_opts, "lbaasv2")
 
 
 class LBaaSv2Driver(base.LBaaSDriver):
-    """LBaaSv2Driver implements LBaaSDriver for Neutron LBaaSv2 API."""
+    """LBaaSv2Driver implements LBaaSDriver for Neutron LBaaSv2 API.
+
+    The load balancers being provisioned are waited for through
+    _provisioning_poller, which checks the provisioning status of all of them
+    with a single list_loadbalancers request every
+    `provisioning_poll_interval` seconds.
+
+    If `batch_member_update` is set, the members of a pool are replaced with
+    a single batch member update request (PUT on the pool members), which
+    creates the members of the new targets and deletes the members of no
+    target.
+
+    If `populated_loadbalancer_create` is set, the load balancers of new
+    services are created along with their listeners, pools and members with
+    a single create_loadbalancer request.
+    """
+
+    def __init__(self):
+        self._provisioning_poller = d_utils.StatusPoller(
+            'lb_provisioning', self._get_loadbalancers_status,
+            oslo_cfg.CONF.lbaasv2.provisioning_poll_interval)
 
     def ensure_loadbalancer(self, endpoints, project_id, subnet_id, ip,
                             security_groups_ids):
@@ -52,6 +105,59 @@ class LBaaSv2Driver(base.LBaaSDriver):
 
         return response
 
+    def ensure_populated_loadbalancer(self, endpoints, project_id,
+                                      subnet_id, ip, security_groups_ids,
+                                      targets):
+        if not oslo_cfg.CONF.lbaasv2.populated_loadbalancer_create:
+            return None
+
+        name = "%(namespace)s/%(name)s" % endpoints['metadata']
+        loadbalancer = obj_lbaas.LBaaSLoadBalancer(name=name,
+                                                   project_id=project_id,
+                                                   subnet_id=subnet_id,
+                                                   ip=ip)
+        if not self._create_populated_loadbalancer(loadbalancer, subnet_id,
+                                                   targets):
+            # The load balancer already exists (e.g. a previous attempt to
+            # create it failed later on), so it is synced step by step
+            return None
+
+        self._wait_for_provisioning(loadbalancer, _ACTIVATION_TIMEOUT)
+
+        lbaas_state = obj_lbaas.LBaaSState(loadbalancer=loadbalancer,
+                                           listeners=[], pools=[], members=[])
+        for (protocol, port), pool_targets in targets.items():
+            listener = self._find_listener(obj_lbaas.LBaaSListener(
+                name="%s:%s:%s" % (name, protocol, port),
+                project_id=project_id,
+                loadbalancer_id=loadbalancer.id,
+                protocol=protocol,
+                port=port))
+            if not listener:
+                raise k_exc.ResourceNotReady(loadbalancer)
+            pool = self._find_pool(obj_lbaas.LBaaSPool(
+                name=listener.name,
+                project_id=project_id,
+                loadbalancer_id=loadbalancer.id,
+                listener_id=listener.id,
+                protocol=protocol))
+            if not pool:
+                raise k_exc.ResourceNotReady(loadbalancer)
+            members = [self._get_member_request(pool, subnet_id, target_ip,
+                                                target_port, target_ref)
+                       for (target_ip, target_port), target_ref
+                       in pool_targets.items()]
+            if members and not self._find_members(pool, members):
+                raise k_exc.ResourceNotReady(loadbalancer)
+
+            lbaas_state.listeners.append(listener)
+            lbaas_state.pools.append(pool)
+            lbaas_state.members.extend(members)
+
+        # TODO(ivc): handle security groups
+
+        return lbaas_state
+
     def release_loadbalancer(self, endpoints, loadbalancer):
         neutron = clients.get_neutron_client()
         self._release(loadbalancer, loadbalancer,
@@ -93,18 +199,33 @@ class LBaaSv2Driver(base.LBaaSDriver):
 
     def ensure_member(self, endpoints, loadbalancer, pool,
                       subnet_id, ip, port, target_ref):
-        name = "%(namespace)s/%(name)s" % target_ref
-        name += ":%s" % port
-        member = obj_lbaas.LBaaSMember(name=name,
-                                       project_id=pool.project_id,
-                                       pool_id=pool.id,
-                                       subnet_id=subnet_id,
-                                       ip=ip,
-                                       port=port)
+        member = self._get_member_request(pool, subnet_id, ip, port,
+                                          target_ref)
         return self._ensure_provisioned(loadbalancer, member,
                                         self._create_member,
                                         self._find_member)
 
+    def update_members(self, endpoints, loadbalancer, pool, subnet_id,
+                       members, targets):
+        if not oslo_cfg.CONF.lbaasv2.batch_member_update:
+            return super(LBaaSv2Driver, self).update_members(
+                endpoints, loadbalancer, pool, subnet_id, members, targets)
+
+        current_members = {(str(m.ip), m.port): m for m in members}
+        pool_members = []
+        for (ip, port), target_ref in targets.items():
+            member = current_members.get((ip, port))
+            if member is None:
+                member = self._get_member_request(pool, subnet_id, ip, port,
+                                                  target_ref)
+            pool_members.append(member)
+
+        LOG.debug("Replacing the %(current)d members of %(pool)s by "
+                  "%(num)d members", {'current': len(members), 'pool': pool,
+                                      'num': len(pool_members)})
+        self._ensure_members(loadbalancer, pool, pool_members)
+        return pool_members
+
     def release_member(self, endpoints, loadbalancer, member):
         neutron = clients.get_neutron_client()
         self._release(loadbalancer, member,
@@ -122,6 +243,47 @@ class LBaaSv2Driver(base.LBaaSDriver):
         loadbalancer.id = response['loadbalancer']['id']
         return loadbalancer
 
+    def _create_populated_loadbalancer(self, loadbalancer, subnet_id,
+                                       targets):
+        listeners = []
+        for (protocol, port), pool_targets in targets.items():
+            name = "%s:%s:%s" % (loadbalancer.name, protocol, port)
+            listeners.append({
+                'name': name,
+                'protocol': protocol,
+                'protocol_port': port,
+                'default_pool': {
+                    'name': name,
+                    'protocol': protocol,
+                    'lb_algorithm': _LB_ALGORITHM,
+                    'members': [
+                        {'name': "%s/%s:%s" % (target_ref['namespace'],
+                                               target_ref['name'],
+                                               target_port),
+                         'subnet_id': subnet_id,
+                         'address': target_ip,
+                         'protocol_port': target_port}
+                        for (target_ip, target_port), target_ref
+                        in pool_targets.items()]}})
+
+        neutron = clients.get_neutron_client()
+        try:
+            response = neutron.create_loadbalancer({'loadbalancer': {
+                'name': loadbalancer.name,
+                'project_id': loadbalancer.project_id,
+                'tenant_id': loadbalancer.project_id,
+                'vip_address': str(loadbalancer.ip),
+                'vip_subnet_id': loadbalancer.subnet_id,
+                'listeners': listeners}})
+        except n_exc.Conflict:
+            LOG.debug("Unable to create populated %(lb)s, as it already "
+                      "exists", {'lb': loadbalancer})
+            return None
+        loadbalancer.id = response['loadbalancer']['id']
+        LOG.debug("Created populated %(lb)s with %(num)d listeners",
+                  {'lb': loadbalancer, 'num': len(listeners)})
+        return loadbalancer
+
     def _find_loadbalancer(self, loadbalancer):
         neutron = clients.get_neutron_client()
         response = neutron.list_loadbalancers(
@@ -168,8 +330,7 @@ class LBaaSv2Driver(base.LBaaSDriver):
         return listener
 
     def _create_pool(self, pool):
-        # TODO(ivc): make lb_algorithm configurable
-        lb_algorithm = 'ROUND_ROBIN'
+        lb_algorithm = _LB_ALGORITHM
         neutron = clients.get_neutron_client()
         try:
             response = neutron.create_lbaas_pool({'pool': {
@@ -223,6 +384,16 @@ class LBaaSv2Driver(base.LBaaSDriver):
 
         return pool
 
+    def _get_member_request(self, pool, subnet_id, ip, port, target_ref):
+        name = "%(namespace)s/%(name)s" % target_ref
+        name += ":%s" % port
+        return obj_lbaas.LBaaSMember(name=name,
+                                     project_id=pool.project_id,
+                                     pool_id=pool.id,
+                                     subnet_id=subnet_id,
+                                     ip=ip,
+                                     port=port)
+
     def _create_member(self, member):
         neutron = clients.get_neutron_client()
         response = neutron.create_lbaas_member(member.pool_id, {'member': {
@@ -253,6 +424,48 @@ class LBaaSv2Driver(base.LBaaSDriver):
 
         return member
 
+    def _replace_members(self, pool, members):
+        neutron = clients.get_neutron_client()
+        neutron.put(neutron.lbaas_members_path % pool.id, body={'members': [
+            {'name': member.name,
+             'subnet_id': member.subnet_id,
+             'address': str(member.ip),
+             'protocol_port': member.port}
+            for member in members]})
+        return self._find_members(pool, members)
+
+    def _find_members(self, pool, members):
+        neutron = clients.get_neutron_client()
+        response = neutron.list_lbaas_members(pool.id)
+        member_ids = {(m['address'], m['protocol_port']): m['id']
+                      for m in response.get('members', [])}
+
+        try:
+            for member in members:
+                member.id = member_ids[str(member.ip), member.port]
+        except KeyError:
+            return None
+
+        return pool
+
+    def _ensure_members(self, loadbalancer, pool, members):
+        """Replaces the members of the pool once the LB is provisioned.
+
+        Unlike a creation, a replacement rejected with a Conflict (e.g., as
+        the load balancer is immutable) has not been applied, even if all
+        the members already exist, so it is retried instead.
+        """
+        for remaining in self._provisioning_timer(_ACTIVATION_TIMEOUT):
+            self._wait_for_provisioning(loadbalancer, remaining)
+            try:
+                if self._replace_members(pool, members):
+                    return
+            except (n_exc.Conflict, n_exc.StateInvalidClient):
+                LOG.debug("Members of %(pool)s not replaced, retrying",
+                          {'pool': pool})
+
+        raise k_exc.ResourceNotReady(pool)
+
     def _ensure(self, obj, create, find):
         try:
             result = create(obj)
@@ -289,23 +502,39 @@ class LBaaSv2Driver(base.LBaaSDriver):
         raise k_exc.ResourceNotReady(obj)
 
     def _wait_for_provisioning(self, loadbalancer, timeout):
-        neutron = clients.get_neutron_client()
-
-        for remaining in self._provisioning_timer(timeout):
-            response = neutron.show_loadbalancer(loadbalancer.id)
-            status = response['loadbalancer']['provisioning_status']
-            if status == 'ACTIVE':
-                LOG.debug("Provisioning complete for %(lb)s", {
-                    'lb': loadbalancer})
-                return
-            else:
-                LOG.debug("Provisioning status %(status)s for %(lb)s, "
-                          "%(rem).3gs remaining until timeout",
-                          {'status': status, 'lb': loadbalancer,
-                           'rem': remaining})
-
+        interval = oslo_cfg.CONF.lbaasv2.provisioning_poll_interval
+        with timeutils.StopWatch(duration=timeout) as timer:
+            while True:
+                status = self._provisioning_poller.wait(
+                    loadbalancer.id, ('ACTIVE',), timer.leftover())
+                if status == 'ACTIVE':
+                    LOG.debug("Provisioning complete for %(lb)s", {
+                        'lb': loadbalancer})
+                    return
+                if status is not None:
+                    break
+
+                # The load balancer was not listed (or could not be polled),
+                # so check whether it still exists, raising NotFound
+                # otherwise, and keep waiting for it
+                neutron = clients.get_neutron_client()
+                neutron.show_loadbalancer(loadbalancer.id)
+                if timer.expired():
+                    break
+                time.sleep(min(interval, timer.leftover()))
+
+        LOG.debug("Provisioning status %(status)s for %(lb)s after waiting "
+                  "%(timeout).3gs", {'status': status, 'lb': loadbalancer,
+                                     'timeout': timeout})
         raise k_exc.ResourceNotReady(loadbalancer)
 
+    def _get_loadbalancers_status(self, loadbalancer_ids):
+        neutron = clients.get_neutron_client()
+        loadbalancers = d_utils.list_by_ids(
+            neutron.list_loadbalancers, 'loadbalancers', loadbalancer_ids,
+            ['id', 'provisioning_status'])
+        return {lb['id']: lb['provisioning_status'] for lb in loadbalancers}
+
     def _provisioning_timer(self, timeout):
         # REVISIT(ivc): consider integrating with Retry
         interval = 3
@@ -12,24 +12,39 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import threading
-
+from kuryr.lib import constants as kl_const
+from kuryr.lib import exceptions as kl_exc
 from neutronclient.common import exceptions as n_exc
 from oslo_log import log as logging
 
 from kuryr_kubernetes import clients
 from kuryr_kubernetes.controller.drivers import nested_vif
+from kuryr_kubernetes.controller.drivers import utils as d_utils
 from kuryr_kubernetes import exceptions as k_exc
 from kuryr_kubernetes import os_vif_util as ovu
 
 LOG = logging.getLogger(__name__)
 
+# Seconds the allowed address pairs updates of a VM port are batched for
+ADDRESS_PAIRS_BATCH_WINDOW = 0.005
+_ADD = 'add'
+_REMOVE = 'remove'
+
 
 class NestedMacvlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
-    """Manages ports for nested-containers using MACVLAN to provide VIFs."""
+    """Manages ports for nested-containers using MACVLAN to provide VIFs.
+
+    The containers ports addresses are added to (and removed from) the
+    allowed address pairs of the VM port through _address_pairs_updater,
+    which serializes the updates of each VM port and merges the ones made
+    concurrently into a single read-modify-write of the port.
+    """
 
     def __init__(self):
-        self.lock = threading.Lock()
+        super(NestedMacvlanPodVIFDriver, self).__init__()
+        self._address_pairs_updater = d_utils.RequestsCoalescer(
+            'allowed_address_pairs', self._send_address_pairs_updates,
+            window=ADDRESS_PAIRS_BATCH_WINDOW)
 
     def request_vif(self, pod, project_id, subnets, security_groups):
         neutron = clients.get_neutron_client()
@@ -37,35 +52,58 @@ class NestedMacvlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
                                      security_groups)
         container_port = neutron.create_port(req).get('port')
 
-        container_mac = container_port['mac_address']
-        container_ips = frozenset(entry['ip_address'] for entry in
-                                  container_port['fixed_ips'])
-
-        with self.lock:
-            vm_port = self._get_parent_port(neutron, pod)
-            self._add_to_allowed_address_pairs(neutron, vm_port,
-                                               container_ips, container_mac)
+        self._address_pairs_updater.submit(
+            pod['status']['hostIP'],
+            (_ADD, self._get_address_pairs(container_port)))
 
         return ovu.neutron_to_osvif_vif_nested_macvlan(container_port, subnets)
 
     def request_vifs(self, pod, project_id, subnets, security_groups,
-                     num_ports):
-        # TODO(mchiappe): provide an implementation
-        raise NotImplementedError()
+                     num_ports, trunk_ip=None):
+        """Creates num_ports ports and returns a list with their vifs.
+
+        The ports are created in a single bulk request, and all their
+        addresses are added to the allowed address pairs of the VM port with
+        a single update. If that update fails, the created ports are deleted
+        and the exception is raised.
+        """
+        neutron = clients.get_neutron_client()
+        host_addr = trunk_ip if trunk_ip else pod['status']['hostIP']
+        port_rq = self._get_port_request(pod, project_id, subnets,
+                                         security_groups, unbound=True)
+        bulk_port_rq = {'ports': [port_rq['port'] for _ in range(num_ports)]}
+        try:
+            ports = neutron.create_port(bulk_port_rq).get('ports')
+        except n_exc.NeutronClientException as ex:
+            LOG.error("Error creating bulk ports: %s", bulk_port_rq)
+            raise ex
+
+        address_pairs = []
+        for port in ports:
+            address_pairs.extend(self._get_address_pairs(port))
+        try:
+            self._address_pairs_updater.submit(host_addr,
+                                               (_ADD, address_pairs))
+        except Exception:
+            LOG.error("Error adding the ports to the allowed address pairs "
+                      "of the VM port with IP %s", host_addr)
+            for port in ports:
+                try:
+                    neutron.delete_port(port['id'])
+                except n_exc.NeutronClientException:
+                    LOG.warning("Unable to delete port %s", port['id'])
+            raise
+
+        return [ovu.neutron_to_osvif_vif_nested_macvlan(port, subnets)
+                for port in ports]
 
     def release_vif(self, pod, vif):
         neutron = clients.get_neutron_client()
         container_port = neutron.show_port(vif.id).get('port')
 
-        container_mac = container_port['mac_address']
-        container_ips = frozenset(entry['ip_address'] for entry in
-                                  container_port['fixed_ips'])
-
-        with self.lock:
-            vm_port = self._get_parent_port(neutron, pod)
-            self._remove_from_allowed_address_pairs(neutron, vm_port,
-                                                    container_ips,
-                                                    container_mac)
+        self._address_pairs_updater.submit(
+            pod['status']['hostIP'],
+            (_REMOVE, self._get_address_pairs(container_port)))
 
         try:
             neutron.delete_port(vif.id)
@@ -81,21 +119,116 @@ class NestedMacvlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
         # immediately to let the CNI driver make progress.
         vif.active = True
 
-    def _add_to_allowed_address_pairs(self, neutron, port, ip_addresses,
-                                      mac_address=None):
-        if not ip_addresses:
+    def _get_port_request(self, pod, project_id, subnets, security_groups,
+                          unbound=False):
+        if not unbound:
+            return super(NestedMacvlanPodVIFDriver, self)._get_port_request(
+                pod, project_id, subnets, security_groups)
+
+        # The pool ports are not bound to any pod nor host, and they may be
+        # requested without a pod, e.g., by force_populate_pool
+        port_req_body = {'project_id': project_id,
+                         'name': 'available-port',
+                         'network_id': self._get_network_id(subnets),
+                         'fixed_ips': ovu.osvif_to_neutron_fixed_ips(subnets),
+                         'device_owner': kl_const.DEVICE_OWNER,
+                         'admin_state_up': True}
+        if security_groups:
+            port_req_body['security_groups'] = security_groups
+
+        return {'port': port_req_body}
+
+    def _detach_vifs(self, neutron, host_addr, vifs):
+        address_pairs = [{'ip_address': str(ip.address),
+                          'mac_address': str(vif.address)}
+                         for vif in vifs
+                         for subnet in vif.network.subnets.objects
+                         for ip in subnet.ips.objects]
+        try:
+            self._address_pairs_updater.submit(host_addr,
+                                               (_REMOVE, address_pairs))
+        except (kl_exc.NoResourceException, n_exc.PortNotFoundClient):
+            LOG.debug('The VM port with IP %s no longer exists, its ports '
+                      'are already detached.', host_addr)
+
+    def _get_attached_vifs(self, neutron, ports, subnets):
+        self._load_parent_ports(neutron)
+        hosts = {}
+        for host_addr, vm_port in self._parent_ports.items():
+            for pair in vm_port.get('allowed_address_pairs', []):
+                hosts[(pair['ip_address'], pair['mac_address'])] = host_addr
+
+        attached_vifs = {}
+        for port in ports:
+            pair = self._get_address_pairs(port)[0]
+            host_addr = hosts.get((pair['ip_address'], pair['mac_address']))
+            if not host_addr:
+                continue
+            vif = ovu.neutron_to_osvif_vif_nested_macvlan(
+                port, self._get_port_subnets(port, subnets))
+            attached_vifs.setdefault(host_addr, []).append((port, vif))
+        return attached_vifs
+
+    def _get_current_parent_port(self, neutron, node_fixed_ip):
+        """Returns the up to date parent port of the given node.
+
+        The cached parent port only provides the port id, as its allowed
+        address pairs may be outdated.
+        """
+        vm_port = self._get_parent_port_by_host_ip(neutron, node_fixed_ip)
+        try:
+            return neutron.show_port(vm_port['id']).get('port')
+        except n_exc.PortNotFoundClient:
+            # The cached port no longer exists, e.g., the VM got replaced
+            self._invalidate_parent_port(node_fixed_ip)
+            vm_port = self._get_parent_port_by_host_ip(neutron,
+                                                       node_fixed_ip)
+            return neutron.show_port(vm_port['id']).get('port')
+
+    @staticmethod
+    def _get_address_pairs(port):
+        return [{'ip_address': entry['ip_address'],
+                 'mac_address': port['mac_address']}
+                for entry in port['fixed_ips']]
+
+    def _send_address_pairs_updates(self, host_addr, updates):
+        """Applies the given updates to the VM port with a single request.
+
+        :param host_addr: IP of the VM port on the worker nodes subnet
+        :param updates: list of (action, address_pairs) tuples, where action
+                        is either 'add' or 'remove', in the order they have
+                        to be applied
+        """
+        neutron = clients.get_neutron_client()
+        vm_port = self._get_current_parent_port(neutron, host_addr)
+        updated = False
+        for action, address_pairs in updates:
+            if action == _ADD:
+                self._add_address_pairs(vm_port, address_pairs)
+                updated = True
+            else:
+                updated |= self._remove_address_pairs(vm_port, address_pairs)
+
+        if updated:
+            self._update_port_address_pairs(
+                neutron, vm_port['id'], vm_port['allowed_address_pairs'])
+        return [None] * len(updates)
+
+    def _add_address_pairs(self, port, new_pairs):
+        if not new_pairs:
             raise k_exc.IntegrityError(
                 "Cannot add pair from the "
                 "allowed_address_pairs of port %s: missing IP address",
                 port['id'])
 
-        mac = mac_address if mac_address else port['mac_address']
         address_pairs = port['allowed_address_pairs']
 
         # look for duplicates or near-matches
+        new_macs = {pair['ip_address']: pair['mac_address']
+                    for pair in new_pairs}
         for pair in address_pairs:
-            if pair['ip_address'] in ip_addresses:
-                if pair['mac_address'] is mac:
+            if pair['ip_address'] in new_macs:
+                if pair['mac_address'] == new_macs[pair['ip_address']]:
                     raise k_exc.AllowedAddressAlreadyPresent(
                         "Pair %s already "
                         "present in the 'allowed_address_pair' list. This is "
@@ -107,34 +240,28 @@ class NestedMacvlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
                         "This could indicate a misconfiguration or a "
                         "bug", pair['ip_address'])
 
-        for ip in ip_addresses:
-            address_pairs.append({'ip_address': ip, 'mac_address': mac})
-
-        self._update_port_address_pairs(neutron, port['id'], address_pairs)
+        address_pairs.extend(new_pairs)
 
-    def _remove_from_allowed_address_pairs(self, neutron, port, ip_addresses,
-                                           mac_address=None):
-        if not ip_addresses:
+    def _remove_address_pairs(self, port, old_pairs):
+        if not old_pairs:
             raise k_exc.IntegrityError(
                 "Cannot remove pair from the "
                 "allowed_address_pairs of port %s: missing IP address",
                 port['id'])
 
-        mac = mac_address if mac_address else port['mac_address']
         address_pairs = port['allowed_address_pairs']
         updated = False
 
-        for ip in ip_addresses:
+        for pair in old_pairs:
             try:
-                address_pairs.remove({'ip_address': ip, 'mac_address': mac})
+                address_pairs.remove(pair)
                 updated = True
             except ValueError:
                 LOG.error("No {'ip_address': %s, 'mac_address': %s} pair "
                           "found in the 'allowed_address_pair' list while "
-                          "trying to remove it.", ip, mac)
-
-        if updated:
-            self._update_port_address_pairs(neutron, port['id'], address_pairs)
+                          "trying to remove it.", pair['ip_address'],
+                          pair['mac_address'])
+        return updated
 
     def _update_port_address_pairs(self, neutron, port_id, address_pairs):
         try:
@@ -14,6 +14,7 @@
 
 import abc
 import six
+import time
 
 from kuryr.lib._i18n import _
 from kuryr.lib import exceptions as kl_exc
@@ -35,32 +36,73 @@ nested_vif_driver_opts = [
 
 oslo_cfg.CONF.register_opts(nested_vif_driver_opts, "pod_vif_nested")
 
+# Seconds during which an IP not found on the worker nodes subnet is reported
+# as missing without reloading the parent ports again
+PARENT_PORT_MISS_TTL = 10
+
 
 @six.add_metaclass(abc.ABCMeta)
 class NestedPodVIFDriver(neutron_vif.NeutronPodVIFDriver):
-    """Skeletal handler driver for VIFs for Nested Pods."""
+    """Skeletal handler driver for VIFs for Nested Pods.
+
+    The parent ports of the worker node VMs are cached at _parent_ports,
+    a dictionary shared by all the nested drivers whose keys are the VMs IPs
+    on the worker nodes subnet and whose values are the parent ports. It is
+    loaded with all the ports of that subnet in a single request, and
+    reloaded whenever an IP is not found on it, unless that IP was already
+    missing after a reload in the last PARENT_PORT_MISS_TTL seconds, as
+    kept at _missing_parent_ports. As the cached ports may be outdated, only
+    their immutable information (e.g., ids and trunk details) should be
+    used, and the entries found to be outdated have to be invalidated.
+    """
+    _parent_ports = {}
+    _missing_parent_ports = {}
 
     def _get_parent_port_by_host_ip(self, neutron, node_fixed_ip):
+        node_fixed_ip = str(node_fixed_ip)
+        parent_port = self._parent_ports.get(node_fixed_ip)
+        if parent_port:
+            return parent_port
+
+        missing_since = self._missing_parent_ports.get(node_fixed_ip, 0)
+        if time.time() - missing_since >= PARENT_PORT_MISS_TTL:
+            self._load_parent_ports(neutron)
+            try:
+                return self._parent_ports[node_fixed_ip]
+            except KeyError:
+                self._missing_parent_ports[node_fixed_ip] = time.time()
+        LOG.error("Neutron port for vm port with fixed ip %s"
+                  " not found!", node_fixed_ip)
+        raise kl_exc.NoResourceException
+
+    def _load_parent_ports(self, neutron):
         node_subnet_id = oslo_cfg.CONF.pod_vif_nested.worker_nodes_subnet
         if not node_subnet_id:
             raise oslo_cfg.RequiredOptError(
                 'worker_nodes_subnet', oslo_cfg.OptGroup('pod_vif_nested'))
 
         try:
-            fixed_ips = ['subnet_id=%s' % str(node_subnet_id),
-                         'ip_address=%s' % str(node_fixed_ip)]
+            fixed_ips = ['subnet_id=%s' % str(node_subnet_id)]
             ports = neutron.list_ports(fixed_ips=fixed_ips)
         except n_exc.NeutronClientException as ex:
-            LOG.error("Parent vm port with fixed ips %s not found!",
+            LOG.error("Parent vm ports with fixed ips %s not found!",
                       fixed_ips)
             raise ex
 
-        if ports['ports']:
-            return ports['ports'][0]
-        else:
-            LOG.error("Neutron port for vm port with fixed ips %s"
-                      " not found!", fixed_ips)
-            raise kl_exc.NoResourceException
+        parent_ports = {}
+        for port in ports['ports']:
+            for fixed_ip in port['fixed_ips']:
+                if fixed_ip['subnet_id'] == node_subnet_id:
+                    parent_ports[fixed_ip['ip_address']] = port
+        self._parent_ports.clear()
+        self._parent_ports.update(parent_ports)
+        for node_fixed_ip in parent_ports:
+            self._missing_parent_ports.pop(node_fixed_ip, None)
+
+    def _invalidate_parent_port(self, node_fixed_ip):
+        """Drops the cached parent port of the given node, if any."""
+        self._parent_ports.pop(str(node_fixed_ip), None)
+        self._missing_parent_ports.pop(str(node_fixed_ip), None)
 
     def _get_parent_port(self, neutron, pod):
         try:
@@ -74,3 +116,39 @@ class NestedPodVIFDriver(neutron_vif.NeutronPodVIFDriver):
             LOG.error("Failed to get parent vm port ip")
             raise
         return self._get_parent_port_by_host_ip(neutron, node_fixed_ip)
+
+    @abc.abstractmethod
+    def _detach_vifs(self, neutron, host_addr, vifs):
+        """Detaches the VIFs from the VM they were requested for.
+
+        It is used by the ports pool before deleting its ports, and it does
+        not delete them. If the VM (or its trunk) no longer exists, the VIFs
+        are already detached and no exception is raised.
+
+        :param neutron: Neutron client
+        :param host_addr: IP of the VM parent port on the worker nodes subnet
+        :param vifs: list of VIF objects of the ports to detach
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def _get_attached_vifs(self, neutron, ports, subnets):
+        """Finds the VMs the given ports are attached to.
+
+        It is used by the ports pool to recover or free the ports created on
+        previous runs.
+
+        :param neutron: Neutron client
+        :param ports: list of Neutron port dicts
+        :param subnets: dict with the os-vif Network objects of the ports
+                        subnets, keyed by subnet id
+        :returns: dict with the list of (port, VIF object) tuples of the
+                  ports attached to each VM, keyed by the IP of the VM parent
+                  port. The ports not attached to any VM are left out.
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    def _get_port_subnets(port, subnets):
+        subnet_id = port['fixed_ips'][0]['subnet_id']
+        return {subnet_id: subnets[subnet_id]}
@@ -11,16 +11,17 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
-from time import sleep
+import random
+import threading
 
 from kuryr.lib import constants as kl_const
 from kuryr.lib import exceptions as kl_exc
-from kuryr.lib import segmentation_type_drivers as seg_driver
 from neutronclient.common import exceptions as n_exc
 from oslo_log import log as logging
 
 from kuryr_kubernetes import clients
 from kuryr_kubernetes.controller.drivers import nested_vif
+from kuryr_kubernetes.controller.drivers import utils as d_utils
 from kuryr_kubernetes import exceptions as k_exc
 from kuryr_kubernetes import os_vif_util as ovu
 
@@ -28,25 +29,133 @@ from kuryr_kubernetes import os_vif_util as ovu
 LOG = logging.getLogger(__name__)
 
 DEFAULT_MAX_RETRY_COUNT = 3
-DEFAULT_RETRY_INTERVAL = 1
+# Seconds the subports to attach to (or detach from) a trunk are batched for
+SUBPORTS_BATCH_WINDOW = 0.005
+
+# VLAN ids 0 and 4095 are reserved and never allocated
+_VLAN_IDS_MASK = (1 << (kl_const.MAX_VLAN_TAG + 2)) - 1
+_RESERVED_VLAN_IDS = 1 | 1 << (kl_const.MAX_VLAN_TAG + 1)
+
+
+class VlanIdAllocator(object):
+    """Keeps track of the VLAN ids in use at a trunk port.
+
+    The VLAN ids are kept as a bitmap, stored in an integer where the bit N
+    is set if the VLAN id N is in use. The operations do not yield, so they
+    are atomic with regard to other greenthreads.
+    """
+
+    def __init__(self, in_use_ids=()):
+        self._bitmap = _RESERVED_VLAN_IDS
+        self.update(in_use_ids)
+
+    def update(self, in_use_ids):
+        """Marks the given VLAN ids as in use."""
+        for vlan_id in in_use_ids:
+            self._bitmap |= 1 << vlan_id
+
+    def allocate(self):
+        free = ~self._bitmap & _VLAN_IDS_MASK
+        if not free:
+            raise kl_exc.SegmentationIdAllocationFailure
+        # Look for a free id starting from a random one, so that several
+        # controllers allocating ids at the same trunk are unlikely to pick
+        # the same ones
+        start = random.randint(kl_const.MIN_VLAN_TAG, kl_const.MAX_VLAN_TAG)
+        candidates = free >> start
+        if candidates:
+            vlan_id = start + self._lowest_bit(candidates)
+        else:
+            vlan_id = self._lowest_bit(free)
+        self._bitmap |= 1 << vlan_id
+        return vlan_id
+
+    def release(self, vlan_id):
+        self._bitmap &= ~(1 << vlan_id)
+
+    def is_in_use(self, vlan_id):
+        return bool(self._bitmap & 1 << vlan_id)
+
+    @staticmethod
+    def _lowest_bit(bitmap):
+        return (bitmap & -bitmap).bit_length() - 1
 
 
 class NestedVlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
-    """Manages ports for nested-containers using VLANs to provide VIFs."""
+    """Manages ports for nested-containers using VLANs to provide VIFs.
+
+    The VLAN ids in use at each trunk port are tracked in memory by a
+    VlanIdAllocator, kept at _vlan_ids_allocators by trunk id. Each allocator
+    is seeded from Neutron the first time the trunk is used, and resynced
+    with it when Neutron reports a VLAN id conflict, e.g., due to another
+    controller using the same trunk.
+
+    The subports attached and detached by request_vif and release_vif are
+    sent to Neutron in per trunk batches, as the trunk is locked by Neutron
+    on each subports update.
+
+    As the parent ports are cached, the trunk of a VM may be outdated, e.g.,
+    if the VM got rebuilt with the same IP, or if its trunk got created
+    after its port was cached. Thus, the ports requests that find the trunk
+    missing are retried once with the parent port reloaded.
+    """
+    _vlan_ids_allocators = {}
+    _vlan_ids_lock = threading.Lock()
+
+    def __init__(self):
+        super(NestedVlanPodVIFDriver, self).__init__()
+        self._subports_adder = d_utils.RequestsCoalescer(
+            'trunk_add_subports', self._send_add_subports,
+            window=SUBPORTS_BATCH_WINDOW)
+        self._subports_remover = d_utils.RequestsCoalescer(
+            'trunk_remove_subports', self._send_remove_subports,
+            window=SUBPORTS_BATCH_WINDOW)
 
     def request_vif(self, pod, project_id, subnets, security_groups):
+        return self._retry_on_stale_trunk(
+            pod['status'].get('hostIP'), self._request_vif, pod, project_id,
+            subnets, security_groups)
+
+    def request_vifs(self, pod, project_id, subnets, security_groups,
+                     num_ports, trunk_ip=None):
+        host_addr = trunk_ip if trunk_ip else pod['status'].get('hostIP')
+        return self._retry_on_stale_trunk(
+            host_addr, self._request_vifs, pod, project_id, subnets,
+            security_groups, num_ports, trunk_ip=trunk_ip)
+
+    def _retry_on_stale_trunk(self, host_addr, func, *args, **kwargs):
+        """Calls func, retrying it once if the trunk of the VM is missing.
+
+        The trunk is missing if the parent port has no trunk details or if
+        the trunk is not found. As that may be due to the cached parent port
+        being outdated, it is invalidated before retrying.
+        """
+        try:
+            return func(*args, **kwargs)
+        except (k_exc.K8sNodeTrunkPortFailure, n_exc.NotFound):
+            LOG.info("Trunk of the VM with IP %s not found, retrying with "
+                     "its parent port reloaded.", host_addr)
+            self._invalidate_parent_port(host_addr)
+            return func(*args, **kwargs)
+
+    def _request_vif(self, pod, project_id, subnets, security_groups):
         neutron = clients.get_neutron_client()
         parent_port = self._get_parent_port(neutron, pod)
         trunk_id = self._get_trunk_id(parent_port)
 
         rq = self._get_port_request(pod, project_id, subnets, security_groups)
         port = neutron.create_port(rq).get('port')
-        vlan_id = self._add_subport(neutron, trunk_id, port['id'])
+        try:
+            vlan_id = self._add_subport(neutron, trunk_id, port['id'])
+        except n_exc.NotFound:
+            self._vlan_ids_allocators.pop(trunk_id, None)
+            neutron.delete_port(port['id'])
+            raise
 
         return ovu.neutron_to_osvif_vif_nested_vlan(port, subnets, vlan_id)
 
-    def request_vifs(self, pod, project_id, subnets, security_groups,
-                     num_ports, trunk_ip=None):
+    def _request_vifs(self, pod, project_id, subnets, security_groups,
+                      num_ports, trunk_ip=None):
         """This method creates subports and returns a list with their vifs.
 
         It creates up to num_ports subports and attaches them to the trunk
@@ -75,26 +184,36 @@ class NestedVlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
             LOG.error("There are no vlan ids available to create subports")
             return []
 
+        vlan_ids = [info['segmentation_id'] for info in subports_info]
         bulk_port_rq = {'ports': [port_rq for _ in range(len(subports_info))]}
         try:
             ports = neutron.create_port(bulk_port_rq).get('ports')
         except n_exc.NeutronClientException as ex:
             LOG.error("Error creating bulk ports: %s", bulk_port_rq)
+            self._release_vlan_ids(trunk_id, vlan_ids)
             raise ex
         for index, port in enumerate(ports):
             subports_info[index]['port_id'] = port['id']
 
         try:
-            try:
-                neutron.trunk_add_subports(trunk_id,
-                                           {'sub_ports': subports_info})
-            except n_exc.Conflict as ex:
-                LOG.error("vlan ids already in use on trunk")
-                for port in ports:
-                    neutron.delete_port(port['id'])
-                raise ex
+            neutron.trunk_add_subports(trunk_id,
+                                       {'sub_ports': subports_info})
+        except n_exc.Conflict as ex:
+            LOG.error("vlan ids already in use on trunk")
+            for port in ports:
+                neutron.delete_port(port['id'])
+            self._release_vlan_ids(trunk_id, vlan_ids)
+            self._resync_vlan_ids(trunk_id)
+            raise ex
+        except n_exc.NotFound:
+            LOG.error("Trunk %s not found", trunk_id)
+            for port in ports:
+                neutron.delete_port(port['id'])
+            self._vlan_ids_allocators.pop(trunk_id, None)
+            raise
         except n_exc.NeutronClientException as ex:
             LOG.error("Error happened during subport addition to trunk")
+            self._release_vlan_ids(trunk_id, vlan_ids)
             raise ex
 
         vifs = []
@@ -109,13 +228,65 @@ class NestedVlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
         parent_port = self._get_parent_port(neutron, pod)
         trunk_id = self._get_trunk_id(parent_port)
         self._remove_subport(neutron, trunk_id, vif.id)
-        self._release_vlan_id(vif.vlan_id)
+        self._release_vlan_id(trunk_id, vif.vlan_id)
         try:
             neutron.delete_port(vif.id)
         except n_exc.PortNotFoundClient:
             LOG.debug('Unable to release port %s as it no longer exists.',
                       vif.id)
 
+    def _detach_vifs(self, neutron, host_addr, vifs):
+        try:
+            parent_port = self._get_parent_port_by_host_ip(neutron, host_addr)
+            trunk_id = self._get_trunk_id(parent_port)
+        except (kl_exc.NoResourceException, k_exc.K8sNodeTrunkPortFailure):
+            LOG.debug('The VM with IP %s has no trunk, its subports are '
+                      'already detached.', host_addr)
+            self._invalidate_parent_port(host_addr)
+            return
+        try:
+            self._remove_subports(neutron, trunk_id,
+                                  [vif.id for vif in vifs])
+        except n_exc.NotFound:
+            LOG.debug('Trunk %s no longer exists, its subports are already '
+                      'detached.', trunk_id)
+            self._vlan_ids_allocators.pop(trunk_id, None)
+            self._invalidate_parent_port(host_addr)
+            return
+        except n_exc.NeutronClientException:
+            # Fall back to removing them one by one, so that a single stale
+            # subport does not prevent removing the rest of them
+            for vif in vifs:
+                try:
+                    self._remove_subport(neutron, trunk_id, vif.id)
+                except n_exc.NeutronClientException:
+                    LOG.debug('Unable to remove subport %s from trunk %s.',
+                              vif.id, trunk_id)
+        self._release_vlan_ids(trunk_id, [vif.vlan_id for vif in vifs])
+
+    def _get_attached_vifs(self, neutron, ports, subnets):
+        ports = {port['id']: port for port in ports}
+        self._load_parent_ports(neutron)
+        hosts = {parent_port['id']: host_addr
+                 for host_addr, parent_port in self._parent_ports.items()}
+
+        attached_vifs = {}
+        for trunk in neutron.list_trunks().get('trunks'):
+            host_addr = hosts.get(trunk['port_id'])
+            if not host_addr:
+                LOG.debug('Unable to find parent port for trunk port %s.',
+                          trunk['port_id'])
+                continue
+            for subport in trunk.get('sub_ports'):
+                port = ports.get(subport['port_id'])
+                if not port:
+                    continue
+                vif = ovu.neutron_to_osvif_vif_nested_vlan(
+                    port, self._get_port_subnets(port, subnets),
+                    subport['segmentation_id'])
+                attached_vifs.setdefault(host_addr, []).append((port, vif))
+        return attached_vifs
+
     def _get_port_request(self, pod, project_id, subnets, security_groups,
                           unbound=False):
         port_req_body = {'project_id': project_id,
@@ -139,17 +310,15 @@ class NestedVlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
                               unbound=False):
         subports_info = []
 
-        in_use_vlan_ids = self._get_in_use_vlan_ids_set(trunk_id)
         port_rq = self._get_port_request(pod, project_id, subnets,
                                          security_groups, unbound)['port']
         for i in range(num_ports):
             try:
-                vlan_id = seg_driver.allocate_segmentation_id(in_use_vlan_ids)
+                vlan_id = self._get_vlan_id(trunk_id)
             except kl_exc.SegmentationIdAllocationFailure:
                 LOG.warning("There is not enough vlan ids available to "
                             "create a batch of %d subports.", num_ports)
                 break
-            in_use_vlan_ids.add(vlan_id)
 
             subports_info.append({'segmentation_id': vlan_id,
                                   'port_id': '',
@@ -168,14 +337,13 @@ class NestedVlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
     def _add_subport(self, neutron, trunk_id, subport):
         """Adds subport port to Neutron trunk
 
-        This method gets vlanid allocated from kuryr segmentation driver.
-        In active/active HA type deployment, possibility of vlanid conflict
-        is there. In such a case, vlanid will be requested again and subport
-        addition is re-tried. This is tried DEFAULT_MAX_RETRY_COUNT times in
-        case of vlanid conflict.
+        This method gets a vlanid allocated from the trunk's VLAN ids
+        allocator. In active/active HA type deployment, possibility of vlanid
+        conflict is there. In such a case, the allocator is resynced with
+        Neutron and subport addition is re-tried right away with another
+        vlanid. This is tried DEFAULT_MAX_RETRY_COUNT times in case of vlanid
+        conflict.
         """
-        # TODO(vikasc): Better approach for retrying in case of
-        # vlan-id conflict.
         retry_count = 1
         while True:
             try:
@@ -184,18 +352,18 @@ class NestedVlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
                 LOG.error("Getting VlanID for subport on "
                           "trunk %s failed!!", trunk_id)
                 raise ex
-            subport = [{'segmentation_id': vlan_id,
-                        'port_id': subport,
-                       'segmentation_type': 'vlan'}]
+            subport_info = {'segmentation_id': vlan_id,
+                            'port_id': subport,
+                            'segmentation_type': 'vlan'}
             try:
-                neutron.trunk_add_subports(trunk_id,
-                                           {'sub_ports': subport})
+                self._subports_adder.submit(trunk_id, subport_info)
             except n_exc.Conflict as ex:
+                self._release_vlan_id(trunk_id, vlan_id)
+                self._resync_vlan_ids(trunk_id)
                 if retry_count < DEFAULT_MAX_RETRY_COUNT:
                     LOG.error("vlanid already in use on trunk, "
                               "%s. Retrying...", trunk_id)
                     retry_count += 1
-                    sleep(DEFAULT_RETRY_INTERVAL)
                     continue
                 else:
                     LOG.error(
@@ -205,26 +373,70 @@ class NestedVlanPodVIFDriver(nested_vif.NestedPodVIFDriver):
             except n_exc.NeutronClientException as ex:
                 LOG.error("Error happened during subport"
                           "addition to trunk, %s", trunk_id)
+                self._release_vlan_id(trunk_id, vlan_id)
                 raise ex
             return vlan_id
 
+    def _send_add_subports(self, trunk_id, subports_info):
+        neutron = clients.get_neutron_client()
+        neutron.trunk_add_subports(trunk_id, {'sub_ports': subports_info})
+        return [None] * len(subports_info)
+
     def _remove_subport(self, neutron, trunk_id, subport_id):
-        subport_id = [{'port_id': subport_id}]
+        self._subports_remover.submit(trunk_id, subport_id)
+
+    def _send_remove_subports(self, trunk_id, subports_id):
+        neutron = clients.get_neutron_client()
+        self._remove_subports(neutron, trunk_id, subports_id)
+        return [None] * len(subports_id)
+
+    def _remove_subports(self, neutron, trunk_id, subports_id):
+        subports_body = [{'port_id': subport_id}
+                         for subport_id in subports_id]
         try:
             neutron.trunk_remove_subports(trunk_id,
-                                          {'sub_ports': subport_id})
+                                          {'sub_ports': subports_body})
         except n_exc.NeutronClientException as ex:
             LOG.error(
                 "Error happened during subport removal from "
                 "trunk, %s", trunk_id)
             raise ex
 
+    def _get_vlan_ids_allocator(self, trunk_id):
+        with self._vlan_ids_lock:
+            allocator = self._vlan_ids_allocators.get(trunk_id)
+            if not allocator:
+                allocator = VlanIdAllocator(
+                    self._get_in_use_vlan_ids_set(trunk_id))
+                self._vlan_ids_allocators[trunk_id] = allocator
+            return allocator
+
     def _get_vlan_id(self, trunk_id):
-        vlan_ids = self._get_in_use_vlan_ids_set(trunk_id)
-        return seg_driver.allocate_segmentation_id(vlan_ids)
+        return self._get_vlan_ids_allocator(trunk_id).allocate()
+
+    def _release_vlan_id(self, trunk_id, vlan_id):
+        self._release_vlan_ids(trunk_id, [vlan_id])
 
-    def _release_vlan_id(self, id):
-        return seg_driver.release_segmentation_id(id)
+    def _release_vlan_ids(self, trunk_id, vlan_ids):
+        allocator = self._vlan_ids_allocators.get(trunk_id)
+        if allocator:
+            for vlan_id in vlan_ids:
+                allocator.release(vlan_id)
+
+    def _resync_vlan_ids(self, trunk_id):
+        """Marks as in use the VLAN ids Neutron reports in use at the trunk.
+
+        The ids allocated locally and not yet known by Neutron are kept, as
+        their subports may be in the process of being added.
+        """
+        try:
+            in_use_vlan_ids = self._get_in_use_vlan_ids_set(trunk_id)
+        except n_exc.NeutronClientException:
+            LOG.warning("Unable to resync the VLAN ids of trunk %s, it will "
+                        "be seeded again on its next use.", trunk_id)
+            self._vlan_ids_allocators.pop(trunk_id, None)
+            return
+        self._get_vlan_ids_allocator(trunk_id).update(in_use_vlan_ids)
 
     def _get_in_use_vlan_ids_set(self, trunk_id):
         vlan_ids = set()
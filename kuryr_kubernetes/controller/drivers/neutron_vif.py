@@ -13,28 +13,81 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from kuryr.lib._i18n import _
 from kuryr.lib import constants as kl_const
 from neutronclient.common import exceptions as n_exc
+from oslo_config import cfg as oslo_cfg
 from oslo_log import log as logging
 
 from kuryr_kubernetes import clients
 from kuryr_kubernetes.controller.drivers import base
+from kuryr_kubernetes.controller.drivers import utils as d_utils
 from kuryr_kubernetes import exceptions as k_exc
 from kuryr_kubernetes import os_vif_util as ovu
 
 
 LOG = logging.getLogger(__name__)
 
+neutron_vif_driver_opts = [
+    oslo_cfg.FloatOpt('port_activation_poll_interval',
+                      help=_("Interval (in seconds) between the status "
+                             "checks of the ports waiting to become ACTIVE"),
+                      min=0.1,
+                      default=0.5),
+    oslo_cfg.IntOpt('port_activation_timeout',
+                    help=_("Time (in seconds) to wait for a pod port to "
+                           "become ACTIVE before retrying the pod event"),
+                    min=1,
+                    default=20),
+    oslo_cfg.FloatOpt('port_creation_batch_window',
+                      help=_("Time (in seconds) the ports requested at the "
+                             "same time for pods of the same host, project "
+                             "and security groups are collected for, to "
+                             "create them with a single bulk request. 0 to "
+                             "create each port on its own request"),
+                      min=0,
+                      default=0),
+]
+
+oslo_cfg.CONF.register_opts(neutron_vif_driver_opts, "pod_vif_neutron")
+
 
 class NeutronPodVIFDriver(base.PodVIFDriver):
-    """Manages normal Neutron ports to provide VIFs for Kubernetes Pods."""
+    """Manages normal Neutron ports to provide VIFs for Kubernetes Pods.
+
+    The ports being activated are waited for through _activation_poller,
+    which checks the status of all of them with a single list_ports request
+    every `port_activation_poll_interval` seconds, so that each port is
+    activated as soon as it becomes ACTIVE.
+
+    The vif plugin of the ports bound to each host is cached at
+    _vif_plugins, keyed by the 'binding:host_id' of the ports.
+
+    If `port_creation_batch_window` is set, the ports requested concurrently
+    by request_vif are created in bulk through _ports_creator, grouped by
+    host, project, network and security groups.
+    """
+
+    def __init__(self):
+        self._activation_poller = d_utils.StatusPoller(
+            'port_activation', self._get_ports_status,
+            oslo_cfg.CONF.pod_vif_neutron.port_activation_poll_interval)
+        self._vif_plugins = {}
+        self._ports_creator = d_utils.RequestsCoalescer(
+            'create_port', self._create_ports,
+            window=oslo_cfg.CONF.pod_vif_neutron.port_creation_batch_window)
 
     def request_vif(self, pod, project_id, subnets, security_groups):
         neutron = clients.get_neutron_client()
 
         rq = self._get_port_request(pod, project_id, subnets, security_groups)
-        port = neutron.create_port(rq).get('port')
+        if oslo_cfg.CONF.pod_vif_neutron.port_creation_batch_window:
+            port = self._ports_creator.submit(
+                self._get_port_request_key(rq), rq)
+        else:
+            port = neutron.create_port(rq).get('port')
         vif_plugin = self._get_vif_plugin(port)
+        self._cache_vif_plugin(rq, vif_plugin)
 
         return ovu.neutron_to_osvif_vif(vif_plugin, port, subnets)
 
@@ -57,11 +110,17 @@ class NeutronPodVIFDriver(base.PodVIFDriver):
         # NOTE(ltomasbo): Due to the bug (1696051) on neutron bulk port
         # creation request returning the port objects without binding
         # information, an additional (non-bulk) port creation is performed to
-        # get the right vif binding information
+        # get the right vif binding information. The vif plugin is cached per
+        # host, so that it is only needed on the first bulk request of a host
         if vif_plugin == 'unbound':
-            single_port = neutron.create_port(rq).get('port')
-            vif_plugin = self._get_vif_plugin(single_port)
-            ports.append(single_port)
+            host_id = rq['port'].get('binding:host_id')
+            if host_id in self._vif_plugins:
+                vif_plugin = self._vif_plugins[host_id]
+            else:
+                single_port = neutron.create_port(rq).get('port')
+                vif_plugin = self._get_vif_plugin(single_port)
+                ports.append(single_port)
+        self._cache_vif_plugin(rq, vif_plugin)
 
         vifs = []
         for port in ports:
@@ -82,14 +141,47 @@ class NeutronPodVIFDriver(base.PodVIFDriver):
         if vif.active:
             return
 
-        neutron = clients.get_neutron_client()
-        port = neutron.show_port(vif.id).get('port')
+        status = self._activation_poller.wait(
+            vif.id, (kl_const.PORT_STATUS_ACTIVE,),
+            oslo_cfg.CONF.pod_vif_neutron.port_activation_timeout)
 
-        if port['status'] != kl_const.PORT_STATUS_ACTIVE:
+        if status != kl_const.PORT_STATUS_ACTIVE:
             raise k_exc.ResourceNotReady(vif)
 
         vif.active = True
 
+    def _get_port_request_key(self, port_request):
+        port_req_body = port_request['port']
+        return (port_req_body.get('binding:host_id'),
+                port_req_body['project_id'],
+                port_req_body['network_id'],
+                tuple(sorted(port_req_body.get('security_groups', ()))))
+
+    def _create_ports(self, key, port_requests):
+        neutron = clients.get_neutron_client()
+        if len(port_requests) == 1:
+            return [neutron.create_port(port_requests[0]).get('port')]
+
+        ports = neutron.create_port({'ports': port_requests}).get('ports')
+
+        # As with request_vifs, due to the bug (1696051) the ports returned
+        # by the bulk creation have no binding information, so the vif plugin
+        # is taken from the host cache, or from one of the created ports
+        if self._get_vif_plugin(ports[0]) == 'unbound':
+            vif_plugin = self._vif_plugins.get(key[0])
+            if vif_plugin is None:
+                vif_plugin = self._get_vif_plugin(
+                    neutron.show_port(ports[0]['id']).get('port'))
+            for port in ports:
+                port['binding:vif_type'] = vif_plugin
+        return ports
+
+    def _get_ports_status(self, port_ids):
+        neutron = clients.get_neutron_client()
+        ports = d_utils.list_by_ids(neutron.list_ports, 'ports', port_ids,
+                                    ['id', 'status'])
+        return {port['id']: port['status'] for port in ports}
+
     def _get_port_request(self, pod, project_id, subnets, security_groups,
                           unbound=False):
         port_req_body = {'project_id': project_id,
@@ -116,6 +208,15 @@ class NeutronPodVIFDriver(base.PodVIFDriver):
     def _get_vif_plugin(self, port):
         return port.get('binding:vif_type')
 
+    def _cache_vif_plugin(self, port_request, vif_plugin):
+        if vif_plugin in (None, 'unbound', 'binding_failed'):
+            return
+        host_id = port_request['port'].get('binding:host_id')
+        if host_id and self._vif_plugins.get(host_id) != vif_plugin:
+            LOG.debug("Caching vif plugin %(plugin)s for host %(host)s",
+                      {'plugin': vif_plugin, 'host': host_id})
+            self._vif_plugins[host_id] = vif_plugin
+
     def _get_network_id(self, subnets):
         ids = ovu.osvif_to_neutron_network_ids(subnets)
 
@@ -0,0 +1,293 @@
+# Copyright (c) 2017 Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import time
+
+import eventlet
+from eventlet import event
+from eventlet import semaphore
+import netaddr
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# Maximum number of ids filtered by a single listing request, as they are
+# sent in the request URL
+LIST_MAX_IDS = 100
+
+
+def list_by_ids(list_func, resources, ids, fields):
+    """Lists the resources with the given ids, LIST_MAX_IDS at a time.
+
+    :param list_func: neutron client listing method, e.g., list_ports.
+    :param resources: key of the resources in the listing response.
+    :param ids: ids of the resources to list.
+    :param fields: fields of the resources to get.
+    :returns: list with the resources that exist.
+    """
+    items = []
+    for i in range(0, len(ids), LIST_MAX_IDS):
+        items.extend(list_func(id=ids[i:i + LIST_MAX_IDS],
+                               fields=fields).get(resources))
+    return items
+
+
+class RequestsCoalescer(object):
+    """Groups the requests made for the same key into batches.
+
+    The requests submitted for a key are collected for `window` seconds and
+    then sent with `batch_func(key, items)`, which must return a list with
+    the result of each item. The batches of a key
+    are sent one at a time, and the requests submitted while a batch is
+    being sent are collected into the next one.
+
+    If a batch fails, its items are sent one by one through
+    `single_func(key, item)`, which defaults to sending each item as a batch
+    on its own, so that only the requests that fail on their own get the
+    error.
+
+    The number of batches sent per batch size is kept at `batch_sizes`.
+    """
+
+    def __init__(self, name, batch_func, single_func=None, window=0.005):
+        self._name = name
+        self._batch_func = batch_func
+        self._single_func = single_func or (
+            lambda key, item: batch_func(key, [item])[0])
+        self._window = window
+        self._pending = {}
+        self._locks = collections.defaultdict(semaphore.Semaphore)
+        self.batch_sizes = collections.Counter()
+
+    def submit(self, key, item):
+        """Adds item to the next batch of key and waits for its result.
+
+        :returns: the result for item returned by the batch (or single) call
+        :raises: the exception raised by the call that sent item
+        """
+        result = event.Event()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = []
+            eventlet.spawn(self._send_batch, key)
+        batch.append((item, result))
+        return result.wait()
+
+    def _send_batch(self, key):
+        eventlet.sleep(self._window)
+        with self._locks[key]:
+            batch = self._pending.pop(key)
+            items = [item for item, _ in batch]
+            self.batch_sizes[len(items)] += 1
+            LOG.debug("%(name)s: sending a batch of %(size)d requests for "
+                      "%(key)s. Batches sent per size: %(sizes)s",
+                      {'name': self._name, 'size': len(items), 'key': key,
+                       'sizes': dict(self.batch_sizes)})
+            try:
+                results = self._batch_func(key, items)
+            except Exception as ex:
+                if len(batch) == 1:
+                    batch[0][1].send_exception(ex)
+                    return
+                LOG.debug("%(name)s: batch for %(key)s failed, sending its "
+                          "requests one by one",
+                          {'name': self._name, 'key': key})
+                self._send_singles(key, batch)
+                return
+
+            for (_, result), value in zip(batch, results):
+                result.send(value)
+
+    def _send_singles(self, key, batch):
+        for item, result in batch:
+            try:
+                value = self._single_func(key, item)
+            except Exception as ex:
+                result.send_exception(ex)
+            else:
+                result.send(value)
+
+
+class StatusPoller(object):
+    """Waits for resources to reach a status.
+
+    Every `interval` seconds, the resources being waited for are polled with
+    `list_func(ids)`, which must return a dictionary with the current status
+    of each of the given resources that still exists. The polling
+    greenthread is only running while there is someone waiting.
+    """
+
+    def __init__(self, name, list_func, interval):
+        self._name = name
+        self._list_func = list_func
+        self._interval = interval
+        self._waiters = collections.defaultdict(list)
+        self._statuses = {}
+        self._poller = None
+
+    def wait(self, resource_id, statuses, timeout):
+        """Waits for the resource to reach any of the given statuses.
+
+        :returns: the status reached by the resource, None if it no longer
+                  exists, or the last status seen if it does not reach any
+                  of the given statuses within `timeout` seconds
+        """
+        waiter = (statuses, event.Event())
+        self._waiters[resource_id].append(waiter)
+        if self._poller is None:
+            self._poller = eventlet.spawn(self._poll)
+
+        with eventlet.Timeout(timeout, False):
+            return waiter[1].wait()
+
+        status = self._statuses.get(resource_id)
+        self._remove_waiter(resource_id, waiter)
+        return status
+
+    def _remove_waiter(self, resource_id, waiter):
+        waiters = self._waiters.get(resource_id, [])
+        if waiter in waiters:
+            waiters.remove(waiter)
+        if not waiters:
+            self._waiters.pop(resource_id, None)
+            self._statuses.pop(resource_id, None)
+
+    def _poll(self):
+        try:
+            while self._waiters:
+                resource_ids = list(self._waiters)
+                LOG.debug("%(name)s: polling %(num)d resources",
+                          {'name': self._name, 'num': len(resource_ids)})
+                try:
+                    statuses = self._list_func(resource_ids)
+                except Exception:
+                    LOG.warning("%s: error polling the resources status",
+                                self._name, exc_info=True)
+                    statuses = None
+
+                if statuses is not None:
+                    self._notify(resource_ids, statuses)
+                if self._waiters:
+                    eventlet.sleep(self._interval)
+        finally:
+            self._poller = None
+
+    def _notify(self, resource_ids, statuses):
+        for resource_id in resource_ids:
+            if resource_id not in self._waiters:
+                continue
+            status = statuses.get(resource_id)
+            self._statuses[resource_id] = status
+            for waiter in list(self._waiters[resource_id]):
+                if status is None or status in waiter[0]:
+                    self._remove_waiter(resource_id, waiter)
+                    waiter[1].send(status)
+
+
+class TTLCache(object):
+    """Bounded cache of the values loaded with `load_func(key)`.
+
+    The values expire `ttl` seconds after being loaded, and once the cache
+    holds `max_size` values the least recently used one is evicted. The
+    concurrent misses of a key are loaded once: the first one calls
+    `load_func` while the rest wait for its result (or exception).
+
+    The number of hits and misses is kept at `hits` and `misses`.
+    """
+
+    def __init__(self, name, load_func, ttl, max_size):
+        self._name = name
+        self._load_func = load_func
+        self._ttl = ttl
+        self._max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry[0] > time.time():
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+        loading = self._loading.get(key)
+        if loading is not None:
+            self.hits += 1
+            return loading.wait()
+
+        self.misses += 1
+        LOG.debug("%(name)s cache: loading %(key)s (%(hits)d hits, "
+                  "%(misses)d misses)", {'name': self._name, 'key': key,
+                                         'hits': self.hits,
+                                         'misses': self.misses})
+        loading = self._loading[key] = event.Event()
+        try:
+            value = self._load_func(key)
+        except BaseException as ex:
+            # Also on timeouts and kills of the greenthread, as otherwise
+            # the waiters and the later misses of the key would block
+            loading.send_exception(ex)
+            raise
+        finally:
+            del self._loading[key]
+
+        self._entries[key] = (time.time() + self._ttl, value)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+        loading.send(value)
+        return value
+
+    def invalidate(self, key=None):
+        """Removes the value of key, or all the values if no key is given."""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+
+class CIDRIndex(object):
+    """Index of the values associated to CIDRs, by the IPs they contain.
+
+    The CIDRs are grouped by IP version and prefix length, and keyed by their
+    network address, so that the CIDRs containing an IP are found with a
+    dictionary lookup per prefix length in use, regardless of the number of
+    indexed CIDRs. Overlapping CIDRs are supported.
+    """
+
+    def __init__(self, cidrs):
+        """Builds the index.
+
+        :param cidrs: iterable of (cidr, value) tuples
+        """
+        self._networks = collections.defaultdict(
+            lambda: collections.defaultdict(list))
+        for cidr, value in cidrs:
+            cidr = netaddr.IPNetwork(cidr)
+            self._networks[(cidr.version, cidr.prefixlen)][
+                cidr.first].append(value)
+
+    def lookup(self, ip):
+        """Returns the values of the CIDRs containing the given IP."""
+        ip = netaddr.IPAddress(ip)
+        bits = 32 if ip.version == 4 else 128
+        values = []
+        for (version, prefixlen), networks in self._networks.items():
+            if version == ip.version:
+                mask = ((1 << prefixlen) - 1) << (bits - prefixlen)
+                values.extend(networks.get(int(ip) & mask, ()))
+        return values
@@ -21,15 +21,20 @@ import time
 
 from kuryr.lib._i18n import _
 from kuryr.lib import constants as kl_const
+from kuryr.lib import exceptions as kl_exc
 from neutronclient.common import exceptions as n_exc
 from oslo_config import cfg as oslo_cfg
 from oslo_log import log as logging
 
 from kuryr_kubernetes import clients
+from kuryr_kubernetes import config
+from kuryr_kubernetes import constants
 from kuryr_kubernetes.controller.drivers import base
 from kuryr_kubernetes.controller.drivers import default_subnet
 from kuryr_kubernetes import exceptions
 from kuryr_kubernetes import os_vif_util as ovu
+from kuryr_kubernetes import utils
+from kuryr_kubernetes import vif_annotation as vif_annot
 
 LOG = logging.getLogger(__name__)
 
@@ -49,23 +54,158 @@ vif_pool_driver_opts = [
                     help=_("Minimun interval (in seconds) "
                            "between pool updates"),
                     default=20),
+    oslo_cfg.BoolOpt('ports_pool_prewarm',
+                     help=_("Populate the pools of the default project and "
+                            "security groups of every node as soon as the "
+                            "node is known, instead of waiting for its "
+                            "first pod"),
+                     default=False),
+    oslo_cfg.IntOpt('ports_pool_populate_concurrency',
+                    help=_("Maximum number of pools being populated "
+                           "concurrently, i.e., of simultaneous Neutron bulk "
+                           "port creation requests"),
+                    min=1,
+                    default=5),
+    oslo_cfg.IntOpt('ports_release_concurrency',
+                    help=_("Number of ports released concurrently in the "
+                           "background by the noop pool driver, once their "
+                           "pods are deleted. 0 to release them "
+                           "synchronously"),
+                    min=0,
+                    default=0),
 ]
 
 oslo_cfg.CONF.register_opts(vif_pool_driver_opts, "vif_pool")
 
+# Number of attempts made to release a port in the background, and seconds
+# waited before each retry (multiplied by the number of failed attempts)
+RELEASE_ATTEMPTS = 5
+RELEASE_RETRY_INTERVAL = 3
+
+# Errors of the ports requests that may be due to the cached subnets being
+# outdated, e.g., if a subnet got deleted
+_OUTDATED_SUBNETS_ERRORS = (exceptions.IntegrityError, n_exc.NotFound)
+
+
+def _invalidate_subnets(subnets):
+    for subnet_id in subnets:
+        default_subnet.invalidate_subnet(subnet_id)
+
 
 class NoopVIFPool(base.VIFPoolDriver):
-    """No pool VIFs for Kubernetes Pods"""
+    """No pool VIFs for Kubernetes Pods
+
+    If `ports_release_concurrency` is set, release_vif returns right away
+    and the ports are released in the background by that many greenthreads,
+    which take them from _release_queue. The ports that fail to be released
+    are queued again, up to RELEASE_ATTEMPTS times.
+
+    As _release_queue is kept in memory, the ports still queued when the
+    controller stops are not released. Thus, in that case, the ports whose
+    device_id is the UID of a pod that no longer exists are deleted on
+    start-up.
+    """
+
+    def __init__(self):
+        self._release_queue = eventlet.queue.LightQueue()
+        self._release_workers = []
+        if oslo_cfg.CONF.vif_pool.ports_release_concurrency:
+            eventlet.spawn(self._delete_orphaned_ports)
 
     def set_vif_driver(self, driver):
         self._drv_vif = driver
 
     def request_vif(self, pod, project_id, subnets, security_groups):
-        return self._drv_vif.request_vif(pod, project_id, subnets,
-                                         security_groups)
+        try:
+            return self._drv_vif.request_vif(pod, project_id, subnets,
+                                             security_groups)
+        except _OUTDATED_SUBNETS_ERRORS:
+            _invalidate_subnets(subnets)
+            raise
 
     def release_vif(self, pod, vif, *argv):
-        self._drv_vif.release_vif(pod, vif)
+        concurrency = oslo_cfg.CONF.vif_pool.ports_release_concurrency
+        if not concurrency:
+            self._drv_vif.release_vif(pod, vif)
+            return
+
+        if not self._release_workers:
+            self._release_workers = [eventlet.spawn(self._release_ports)
+                                     for _ in range(concurrency)]
+        self._release_queue.put((pod, vif, 1))
+        LOG.debug("Port %(port)s queued for release, %(num)d ports pending",
+                  {'port': vif.id, 'num': self._release_queue.qsize()})
+
+    def _release_ports(self):
+        while True:
+            self._release_port(*self._release_queue.get())
+
+    def _release_port(self, pod, vif, attempt):
+        try:
+            self._drv_vif.release_vif(pod, vif)
+        except Exception:
+            if attempt >= RELEASE_ATTEMPTS:
+                LOG.exception("Error releasing port %s, giving up after %d "
+                              "attempts", vif.id, attempt)
+                return
+            LOG.warning("Error releasing port %s (attempt %d), retrying",
+                        vif.id, attempt, exc_info=True)
+            eventlet.spawn_after(RELEASE_RETRY_INTERVAL * attempt,
+                                 self._release_queue.put,
+                                 (pod, vif, attempt + 1))
+
+    def _delete_orphaned_ports(self):
+        """Deletes the ports of the pods deleted before a restart.
+
+        As other deployments may share the Neutron ports, only the ports of
+        the default project that are bound to a node of the cluster are
+        considered. The ports are listed before the pods, so that the ports
+        created in the meantime are not seen, and the ones of the pods
+        created in the meantime are not taken as orphaned.
+        """
+        project_id = config.CONF.neutron_defaults.project
+        if not project_id:
+            LOG.info("No default project set, the ports of the pods "
+                     "deleted before the restart are not released.")
+            return
+        neutron = clients.get_neutron_client()
+        k8s = clients.get_kubernetes_client()
+        ports = neutron.list_ports(
+            device_owner=kl_const.DEVICE_OWNER, project_id=project_id,
+            fields=['id', 'device_id', 'binding:host_id']).get('ports')
+        try:
+            pods = k8s.get(constants.K8S_API_BASE + '/pods')
+            nodes = k8s.get(constants.K8S_API_BASE + '/nodes')
+        except exceptions.K8sClientException:
+            LOG.warning("Error listing the pods, the ports of the pods "
+                        "deleted before the restart are not released.")
+            return
+        pod_uids = set(pod['metadata']['uid']
+                       for pod in pods.get('items', []))
+        node_names = set(node['metadata']['name']
+                         for node in nodes.get('items', []))
+
+        for port in ports:
+            if (not port['device_id'] or port['device_id'] in pod_uids or
+                    port.get('binding:host_id') not in node_names):
+                continue
+            LOG.debug("Deleting port %(port)s of deleted pod %(uid)s",
+                      {'port': port['id'], 'uid': port['device_id']})
+            try:
+                neutron.delete_port(port['id'])
+            except n_exc.PortNotFoundClient:
+                LOG.debug("Port %s already deleted.", port['id'])
+            except n_exc.NeutronClientException:
+                LOG.exception("Error deleting port %s", port['id'])
+
+    def populate_pool(self, pod, project_id, subnets, security_groups):
+        pass
+
+    def release_pools(self, host_addr):
+        pass
+
+    def resume_pools(self, host_addr):
+        pass
 
     def activate_vif(self, pod, vif):
         self._drv_vif.activate_vif(pod, vif)
@@ -85,6 +225,19 @@ class BaseVIFPool(base.VIFPoolDriver):
     _last_update is a dictionary with the timestamp of the last population
     action for each pool. The keys are the pool_keys and the values are the
     timestamps.
+    _ports_attrs is a dictionary with the Neutron attributes (name, device_id
+    and security_groups) last set on each port. The keys are the 'port_id's
+    and the values dicts with the attributes. It is used to skip the Neutron
+    updates that would not change anything.
+    _pending_ports_attrs is a dictionary with the cosmetic attributes (name
+    and device_id) of the pod still to be set on the ports taken from the
+    pools. The keys are the 'port_id's and the values dicts with the
+    attributes. They are applied in the background on the next recycling
+    iteration, so that they are kept out of the pod creation path, and are
+    superseded by any newer ones set for the same port in the meantime.
+    _released_hosts is a set with the addresses of the nodes whose pools have
+    been released, i.e., nodes removed from the cluster or no longer
+    schedulable. Their ports are deleted instead of recycled.
 
     The following driver configuration options exist:
     - ports_pool_max: it specifies how many ports can be kept at each pool.
@@ -97,13 +250,22 @@ class BaseVIFPool(base.VIFPoolDriver):
     when populating pools.
     - ports_pool_update_frequency: interval in seconds between ports pool
     updates, both for populating pools as well as for recycling ports.
+    - ports_pool_prewarm: whether to populate the pools of each node for the
+    default project and security groups before its first pod needs a port.
+    - ports_pool_populate_concurrency: maximum number of pools being populated
+    at the same time, to bound the load the population puts on Neutron.
     """
     _available_ports_pools = collections.defaultdict(collections.deque)
     _existing_vifs = collections.defaultdict(collections.defaultdict)
     _recyclable_ports = collections.defaultdict(collections.defaultdict)
     _last_update = collections.defaultdict(collections.defaultdict)
+    _ports_attrs = collections.defaultdict(dict)
+    _pending_ports_attrs = collections.defaultdict(dict)
+    _released_hosts = set()
 
     def __init__(self):
+        self._populate_semaphore = eventlet.semaphore.Semaphore(
+            oslo_cfg.CONF.vif_pool.ports_pool_populate_concurrency)
         # Note(ltomasbo) Execute the port recycling periodic actions in a
         # background thread
         eventlet.spawn(self._return_ports_to_pool)
@@ -134,6 +296,14 @@ class BaseVIFPool(base.VIFPoolDriver):
             eventlet.spawn(self._populate_pool, pool_key, pod, subnets)
             raise ex
 
+    def populate_pool(self, pod, project_id, subnets, security_groups):
+        host_addr = pod['status']['hostIP']
+        pool_key = (host_addr, project_id, tuple(sorted(security_groups)))
+        self._populate_pool(pool_key, pod, subnets)
+
+    def resume_pools(self, host_addr):
+        self._released_hosts.discard(host_addr)
+
     def _populate_pool(self, pool_key, pod, subnets):
         # REVISIT(ltomasbo): Drop the subnets parameter and get the information
         # from the pool_key, which will be required when multi-network is
@@ -149,14 +319,21 @@ class BaseVIFPool(base.VIFPoolDriver):
         if pool_size < oslo_cfg.CONF.vif_pool.ports_pool_min:
             num_ports = max(oslo_cfg.CONF.vif_pool.ports_pool_batch,
                             oslo_cfg.CONF.vif_pool.ports_pool_min - pool_size)
-            vifs = self._drv_vif.request_vifs(
-                pod=pod,
-                project_id=pool_key[1],
-                subnets=subnets,
-                security_groups=list(pool_key[2]),
-                num_ports=num_ports)
+            with self._populate_semaphore:
+                try:
+                    vifs = self._drv_vif.request_vifs(
+                        pod=pod,
+                        project_id=pool_key[1],
+                        subnets=subnets,
+                        security_groups=list(pool_key[2]),
+                        num_ports=num_ports)
+                except _OUTDATED_SUBNETS_ERRORS:
+                    _invalidate_subnets(subnets)
+                    raise
             for vif in vifs:
                 self._existing_vifs[vif.id] = vif
+                self._ports_attrs[vif.id] = self._get_available_port_attrs(
+                    pool_key)
                 self._available_ports_pools.setdefault(pool_key,
                                                        []).append(vif.id)
 
@@ -166,13 +343,131 @@ class BaseVIFPool(base.VIFPoolDriver):
 
         if not self._existing_vifs.get(vif.id):
             self._existing_vifs[vif.id] = vif
+        # The pod renaming is not applied if it is still pending, so that
+        # the port is not renamed back and forth on recycling
+        self._pending_ports_attrs.pop(vif.id, None)
         self._recyclable_ports[vif.id] = pool_key
 
+    def release_pools(self, host_addr):
+        neutron = clients.get_neutron_client()
+        self._released_hosts.add(host_addr)
+        for pool_key in list(self._last_update):
+            if pool_key[0] == host_addr:
+                del self._last_update[pool_key]
+        for pool_key in list(self._available_ports_pools):
+            if pool_key[0] != host_addr:
+                continue
+            port_ids = list(self._available_ports_pools.pop(pool_key))
+            if port_ids:
+                LOG.debug("Releasing %(num)s ports of pool %(pool)s",
+                          {'num': len(port_ids), 'pool': pool_key})
+                self._delete_pool_ports(neutron, pool_key, port_ids)
+
+    @abc.abstractmethod
+    def _delete_pool_ports(self, neutron, pool_key, port_ids):
+        """Deletes the given ports, already taken out of their pool."""
+        raise NotImplementedError()
+
     def _get_ports_by_attrs(self, **attrs):
         neutron = clients.get_neutron_client()
         ports = neutron.list_ports(**attrs)
         return ports['ports']
 
+    def _get_available_port_attrs(self, pool_key):
+        return {'name': 'available-port',
+                'security_groups': list(pool_key[2])}
+
+    def _get_pod_port_attrs(self, pod):
+        return {'name': pod['metadata']['name']}
+
+    def _get_in_use_ports(self):
+        """Returns the pods using each port, as per their VIF annotations.
+
+        The ports taken from the pools keep their 'available-port' name
+        until their pending attributes are applied, so the ports looking
+        pre-created on start-up may actually be in use by pods. The pods are
+        obtained with a single listing.
+
+        :returns: dict with the pods, keyed by the id of their port.
+        """
+        k8s = clients.get_kubernetes_client()
+        pods = k8s.get(constants.K8S_API_BASE + '/pods')
+        in_use_ports = {}
+        for pod in pods.get('items', []):
+            annotation = pod['metadata'].get('annotations', {}).get(
+                constants.K8S_ANNOTATION_VIF)
+            if annotation:
+                in_use_ports[vif_annot.get_vif_id(annotation)] = pod
+        return in_use_ports
+
+    def _reclaim_in_use_port(self, port, pod):
+        """Sets the attributes of the pod on a port it is using.
+
+        The port is left out of the pools, and its pending attributes are
+        applied by the next recycling iteration.
+        """
+        LOG.debug("Port %(port)s is in use by pod %(pod)s, it is not "
+                  "recovered", {'port': port['id'],
+                                'pod': pod['metadata']['name']})
+        self._ports_attrs[port['id']] = {
+            attr: port[attr] for attr in self._get_pod_port_attrs(pod)}
+        self._pending_ports_attrs[port['id']] = self._get_pod_port_attrs(pod)
+
+    def _update_port_attrs(self, neutron, port_id, attrs):
+        """Sets the given attributes on a Neutron port if they changed.
+
+        Only the attributes that differ from the ones last set on the port
+        are sent to Neutron, and no call is made at all if none of them
+        changed. Returns whether a Neutron call was made.
+        """
+        known_attrs = self._ports_attrs.setdefault(port_id, {})
+        changed_attrs = {attr: value for attr, value in attrs.items()
+                         if known_attrs.get(attr) != value}
+        if not changed_attrs:
+            return False
+        neutron.update_port(port_id, {'port': changed_attrs})
+        known_attrs.update(changed_attrs)
+        return True
+
+    def _recycle_port(self, neutron, port_id, pool_key):
+        """Prepares a port to be reused and puts it back in its pool.
+
+        The port is renamed back to 'available-port' before being made
+        available, as only the ports with that name are recovered on
+        restarts. Only the attributes that changed are updated, so no
+        Neutron call is made for the ports that kept that name and the
+        security groups of the pool. Returns whether a Neutron call was made.
+        """
+        updated = self._update_port_attrs(
+            neutron, port_id, self._get_available_port_attrs(pool_key))
+        self._available_ports_pools.setdefault(pool_key, []).append(port_id)
+        return updated
+
+    def _update_pending_ports_attrs(self, neutron):
+        """Applies the pending cosmetic updates to the Neutron ports.
+
+        The updates that fail are kept to be retried on the next iteration,
+        unless the port no longer exists.
+        """
+        for port_id, attrs in self._pending_ports_attrs.copy().items():
+            try:
+                self._update_port_attrs(neutron, port_id, attrs)
+            except n_exc.PortNotFoundClient:
+                LOG.debug('Unable to update port %s as it no longer '
+                          'exists.', port_id)
+                self._ports_attrs.pop(port_id, None)
+            except n_exc.NeutronClientException:
+                LOG.warning("Error updating port %s attributes, retrying "
+                            "on the next iteration.", port_id)
+                continue
+            # Newer attributes may have been set while updating the port
+            if self._pending_ports_attrs.get(port_id) is attrs:
+                del self._pending_ports_attrs[port_id]
+
+    def _forget_port(self, port_id):
+        self._ports_attrs.pop(port_id, None)
+        self._pending_ports_attrs.pop(port_id, None)
+
 
 class NeutronVIFPool(BaseVIFPool):
     """Manages VIFs for Bare Metal Kubernetes Pods."""
@@ -182,15 +477,7 @@ class NeutronVIFPool(BaseVIFPool):
             port_id = self._available_ports_pools[pool_key].pop()
         except IndexError:
             raise exceptions.ResourceNotReady(pod)
-        neutron = clients.get_neutron_client()
-        neutron.update_port(
-            port_id,
-            {
-                "port": {
-                    'name': pod['metadata']['name'],
-                    'device_id': pod['metadata']['uid']
-                }
-            })
+        self._pending_ports_attrs[port_id] = self._get_pod_port_attrs(pod)
         # check if the pool needs to be populated
         if (self._get_pool_size(pool_key) <
                 oslo_cfg.CONF.vif_pool.ports_pool_min):
@@ -210,27 +497,23 @@ class NeutronVIFPool(BaseVIFPool):
         """
         neutron = clients.get_neutron_client()
         while True:
+            self._update_pending_ports_attrs(neutron)
+            recycled = updated = 0
             for port_id, pool_key in self._recyclable_ports.copy().items():
-                if (not oslo_cfg.CONF.vif_pool.ports_pool_max or
-                    self._get_pool_size(pool_key) <
-                        oslo_cfg.CONF.vif_pool.ports_pool_max):
+                if (pool_key[0] not in self._released_hosts and
+                    (not oslo_cfg.CONF.vif_pool.ports_pool_max or
+                     self._get_pool_size(pool_key) <
+                        oslo_cfg.CONF.vif_pool.ports_pool_max)):
                     try:
-                        neutron.update_port(
-                            port_id,
-                            {
-                                "port": {
-                                    'name': 'available-port',
-                                    'device_id': '',
-                                    'security_groups': list(pool_key[2])
-                                }
-                            })
+                        if self._recycle_port(neutron, port_id, pool_key):
+                            updated += 1
                     except n_exc.NeutronClientException:
                         LOG.warning("Error preparing port %s to be reused, put"
                                     " back on the cleanable pool.", port_id)
                         continue
-                    self._available_ports_pools.setdefault(
-                        pool_key, []).append(port_id)
+                    recycled += 1
                 else:
+                    self._forget_port(port_id)
                     try:
                         del self._existing_vifs[port_id]
                         neutron.delete_port(port_id)
@@ -240,45 +523,118 @@ class NeutronVIFPool(BaseVIFPool):
                     except KeyError:
                         LOG.debug('Port %s is not in the ports list.', port_id)
                 del self._recyclable_ports[port_id]
+            if recycled:
+                LOG.debug("Recycled %(recycled)s ports with %(updated)s "
+                          "Neutron updates.",
+                          {'recycled': recycled, 'updated': updated})
             eventlet.sleep(oslo_cfg.CONF.vif_pool.ports_pool_update_frequency)
 
+    def _delete_pool_ports(self, neutron, pool_key, port_ids):
+        for port_id in port_ids:
+            self._forget_port(port_id)
+            self._existing_vifs.pop(port_id, None)
+            try:
+                neutron.delete_port(port_id)
+            except n_exc.PortNotFoundClient:
+                LOG.debug('Unable to release port %s as it no longer '
+                          'exists.', port_id)
+            except n_exc.NeutronClientException:
+                LOG.warning('Error deleting port %s', port_id)
+
+    def _get_available_port_attrs(self, pool_key):
+        attrs = super(NeutronVIFPool, self)._get_available_port_attrs(
+            pool_key)
+        attrs['device_id'] = ''
+        return attrs
+
+    def _get_pod_port_attrs(self, pod):
+        attrs = super(NeutronVIFPool, self)._get_pod_port_attrs(pod)
+        attrs['device_id'] = pod['metadata']['uid']
+        return attrs
+
     def _recover_precreated_ports(self):
-        # REVISIT(ltomasbo): host_address cannot be obtained to recover the
-        # port into the corresponding pool. So for now they are just cleaned
-        # up
-        self._cleanup_precreated_ports()
+        """Recovers the pre-created ports into their pools.
 
-    def _cleanup_precreated_ports(self):
+        The ports are created bound to the node they are pooled for, so the
+        pool host address is obtained from the IP of the node named by their
+        binding:host_id. Ports whose node is no longer known, or that could
+        not be bound, are deleted instead. Ports in use by pods are left out
+        of the pools (see _get_in_use_ports).
+        """
         neutron = clients.get_neutron_client()
         available_ports = self._get_ports_by_attrs(
             name='available-port', device_owner=kl_const.DEVICE_OWNER)
+        if not available_ports:
+            return
+
+        try:
+            in_use_ports = self._get_in_use_ports()
+            nodes_ips = self._get_nodes_ips()
+        except exceptions.K8sClientException:
+            LOG.warning("Unable to get the Kubernetes pods and nodes, the "
+                        "pre-created ports are not recovered.")
+            return
+
+        subnets = {}
+        recovered = 0
         for port in available_ports:
-            neutron.delete_port(port['id'])
+            pod = in_use_ports.get(port['id'])
+            if pod:
+                self._reclaim_in_use_port(port, pod)
+                continue
+
+            host_addr = nodes_ips.get(port['binding:host_id'])
+            vif_plugin = port.get('binding:vif_type')
+            if not host_addr or vif_plugin in ('unbound', 'binding_failed'):
+                try:
+                    neutron.delete_port(port['id'])
+                except n_exc.PortNotFoundClient:
+                    LOG.debug('Unable to release port %s as it no longer '
+                              'exists.', port['id'])
+                continue
+
+            subnet_id = port['fixed_ips'][0]['subnet_id']
+            if subnet_id not in subnets:
+                subnets[subnet_id] = {
+                    subnet_id: default_subnet._get_subnet(subnet_id)}
+            vif = ovu.neutron_to_osvif_vif(vif_plugin, port,
+                                           subnets[subnet_id])
+            pool_key = (host_addr, port['project_id'],
+                        tuple(sorted(port['security_groups'])))
+
+            self._existing_vifs[port['id']] = vif
+            self._ports_attrs[port['id']] = {
+                'name': port['name'],
+                'device_id': port['device_id'],
+                'security_groups': sorted(port['security_groups'])}
+            self._available_ports_pools.setdefault(pool_key, []).append(
+                port['id'])
+            recovered += 1
+        LOG.info("Recovered %(recovered)s of %(total)s pre-created ports.",
+                 {'recovered': recovered, 'total': len(available_ports)})
+
+    def _get_nodes_ips(self):
+        k8s = clients.get_kubernetes_client()
+        nodes = k8s.get(constants.K8S_API_BASE + '/nodes')
+        return {node['metadata']['name']: utils.get_node_ip(node)
+                for node in nodes.get('items', [])}
 
 
 class NestedVIFPool(BaseVIFPool):
     """Manages VIFs for nested Kubernetes Pods.
 
-    In order to handle the pools of ports for nested Pods, an extra dict is
-    used:
-    _known_trunk_ids is a dictionary that keeps the trunk port ids associated
-    to each pool_key to skip calls to neutron to get the trunk information.
+    The ports of each pool are attached to the VM whose parent port has the
+    pool host address, either as trunk subports or as allowed address pairs
+    of the VM port, depending on the nested VIF driver. The pool relies on
+    the driver to detach them from (and to find them at) the VMs.
     """
-    _known_trunk_ids = collections.defaultdict(str)
 
     def _get_port_from_pool(self, pool_key, pod, subnets):
         try:
             port_id = self._available_ports_pools[pool_key].pop()
         except IndexError:
             raise exceptions.ResourceNotReady(pod)
-        neutron = clients.get_neutron_client()
-        neutron.update_port(
-            port_id,
-            {
-                "port": {
-                    'name': pod['metadata']['name'],
-                }
-            })
+        self._pending_ports_attrs[port_id] = self._get_pod_port_attrs(pod)
         # check if the pool needs to be populated
         if (self._get_pool_size(pool_key) <
                 oslo_cfg.CONF.vif_pool.ports_pool_min):
@@ -298,37 +654,27 @@ class NestedVIFPool(BaseVIFPool):
         """
         neutron = clients.get_neutron_client()
         while True:
+            self._update_pending_ports_attrs(neutron)
+            recycled = updated = 0
             for port_id, pool_key in self._recyclable_ports.copy().items():
-                if (not oslo_cfg.CONF.vif_pool.ports_pool_max or
-                    self._get_pool_size(pool_key) <
-                        oslo_cfg.CONF.vif_pool.ports_pool_max):
+                if (pool_key[0] not in self._released_hosts and
+                    (not oslo_cfg.CONF.vif_pool.ports_pool_max or
+                     self._get_pool_size(pool_key) <
+                        oslo_cfg.CONF.vif_pool.ports_pool_max)):
                     try:
-                        neutron.update_port(
-                            port_id,
-                            {
-                                "port": {
-                                    'name': 'available-port',
-                                    'security_groups': list(pool_key[2])
-                                }
-                            })
+                        if self._recycle_port(neutron, port_id, pool_key):
+                            updated += 1
                     except n_exc.NeutronClientException:
                         LOG.warning("Error preparing port %s to be reused, put"
                                     " back on the cleanable pool.", port_id)
                         continue
-                    self._available_ports_pools.setdefault(
-                        pool_key, []).append(port_id)
+                    recycled += 1
                 else:
-                    trunk_id = self._known_trunk_ids.get(pool_key, None)
-                    if not trunk_id:
-                        p_port = self._drv_vif._get_parent_port_by_host_ip(
-                            neutron, pool_key[0])
-                        trunk_id = self._drv_vif._get_trunk_id(p_port)
-                        self._known_trunk_ids[pool_key] = trunk_id
+                    self._forget_port(port_id)
                     try:
-                        self._drv_vif._remove_subport(neutron, trunk_id,
-                                                      port_id)
-                        self._drv_vif._release_vlan_id(
-                            self._existing_vifs[port_id].vlan_id)
+                        self._drv_vif._detach_vifs(
+                            neutron, pool_key[0],
+                            [self._existing_vifs[port_id]])
                         del self._existing_vifs[port_id]
                         neutron.delete_port(port_id)
                     except n_exc.PortNotFoundClient:
@@ -336,16 +682,45 @@ class NestedVIFPool(BaseVIFPool):
                                   'exists.', port_id)
                     except KeyError:
                         LOG.debug('Port %s is not in the ports list.', port_id)
-                    except n_exc.NeutronClientException:
-                        LOG.warning('Error removing the subport %s', port_id)
+                    except (n_exc.NeutronClientException,
+                            kl_exc.NoResourceException,
+                            exceptions.K8sNodeTrunkPortFailure):
+                        LOG.warning('Error removing the port %s', port_id)
                         continue
                 del self._recyclable_ports[port_id]
+            if recycled:
+                LOG.debug("Recycled %(recycled)s ports with %(updated)s "
+                          "Neutron updates.",
+                          {'recycled': recycled, 'updated': updated})
             eventlet.sleep(oslo_cfg.CONF.vif_pool.ports_pool_update_frequency)
 
-    def _get_parent_port_ip(self, port_id):
-        neutron = clients.get_neutron_client()
-        parent_port = neutron.show_port(port_id).get('port')
-        return parent_port['fixed_ips'][0]['ip_address']
+    def release_pools(self, host_addr):
+        super(NestedVIFPool, self).release_pools(host_addr)
+        self._drv_vif._invalidate_parent_port(host_addr)
+
+    def _delete_pool_ports(self, neutron, pool_key, port_ids):
+        vifs = [self._existing_vifs[port_id] for port_id in port_ids
+                if port_id in self._existing_vifs]
+        try:
+            self._drv_vif._detach_vifs(neutron, pool_key[0], vifs)
+        except (n_exc.NeutronClientException, kl_exc.NoResourceException,
+                exceptions.K8sNodeTrunkPortFailure):
+            # The ports are released by the next recycling iteration
+            LOG.warning('Unable to detach the ports of pool %s from their '
+                        'VM, retrying on the next iteration.', pool_key)
+            for port_id in port_ids:
+                self._recyclable_ports[port_id] = pool_key
+            return
+        for port_id in port_ids:
+            self._forget_port(port_id)
+            self._existing_vifs.pop(port_id, None)
+            try:
+                neutron.delete_port(port_id)
+            except n_exc.PortNotFoundClient:
+                LOG.debug('Unable to release port %s as it no longer '
+                          'exists.', port_id)
+            except n_exc.NeutronClientException:
+                LOG.warning('Error deleting port %s', port_id)
 
     def _recover_precreated_ports(self):
         self._precreated_ports(action='recover')
@@ -354,14 +729,17 @@ class NestedVIFPool(BaseVIFPool):
         self._precreated_ports(action='free', trunk_ips=trunk_ips)
 
     def _precreated_ports(self, action, trunk_ips=None):
-        """Removes or recovers pre-created subports at given pools
+        """Removes or recovers pre-created ports at given pools
 
         This function handles the pre-created ports based on the given action:
-        - If action is `free` it will remove all the subport from the given
-        trunk ports, or from all the trunk ports if no trunk_ips are passed.
-        - If action is `recover` it will discover the existing subports in the
-        given trunk ports (or in all of them if none are passed) and will add
-        them (and the needed information) to the respective pools.
+        - If action is `free` it will detach and delete all the ports attached
+        to the given VMs, or to all of them if no trunk_ips are passed.
+        - If action is `recover` it will discover the ports attached to the
+        given VMs (or to all of them if none are passed) and will add them
+        (and the needed information) to the respective pools.
+
+        In both cases, the ports in use by pods are left untouched (see
+        _get_in_use_ports).
         """
         neutron = clients.get_neutron_client()
         # Note(ltomasbo): ML2/OVS changes the device_owner to trunk:subport
@@ -375,61 +753,71 @@ class NestedVIFPool(BaseVIFPool):
         if not available_ports:
             return
 
-        trunk_ports = neutron.list_trunks().get('trunks')
-        for trunk in trunk_ports:
-            try:
-                host_addr = self._get_parent_port_ip(trunk['port_id'])
-            except n_exc.PortNotFoundClient:
-                LOG.debug('Unable to find parent port for trunk port %s.',
-                          trunk['port_id'])
-                continue
+        try:
+            in_use_ports = self._get_in_use_ports()
+        except exceptions.K8sClientException:
+            LOG.warning("Unable to get the Kubernetes pods, the pre-created "
+                        "ports are not handled.")
+            return
+        for port in available_ports:
+            pod = in_use_ports.get(port['id'])
+            if pod and action == 'recover':
+                self._reclaim_in_use_port(port, pod)
+        available_ports = [port for port in available_ports
+                           if port['id'] not in in_use_ports]
+        if not available_ports:
+            return
+
+        subnets = {}
+        for port in available_ports:
+            subnet_id = port['fixed_ips'][0]['subnet_id']
+            if subnet_id not in subnets:
+                subnets[subnet_id] = default_subnet._get_subnet(subnet_id)
 
+        attached_vifs = self._drv_vif._get_attached_vifs(
+            neutron, available_ports, subnets)
+        for host_addr, ports_vifs in attached_vifs.items():
             if trunk_ips and host_addr not in trunk_ips:
                 continue
 
-            for subport in trunk.get('sub_ports'):
-                kuryr_subport = None
-                for port in available_ports:
-                    if port['id'] == subport['port_id']:
-                        kuryr_subport = port
-                        break
-
-                if kuryr_subport:
-                    pool_key = (host_addr, kuryr_subport['project_id'],
-                                tuple(kuryr_subport['security_groups']))
-
-                    if action == 'recover':
-                        subnet_id = kuryr_subport['fixed_ips'][0]['subnet_id']
-                        subnet = {
-                            subnet_id: default_subnet._get_subnet(subnet_id)}
-                        vif = ovu.neutron_to_osvif_vif_nested_vlan(
-                            kuryr_subport, subnet, subport['segmentation_id'])
-
-                        self._existing_vifs[subport['port_id']] = vif
-                        self._available_ports_pools.setdefault(
-                            pool_key, []).append(subport['port_id'])
-                    elif action == 'free':
-                        try:
-                            self._drv_vif._remove_subport(neutron, trunk['id'],
-                                                          subport['port_id'])
-                            neutron.delete_port(subport['port_id'])
-                            self._drv_vif._release_vlan_id(
-                                subport['segmentation_id'])
-                            del self._existing_vifs[subport['port_id']]
-                            self._available_ports_pools[pool_key].remove(
-                                subport['port_id'])
-                        except n_exc.PortNotFoundClient:
-                            LOG.debug('Unable to release port %s as it no '
-                                      'longer exists.', subport['port_id'])
-                        except KeyError:
-                            LOG.debug('Port %s is not in the ports list.',
-                                      subport['port_id'])
-                        except n_exc.NeutronClientException:
-                            LOG.warning('Error removing the subport %s',
-                                        subport['port_id'])
-                        except ValueError:
-                            LOG.debug('Port %s is not in the available ports '
-                                      'pool.', subport['port_id'])
+            if action == 'recover':
+                for port, vif in ports_vifs:
+                    pool_key = (host_addr, port['project_id'],
+                                tuple(sorted(port['security_groups'])))
+                    self._existing_vifs[port['id']] = vif
+                    self._ports_attrs[port['id']] = {
+                        'name': port['name'],
+                        'security_groups': sorted(port['security_groups'])}
+                    self._available_ports_pools.setdefault(
+                        pool_key, []).append(port['id'])
+            elif action == 'free':
+                try:
+                    self._drv_vif._detach_vifs(
+                        neutron, host_addr, [vif for port, vif in ports_vifs])
+                except (n_exc.NeutronClientException,
+                        kl_exc.NoResourceException,
+                        exceptions.K8sNodeTrunkPortFailure):
+                    LOG.warning('Error detaching the ports of the VM with '
+                                'IP %s', host_addr)
+                    continue
+                for port, vif in ports_vifs:
+                    pool_key = (host_addr, port['project_id'],
+                                tuple(sorted(port['security_groups'])))
+                    self._forget_port(port['id'])
+                    self._existing_vifs.pop(port['id'], None)
+                    try:
+                        self._available_ports_pools[pool_key].remove(
+                            port['id'])
+                    except (KeyError, ValueError):
+                        LOG.debug('Port %s is not in the available ports '
+                                  'pool.', port['id'])
+                    try:
+                        neutron.delete_port(port['id'])
+                    except n_exc.PortNotFoundClient:
+                        LOG.debug('Unable to release port %s as it no '
+                                  'longer exists.', port['id'])
+                    except n_exc.NeutronClientException:
+                        LOG.warning('Error deleting port %s', port['id'])
 
     def force_populate_pool(self, trunk_ip, project_id, subnets,
                             security_groups, num_ports):
@@ -450,6 +838,8 @@ class NestedVIFPool(BaseVIFPool):
         pool_key = (trunk_ip, project_id, tuple(sorted(security_groups)))
         for vif in vifs:
             self._existing_vifs[vif.id] = vif
+            self._ports_attrs[vif.id] = self._get_available_port_attrs(
+                pool_key)
             self._available_ports_pools.setdefault(pool_key,
                                                    []).append(vif.id)
 
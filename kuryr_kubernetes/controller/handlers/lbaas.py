@@ -13,25 +13,38 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+
 from kuryr.lib._i18n import _
 from oslo_log import log as logging
 from oslo_serialization import jsonutils
+from oslo_utils import excutils
 
 from kuryr_kubernetes import clients
 from kuryr_kubernetes import constants as k_const
 from kuryr_kubernetes.controller.drivers import base as drv_base
+from kuryr_kubernetes.controller.drivers import utils as d_utils
 from kuryr_kubernetes import exceptions as k_exc
 from kuryr_kubernetes.handlers import k8s_base
 from kuryr_kubernetes.objects import lbaas as obj_lbaas
+from kuryr_kubernetes import utils
 
 LOG = logging.getLogger(__name__)
 
+# Number of subnets indexes kept by LBaaSSpecHandler, one per distinct set of
+# service subnets
+SUBNETS_INDEXES_SIZE = 32
+
 
 class LBaaSSpecHandler(k8s_base.ResourceEventHandler):
     """LBaaSSpecHandler handles K8s Service events.
 
     LBaaSSpecHandler handles K8s Service events and updates related Endpoints
     with LBaaSServiceSpec when necessary.
+
+    The subnet of the service IP is looked up in a CIDR index of the service
+    subnets, kept at _subnets_indexes for the last SUBNETS_INDEXES_SIZE sets
+    of subnets returned by the ServiceSubnetsDriver.
     """
 
     OBJECT_KIND = k_const.K8S_OBJ_SERVICE
@@ -40,6 +53,7 @@ class LBaaSSpecHandler(k8s_base.ResourceEventHandler):
         self._drv_project = drv_base.ServiceProjectDriver.get_instance()
         self._drv_subnets = drv_base.ServiceSubnetsDriver.get_instance()
         self._drv_sg = drv_base.ServiceSecurityGroupsDriver.get_instance()
+        self._subnets_indexes = collections.OrderedDict()
 
     def on_present(self, service):
         lbaas_spec = self._get_lbaas_spec(service)
@@ -66,11 +80,8 @@ class LBaaSSpecHandler(k8s_base.ResourceEventHandler):
 
     def _get_subnet_id(self, service, project_id, ip):
         subnets_mapping = self._drv_subnets.get_subnets(service, project_id)
-        subnet_ids = {
-            subnet_id
-            for subnet_id, network in subnets_mapping.items()
-            for subnet in network.subnets.objects
-            if ip in subnet.cidr}
+        subnets_index = self._get_subnets_index(subnets_mapping)
+        subnet_ids = set(subnets_index.lookup(ip))
 
         if len(subnet_ids) != 1:
             raise k_exc.IntegrityError(_(
@@ -81,6 +92,22 @@ class LBaaSSpecHandler(k8s_base.ResourceEventHandler):
 
         return subnet_ids.pop()
 
+    def _get_subnets_index(self, subnets_mapping):
+        # The CIDR of a Neutron subnet cannot be updated, so the index of a
+        # set of subnets stays valid as long as the set does not change
+        key = frozenset(subnets_mapping)
+        subnets_index = self._subnets_indexes.pop(key, None)
+        if subnets_index is None:
+            LOG.debug("Indexing the CIDRs of %d service subnets", len(key))
+            subnets_index = d_utils.CIDRIndex(
+                (subnet.cidr, subnet_id)
+                for subnet_id, network in subnets_mapping.items()
+                for subnet in network.subnets.objects)
+            while len(self._subnets_indexes) >= SUBNETS_INDEXES_SIZE:
+                self._subnets_indexes.popitem(last=False)
+        self._subnets_indexes[key] = subnets_index
+        return subnets_index
+
     def _generate_lbaas_spec(self, service):
         project_id = self._drv_project.get_project(service)
         ip = self._get_service_ip(service)
@@ -160,10 +187,8 @@ class LBaaSSpecHandler(k8s_base.ResourceEventHandler):
             LOG.debug("Removing LBaaSServiceSpec annotation: %r", lbaas_spec)
             annotation = None
         else:
-            lbaas_spec.obj_reset_changes(recursive=True)
             LOG.debug("Setting LBaaSServiceSpec annotation: %r", lbaas_spec)
-            annotation = jsonutils.dumps(lbaas_spec.obj_to_primitive(),
-                                         sort_keys=True)
+            annotation = utils.dump_annotation_obj(lbaas_spec)
         svc_link = service['metadata']['selfLink']
         ep_link = self._get_endpoints_link(service)
         k8s = clients.get_kubernetes_client()
@@ -186,8 +211,8 @@ class LBaaSSpecHandler(k8s_base.ResourceEventHandler):
             annotation = annotations[k_const.K8S_ANNOTATION_LBAAS_SPEC]
         except KeyError:
             return None
-        obj_dict = jsonutils.loads(annotation)
-        obj = obj_lbaas.LBaaSServiceSpec.obj_from_primitive(obj_dict)
+        obj = utils.load_annotation_obj(annotation,
+                                        obj_lbaas.LBaaSServiceSpec)
         LOG.debug("Got LBaaSServiceSpec from annotation: %r", obj)
         return obj
 
@@ -198,6 +223,14 @@ class LoadBalancerHandler(k8s_base.ResourceEventHandler):
     LoadBalancerHandler handles K8s Endpoints events and tracks changes in
     LBaaSServiceSpec to update Neutron LBaaS accordingly and to reflect its'
     actual state in LBaaSState.
+
+    The LBaaSState of each Endpoints is kept at _lbaas_states, keyed by the
+    Endpoints UID, along with the annotation it was last saved to (or loaded
+    from). The annotation is only decoded when the LBaaSState is not cached,
+    e.g., after a restart, and only written when the LBaaSState changes. The
+    cached LBaaSState is dropped if the handling of an event fails, as it may
+    have been partially updated, so that it is loaded again from the
+    annotation.
     """
 
     OBJECT_KIND = k_const.K8S_OBJ_ENDPOINTS
@@ -206,6 +239,7 @@ class LoadBalancerHandler(k8s_base.ResourceEventHandler):
         self._drv_lbaas = drv_base.LBaaSDriver.get_instance()
         self._drv_pod_project = drv_base.PodProjectDriver.get_instance()
         self._drv_pod_subnets = drv_base.PodSubnetsDriver.get_instance()
+        self._lbaas_states = {}
 
     def on_present(self, endpoints):
         lbaas_spec = self._get_lbaas_spec(endpoints)
@@ -216,21 +250,27 @@ class LoadBalancerHandler(k8s_base.ResourceEventHandler):
         if not lbaas_state:
             lbaas_state = obj_lbaas.LBaaSState()
 
-        if self._sync_lbaas_members(endpoints, lbaas_state, lbaas_spec):
-            # REVISIT(ivc): since _sync_lbaas_members is responsible for
-            # creating all lbaas components (i.e. load balancer, listeners,
-            # pools, members), it is currently possible for it to fail (due
-            # to invalid Kuryr/K8s/Neutron configuration, e.g. Members' IPs
-            # not belonging to configured Neutron subnet or Service IP being
-            # in use by gateway or VMs) leaving some Neutron entities without
-            # properly updating annotation. Some sort of failsafe mechanism is
-            # required to deal with such situations (e.g. cleanup, or skip
-            # failing items, or validate configuration) to prevent annotation
-            # being out of sync with the actual Neutron state.
-            self._set_lbaas_state(endpoints, lbaas_state)
+        try:
+            if self._sync_lbaas_members(endpoints, lbaas_state, lbaas_spec):
+                # REVISIT(ivc): since _sync_lbaas_members is responsible for
+                # creating all lbaas components (i.e. load balancer,
+                # listeners, pools, members), it is currently possible for it
+                # to fail (due to invalid Kuryr/K8s/Neutron configuration,
+                # e.g. Members' IPs not belonging to configured Neutron subnet
+                # or Service IP being in use by gateway or VMs) leaving some
+                # Neutron entities without properly updating annotation. Some
+                # sort of failsafe mechanism is required to deal with such
+                # situations (e.g. cleanup, or skip failing items, or validate
+                # configuration) to prevent annotation being out of sync with
+                # the actual Neutron state.
+                self._set_lbaas_state(endpoints, lbaas_state)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self._drop_lbaas_state(endpoints)
 
     def on_deleted(self, endpoints):
         lbaas_state = self._get_lbaas_state(endpoints)
+        self._drop_lbaas_state(endpoints)
         if not lbaas_state:
             return
         # NOTE(ivc): deleting pool deletes its members
@@ -261,28 +301,55 @@ class LoadBalancerHandler(k8s_base.ResourceEventHandler):
     def _sync_lbaas_members(self, endpoints, lbaas_state, lbaas_spec):
         changed = False
 
+        if self._add_populated_loadbalancer(endpoints, lbaas_state,
+                                            lbaas_spec):
+            changed = True
+
         if self._remove_unused_members(endpoints, lbaas_state, lbaas_spec):
             changed = True
 
         if self._sync_lbaas_pools(endpoints, lbaas_state, lbaas_spec):
             changed = True
 
-        if self._add_new_members(endpoints, lbaas_state, lbaas_spec):
+        if self._update_members(endpoints, lbaas_state, lbaas_spec):
             changed = True
 
         return changed
 
-    def _add_new_members(self, endpoints, lbaas_state, lbaas_spec):
-        changed = False
-
-        lsnr_by_id = {l.id: l for l in lbaas_state.listeners}
-        pool_by_lsnr_port = {(lsnr_by_id[p.listener_id].protocol,
-                              lsnr_by_id[p.listener_id].port): p
-                             for p in lbaas_state.pools}
-        pool_by_tgt_name = {p.name: pool_by_lsnr_port[p.protocol, p.port]
-                            for p in lbaas_spec.ports}
-        current_targets = {(str(m.ip), m.port) for m in lbaas_state.members}
-
+    def _add_populated_loadbalancer(self, endpoints, lbaas_state,
+                                    lbaas_spec):
+        if (lbaas_state.loadbalancer or lbaas_state.listeners or
+                not lbaas_spec.ip):
+            return False
+
+        targets = self._get_targets(endpoints, lbaas_spec)
+        populated_state = self._drv_lbaas.ensure_populated_loadbalancer(
+            endpoints=endpoints,
+            project_id=lbaas_spec.project_id,
+            subnet_id=lbaas_spec.subnet_id,
+            ip=lbaas_spec.ip,
+            security_groups_ids=lbaas_spec.security_groups_ids,
+            targets={(p.protocol, p.port): targets.get((p.protocol, p.port),
+                                                       {})
+                     for p in lbaas_spec.ports})
+        if not populated_state:
+            return False
+
+        lbaas_state.loadbalancer = populated_state.loadbalancer
+        lbaas_state.listeners = populated_state.listeners
+        lbaas_state.pools = populated_state.pools
+        lbaas_state.members = populated_state.members
+        return True
+
+    def _get_targets(self, endpoints, lbaas_spec):
+        """Returns the Pod targets of each service port of the spec.
+
+        :returns: dictionary of the targets of each (protocol, port) of the
+                  service, as dictionaries with the ObjectReference of each
+                  target keyed by its (ip, port)
+        """
+        spec_ports = {p.name: (p.protocol, p.port) for p in lbaas_spec.ports}
+        targets = collections.defaultdict(dict)
         for subset in endpoints.get('subsets', []):
             subset_ports = subset.get('ports', [])
             for subset_address in subset.get('addresses', []):
@@ -295,50 +362,68 @@ class LoadBalancerHandler(k8s_base.ResourceEventHandler):
                     continue
 
                 for subset_port in subset_ports:
-                    target_port = subset_port['port']
-                    if (target_ip, target_port) in current_targets:
-                        continue
-                    port_name = subset_port.get('name')
-                    pool = pool_by_tgt_name[port_name]
-                    # We use the service subnet id so that the connectivity
-                    # from VIP to pods happens in layer 3 mode, i.e., routed.
-                    # TODO(apuimedo): Add L2 mode
-                    # TODO(apuimedo): Do not pass subnet_id at all when in
-                    # L3 mode once old neutron-lbaasv2 is not supported, as
-                    # octavia does not require it
-                    member_subnet_id = lbaas_state.loadbalancer.subnet_id
-                    member = self._drv_lbaas.ensure_member(
-                        endpoints=endpoints,
-                        loadbalancer=lbaas_state.loadbalancer,
-                        pool=pool,
-                        subnet_id=member_subnet_id,
-                        ip=target_ip,
-                        port=target_port,
-                        target_ref=target_ref)
-                    lbaas_state.members.append(member)
-                    changed = True
+                    spec_port = spec_ports.get(subset_port.get('name'))
+                    if spec_port:
+                        targets[spec_port][
+                            target_ip, subset_port['port']] = target_ref
+        return targets
+
+    def _get_pools_targets(self, endpoints, lbaas_state, lbaas_spec):
+        targets = self._get_targets(endpoints, lbaas_spec)
+        lsnr_by_id = {l.id: l for l in lbaas_state.listeners}
+        return {p.id: targets.get((lsnr_by_id[p.listener_id].protocol,
+                                   lsnr_by_id[p.listener_id].port), {})
+                for p in lbaas_state.pools}
+
+    def _update_pool_members(self, endpoints, lbaas_state, pool, targets):
+        members = [m for m in lbaas_state.members if m.pool_id == pool.id]
+        if {(str(m.ip), m.port) for m in members} == set(targets):
+            return False
+
+        # We use the service subnet id so that the connectivity
+        # from VIP to pods happens in layer 3 mode, i.e., routed.
+        # TODO(apuimedo): Add L2 mode
+        # TODO(apuimedo): Do not pass subnet_id at all when in
+        # L3 mode once old neutron-lbaasv2 is not supported, as
+        # octavia does not require it
+        member_subnet_id = lbaas_state.loadbalancer.subnet_id
+        pool_members = self._drv_lbaas.update_members(
+            endpoints=endpoints,
+            loadbalancer=lbaas_state.loadbalancer,
+            pool=pool,
+            subnet_id=member_subnet_id,
+            members=members,
+            targets=targets)
+        lbaas_state.members = [m for m in lbaas_state.members
+                               if m.pool_id != pool.id] + pool_members
+        return True
+
+    def _update_members(self, endpoints, lbaas_state, lbaas_spec):
+        changed = False
+
+        pools_targets = self._get_pools_targets(endpoints, lbaas_state,
+                                                lbaas_spec)
+        for pool in lbaas_state.pools:
+            targets = pools_targets[pool.id]
+            if targets and self._update_pool_members(
+                    endpoints, lbaas_state, pool, targets):
+                changed = True
 
         return changed
 
     def _remove_unused_members(self, endpoints, lbaas_state, lbaas_spec):
-        spec_port_names = {p.name for p in lbaas_spec.ports}
-        current_targets = {(a['ip'], p['port'])
-                           for s in endpoints['subsets']
-                           for a in s['addresses']
-                           for p in s['ports']
-                           if p.get('name') in spec_port_names}
-        removed_ids = set()
-        for member in lbaas_state.members:
-            if (str(member.ip), member.port) in current_targets:
-                continue
-            self._drv_lbaas.release_member(endpoints,
-                                           lbaas_state.loadbalancer,
-                                           member)
-            removed_ids.add(member.id)
-        if removed_ids:
-            lbaas_state.members = [m for m in lbaas_state.members
-                                   if m.id not in removed_ids]
-        return bool(removed_ids)
+        # The members of the pools that keep any target are updated by
+        # _update_members, so that each pool is updated once per sync
+        changed = False
+
+        pools_targets = self._get_pools_targets(endpoints, lbaas_state,
+                                                lbaas_spec)
+        for pool in lbaas_state.pools:
+            if not pools_targets[pool.id] and self._update_pool_members(
+                    endpoints, lbaas_state, pool, {}):
+                changed = True
+
+        return changed
 
     def _sync_lbaas_pools(self, endpoints, lbaas_state, lbaas_spec):
         changed = False
@@ -464,34 +549,51 @@ class LoadBalancerHandler(k8s_base.ResourceEventHandler):
             annotation = annotations[k_const.K8S_ANNOTATION_LBAAS_SPEC]
         except KeyError:
             return None
-        obj_dict = jsonutils.loads(annotation)
-        obj = obj_lbaas.LBaaSServiceSpec.obj_from_primitive(obj_dict)
+        obj = utils.load_annotation_obj(annotation,
+                                        obj_lbaas.LBaaSServiceSpec)
         LOG.debug("Got LBaaSServiceSpec from annotation: %r", obj)
         return obj
 
     def _set_lbaas_state(self, endpoints, lbaas_state):
         # TODO(ivc): extract annotation interactions
+        uid = endpoints['metadata']['uid']
         if lbaas_state is None:
-            LOG.debug("Removing LBaaSState annotation: %r", lbaas_state)
             annotation = None
         else:
-            lbaas_state.obj_reset_changes(recursive=True)
-            LOG.debug("Setting LBaaSState annotation: %r", lbaas_state)
-            annotation = jsonutils.dumps(lbaas_state.obj_to_primitive(),
-                                         sort_keys=True)
-        k8s = clients.get_kubernetes_client()
-        k8s.annotate(endpoints['metadata']['selfLink'],
-                     {k_const.K8S_ANNOTATION_LBAAS_STATE: annotation},
-                     resource_version=endpoints['metadata']['resourceVersion'])
+            annotation = utils.dump_annotation_obj(lbaas_state)
+        _, saved_annotation = self._lbaas_states.pop(uid, (None, None))
+        if annotation != saved_annotation:
+            if annotation is None:
+                LOG.debug("Removing LBaaSState annotation: %r", lbaas_state)
+            else:
+                LOG.debug("Setting LBaaSState annotation: %r", lbaas_state)
+            k8s = clients.get_kubernetes_client()
+            k8s.annotate(endpoints['metadata']['selfLink'],
+                         {k_const.K8S_ANNOTATION_LBAAS_STATE: annotation},
+                         resource_version=endpoints['metadata'][
+                             'resourceVersion'])
+        if lbaas_state is not None:
+            self._lbaas_states[uid] = (lbaas_state, annotation)
 
     def _get_lbaas_state(self, endpoints):
         # TODO(ivc): same as '_set_lbaas_state'
+        uid = endpoints['metadata']['uid']
+        try:
+            return self._lbaas_states[uid][0]
+        except KeyError:
+            pass
         try:
             annotations = endpoints['metadata']['annotations']
             annotation = annotations[k_const.K8S_ANNOTATION_LBAAS_STATE]
         except KeyError:
             return None
+        # The LBaaSState is updated in place while syncing the load balancer,
+        # so it is not taken from the (shared) annotations cache
         obj_dict = jsonutils.loads(annotation)
         obj = obj_lbaas.LBaaSState.obj_from_primitive(obj_dict)
         LOG.debug("Got LBaaSState from annotation: %r", obj)
+        self._lbaas_states[uid] = (obj, annotation)
         return obj
+
+    def _drop_lbaas_state(self, endpoints):
+        self._lbaas_states.pop(endpoints['metadata']['uid'], None)
@@ -0,0 +1,127 @@
+# Copyright (c) 2017 Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from oslo_config import cfg as oslo_cfg
+from oslo_log import log as logging
+
+from kuryr_kubernetes import constants
+from kuryr_kubernetes.controller.drivers import base as drivers
+from kuryr_kubernetes.handlers import k8s_base
+from kuryr_kubernetes import utils
+
+LOG = logging.getLogger(__name__)
+
+
+class NodeHandler(k8s_base.ResourceEventHandler):
+    """Manages the ports pools of the Kubernetes nodes.
+
+    `NodeHandler` asks the VIF pool driver to populate the pool of the
+    default project and security groups of every node, both for the nodes
+    already in the cluster when the controller starts (as they are reported
+    by the initial watch events) and for the ones joining it later on. That
+    way the ports needed by the first pods of each node are ready before the
+    pods are scheduled.
+
+    Conversely, the pools of the nodes that are deleted or cordoned are
+    released, so that the ports (and IPs) kept in the pools scale with the
+    nodes that can actually get new pods.
+
+    The pools are only populated if `ports_pool_prewarm` is set and a pool
+    driver other than 'noop' is used, so that the drivers are not queried
+    for nodes whose pools are not going to be populated.
+    """
+
+    OBJECT_KIND = constants.K8S_OBJ_NODE
+
+    def __init__(self):
+        self._drv_project = drivers.PodProjectDriver.get_instance()
+        self._drv_subnets = drivers.PodSubnetsDriver.get_instance()
+        self._drv_sg = drivers.PodSecurityGroupsDriver.get_instance()
+        self._drv_vif_pool = drivers.VIFPoolDriver.get_instance()
+        self._drv_vif_pool.set_vif_driver(
+            drivers.PodVIFDriver.get_instance())
+        self._unschedulable_nodes = set()
+
+    def on_added(self, node):
+        if self._is_unschedulable(node):
+            self._unschedulable_nodes.add(node['metadata']['name'])
+            self._release_pools(node)
+        else:
+            self._populate_pool(node)
+
+    def on_modified(self, node):
+        # Nodes get modified every few seconds due to their status
+        # updates, so only the changes of their schedulability are handled
+        name = node['metadata']['name']
+        if self._is_unschedulable(node):
+            if name not in self._unschedulable_nodes:
+                self._unschedulable_nodes.add(name)
+                self._release_pools(node)
+        elif name in self._unschedulable_nodes:
+            self._unschedulable_nodes.discard(name)
+            self._populate_pool(node)
+
+    def on_deleted(self, node):
+        self._unschedulable_nodes.discard(node['metadata']['name'])
+        self._release_pools(node)
+
+    @staticmethod
+    def _is_unschedulable(node):
+        return node['spec'].get('unschedulable', False)
+
+    @staticmethod
+    def _is_prewarm_enabled():
+        return (oslo_cfg.CONF.vif_pool.ports_pool_prewarm and
+                oslo_cfg.CONF.kubernetes.vif_pool_driver != 'noop')
+
+    def _populate_pool(self, node):
+        pod = self._get_node_pod(node)
+        if not pod:
+            LOG.debug("Node %s has no internal IP yet, skipping its pools",
+                      node['metadata']['name'])
+            return
+
+        self._drv_vif_pool.resume_pools(pod['status']['hostIP'])
+        if not self._is_prewarm_enabled():
+            return
+
+        project_id = self._drv_project.get_project(pod)
+        security_groups = self._drv_sg.get_security_groups(pod, project_id)
+        subnets = self._drv_subnets.get_subnets(pod, project_id)
+        self._drv_vif_pool.populate_pool(pod, project_id, subnets,
+                                         security_groups)
+
+    def _release_pools(self, node):
+        host_ip = utils.get_node_ip(node)
+        if host_ip:
+            LOG.info("Releasing the ports pools of node %s",
+                     node['metadata']['name'])
+            self._drv_vif_pool.release_pools(host_ip)
+
+    @staticmethod
+    def _get_node_pod(node):
+        """Returns a Pod-like object standing for any pod on the node.
+
+        It holds just the fields the drivers need to pick the pool and create
+        the ports for the node, without being bound to any actual pod.
+        """
+        host_ip = utils.get_node_ip(node)
+        if not host_ip:
+            return None
+        return {'metadata': {'name': node['metadata']['name'],
+                             'namespace': '',
+                             'uid': ''},
+                'spec': {'nodeName': node['metadata']['name']},
+                'status': {'hostIP': host_ip}}
@@ -13,7 +13,6 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-from os_vif import objects as obj_vif
 from oslo_log import log as logging
 from oslo_serialization import jsonutils
 
@@ -22,6 +21,7 @@ from kuryr_kubernetes import constants
 from kuryr_kubernetes.controller.drivers import base as drivers
 from kuryr_kubernetes import exceptions as k_exc
 from kuryr_kubernetes.handlers import k8s_base
+from kuryr_kubernetes import vif_annotation as vif_annot
 
 LOG = logging.getLogger(__name__)
 
@@ -35,6 +35,10 @@ class VIFHandler(k8s_base.ResourceEventHandler):
     (which are responsible for managing Neutron resources) to define the VIF
     object and pass it to the CNI driver in form of the Kubernetes pod
     annotation.
+
+    The project and security groups the VIF was requested with are kept on
+    another pod annotation, so that the VIF can be released to the right
+    pool without looking them up again once the pod is deleted.
     """
 
     OBJECT_KIND = constants.K8S_OBJ_POD
@@ -68,7 +72,7 @@ class VIFHandler(k8s_base.ResourceEventHandler):
             vif = self._drv_vif_pool.request_vif(pod, project_id, subnets,
                                                  security_groups)
             try:
-                self._set_vif(pod, vif)
+                self._set_vif(pod, vif, project_id, security_groups)
             except k_exc.K8sClientException as ex:
                 LOG.debug("Failed to set annotation: %s", ex)
                 # FIXME(ivc): improve granularity of K8sClient exceptions:
@@ -76,6 +80,8 @@ class VIFHandler(k8s_base.ResourceEventHandler):
                 self._drv_vif_pool.release_vif(pod, vif, project_id,
                                                security_groups)
         elif not vif.active:
+            # The annotation VIF is shared with the annotations cache
+            vif = vif.obj_clone()
             self._drv_vif_pool.activate_vif(pod, vif)
             self._set_vif(pod, vif)
 
@@ -86,10 +92,16 @@ class VIFHandler(k8s_base.ResourceEventHandler):
         vif = self._get_vif(pod)
 
         if vif:
-            project_id = self._drv_project.get_project(pod)
-            security_groups = self._drv_sg.get_security_groups(pod, project_id)
+            project_id, security_groups = self._get_vif_pool_attrs(pod)
+            if project_id is None:
+                project_id = self._drv_project.get_project(pod)
+                security_groups = self._drv_sg.get_security_groups(
+                    pod, project_id)
             self._drv_vif_pool.release_vif(pod, vif, project_id,
                                            security_groups)
+            vif_annot.release_vif(
+                pod['metadata']['annotations'][constants.K8S_ANNOTATION_VIF],
+                pod['metadata']['namespace'])
 
     @staticmethod
     def _is_host_network(pod):
@@ -104,19 +116,24 @@ class VIFHandler(k8s_base.ResourceEventHandler):
         except KeyError:
             return False
 
-    def _set_vif(self, pod, vif):
+    def _set_vif(self, pod, vif, project_id=None, security_groups=None):
         # TODO(ivc): extract annotation interactions
         if vif is None:
             LOG.debug("Removing VIF annotation: %r", vif)
-            annotation = None
+            annotations = {constants.K8S_ANNOTATION_VIF: None,
+                           constants.K8S_ANNOTATION_VIF_POOL: None}
         else:
-            vif.obj_reset_changes(recursive=True)
             LOG.debug("Setting VIF annotation: %r", vif)
-            annotation = jsonutils.dumps(vif.obj_to_primitive(),
-                                         sort_keys=True)
+            annotations = {
+                constants.K8S_ANNOTATION_VIF: vif_annot.dump_vif(
+                    vif, pod['metadata']['namespace'])}
+            if project_id is not None:
+                annotations[constants.K8S_ANNOTATION_VIF_POOL] = (
+                    jsonutils.dumps({'project_id': project_id,
+                                     'security_groups': security_groups},
+                                    sort_keys=True))
         k8s = clients.get_kubernetes_client()
-        k8s.annotate(pod['metadata']['selfLink'],
-                     {constants.K8S_ANNOTATION_VIF: annotation},
+        k8s.annotate(pod['metadata']['selfLink'], annotations,
                      resource_version=pod['metadata']['resourceVersion'])
 
     def _get_vif(self, pod):
@@ -126,7 +143,21 @@ class VIFHandler(k8s_base.ResourceEventHandler):
             vif_annotation = annotations[constants.K8S_ANNOTATION_VIF]
         except KeyError:
             return None
-        vif_dict = jsonutils.loads(vif_annotation)
-        vif = obj_vif.vif.VIFBase.obj_from_primitive(vif_dict)
+        vif = vif_annot.load_vif(vif_annotation, pod['metadata']['namespace'])
         LOG.debug("Got VIF from annotation: %r", vif)
         return vif
+
+    def _get_vif_pool_attrs(self, pod):
+        """Returns the project and security groups the VIF was requested with.
+
+        :returns: (project_id, security_groups) tuple, with None values if the
+                  pod has no such annotation, e.g., it was annotated by an
+                  older version
+        """
+        try:
+            annotations = pod['metadata']['annotations']
+            pool_annotation = annotations[constants.K8S_ANNOTATION_VIF_POOL]
+        except KeyError:
+            return None, None
+        pool_attrs = jsonutils.loads(pool_annotation)
+        return pool_attrs['project_id'], pool_attrs['security_groups']
@@ -23,6 +23,7 @@ from kuryr_kubernetes import clients
 from kuryr_kubernetes import config
 from kuryr_kubernetes import constants
 from kuryr_kubernetes.controller.handlers import lbaas as h_lbaas
+from kuryr_kubernetes.controller.handlers import node as h_node
 from kuryr_kubernetes.controller.handlers import pipeline as h_pipeline
 from kuryr_kubernetes.controller.handlers import vif as h_vif
 from kuryr_kubernetes import objects
@@ -41,11 +42,12 @@ class KuryrK8sService(service.Service):
         pipeline = h_pipeline.ControllerPipeline(self.tg)
         self.watcher = watcher.Watcher(pipeline, self.tg)
         # TODO(ivc): pluggable resource/handler registration
-        for resource in ["pods", "services", "endpoints"]:
+        for resource in ["pods", "services", "endpoints", "nodes"]:
             self.watcher.add("%s/%s" % (constants.K8S_API_BASE, resource))
         pipeline.register(h_vif.VIFHandler())
         pipeline.register(h_lbaas.LBaaSSpecHandler())
         pipeline.register(h_lbaas.LoadBalancerHandler())
+        pipeline.register(h_node.NodeHandler())
 
     def start(self):
         LOG.info("Service '%s' starting", self.__class__.__name__)
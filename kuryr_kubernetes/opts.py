@@ -15,14 +15,20 @@ from oslo_log import _options
 
 from kuryr.lib import opts as lib_opts
 from kuryr_kubernetes import config
+from kuryr_kubernetes.controller.drivers import default_subnet
+from kuryr_kubernetes.controller.drivers import lbaasv2
 from kuryr_kubernetes.controller.drivers import nested_vif
+from kuryr_kubernetes.controller.drivers import neutron_vif
 from kuryr_kubernetes.controller.drivers import vif_pool
 
 _kuryr_k8s_opts = [
     ('kubernetes', config.k8s_opts),
     ('kuryr-kubernetes', config.kuryr_k8s_opts),
     ('neutron_defaults', config.neutron_defaults),
+    ('lbaasv2', lbaasv2.lbaasv2_driver_opts),
     ('pod_vif_nested', nested_vif.nested_vif_driver_opts),
+    ('pod_vif_neutron', neutron_vif.neutron_vif_driver_opts),
+    ('subnet_cache', default_subnet.subnet_cache_opts),
     ('vif_pool', vif_pool.vif_pool_driver_opts),
 ]
 
@@ -89,6 +89,26 @@ def _neutron_to_osvif_routes(neutron_routes):
     return osv_route.RouteList(objects=obj_list)
 
 
+def _copy_obj(obj, exclude=()):
+    """Makes a shallow copy of an os-vif object.
+
+    Unlike obj_clone, the copy shares the values of the fields holding other
+    objects (e.g., the Subnet routes) with the original object, so that the
+    VIFs made from the same subnets mapping do not hold identical copies of
+    them. Those shared values are not meant to be modified.
+
+    :param obj: os-vif object to copy
+    :param exclude: names of the fields not to be copied
+    :return: a new os-vif object of the same class as 'obj'
+    """
+
+    copy = obj.__class__()
+    for field in obj.fields:
+        if field not in exclude and obj.obj_attr_is_set(field):
+            setattr(copy, field, getattr(obj, field))
+    return copy
+
+
 def _make_vif_subnet(subnets, subnet_id):
     """Makes a copy of an os-vif Subnet from subnets mapping.
 
@@ -106,7 +126,7 @@ def _make_vif_subnet(subnets, subnet_id):
             'subnet_id': subnet_id,
             'num_subnets': len(network.subnets.objects)})
 
-    subnet = network.subnets.objects[0].obj_clone()
+    subnet = _copy_obj(network.subnets.objects[0], exclude=('ips',))
     subnet.ips = osv_fixed_ip.FixedIPList(objects=[])
     return subnet
 
@@ -155,7 +175,8 @@ def _make_vif_network(neutron_port, subnets):
     """
 
     try:
-        network = next(net.obj_clone() for net in subnets.values()
+        network = next(_copy_obj(net, exclude=('subnets',))
+                       for net in subnets.values()
                        if net.id == neutron_port.get('network_id'))
     except StopIteration:
         raise k_exc.IntegrityError(_(
@@ -18,6 +18,7 @@ import mock
 import six
 
 from kuryr_kubernetes.controller.drivers import base as d_base
+from kuryr_kubernetes.objects import lbaas as obj_lbaas
 from kuryr_kubernetes.tests import base as test_base
 
 
@@ -81,3 +82,30 @@ class TestDriverBase(test_base.TestCase):
         self.assertRaises(TypeError, _TestDriver.get_instance)
         m_cfg.assert_not_called()
         m_stv_mgr.assert_not_called()
+
+
+class TestLBaaSDriver(test_base.TestCase):
+
+    def test_update_members(self):
+        m_driver = mock.Mock(spec=d_base.LBaaSDriver)
+        endpoints = mock.sentinel.endpoints
+        loadbalancer = mock.sentinel.loadbalancer
+        pool = mock.sentinel.pool
+        subnet_id = mock.sentinel.subnet_id
+        kept = obj_lbaas.LBaaSMember(ip='1.2.3.4', port=1234)
+        released = obj_lbaas.LBaaSMember(ip='1.2.3.5', port=1234)
+        target_ref = mock.sentinel.target_ref
+        new = mock.sentinel.new_member
+        m_driver.ensure_member.return_value = new
+
+        ret = d_base.LBaaSDriver.update_members(
+            m_driver, endpoints, loadbalancer, pool, subnet_id,
+            [kept, released], {('1.2.3.4', 1234): target_ref,
+                               ('1.2.3.6', 1234): target_ref})
+
+        self.assertEqual([kept, new], ret)
+        m_driver.release_member.assert_called_once_with(
+            endpoints, loadbalancer, released)
+        m_driver.ensure_member.assert_called_once_with(
+            endpoints, loadbalancer, pool, subnet_id, '1.2.3.6', 1234,
+            target_ref)
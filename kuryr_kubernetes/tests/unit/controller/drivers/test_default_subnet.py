@@ -87,7 +87,7 @@ class TestGetSubnet(test_base.TestCase):
 
     @mock.patch('kuryr_kubernetes.os_vif_util.neutron_to_osvif_network')
     @mock.patch('kuryr_kubernetes.os_vif_util.neutron_to_osvif_subnet')
-    def test_get_subnet(self, m_osv_subnet, m_osv_network):
+    def test_load_subnet(self, m_osv_subnet, m_osv_network):
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
         subnet = mock.MagicMock()
@@ -104,7 +104,7 @@ class TestGetSubnet(test_base.TestCase):
         m_osv_subnet.return_value = subnet
         m_osv_network.return_value = network
 
-        ret = default_subnet._get_subnet(subnet_id)
+        ret = default_subnet._load_subnet(subnet_id)
 
         self.assertEqual(network, ret)
         neutron.show_subnet.assert_called_once_with(subnet_id)
@@ -112,3 +112,43 @@ class TestGetSubnet(test_base.TestCase):
         m_osv_subnet.assert_called_once_with(neutron_subnet)
         m_osv_network.assert_called_once_with(neutron_network)
         network.subnets.objects.append.assert_called_once_with(subnet)
+
+    @mock.patch('kuryr_kubernetes.controller.drivers.default_subnet.'
+                '_subnets_cache', None)
+    @mock.patch('kuryr_kubernetes.controller.drivers.default_subnet.'
+                '_load_subnet')
+    def test_get_subnet(self, m_load_subnet):
+        network = mock.Mock()
+        m_load_subnet.return_value = network
+
+        self.assertEqual(network.obj_clone.return_value,
+                         default_subnet._get_subnet('subnet1'))
+        self.assertEqual(network.obj_clone.return_value,
+                         default_subnet._get_subnet('subnet1'))
+
+        m_load_subnet.assert_called_once_with('subnet1')
+        self.assertEqual(2, network.obj_clone.call_count)
+
+    @mock.patch('kuryr_kubernetes.controller.drivers.default_subnet.'
+                '_subnets_cache', None)
+    @mock.patch('kuryr_kubernetes.controller.drivers.default_subnet.'
+                '_load_subnet')
+    def test_get_subnet_invalidated(self, m_load_subnet):
+
+        default_subnet._get_subnet('subnet1')
+        default_subnet.invalidate_subnet('subnet1')
+        default_subnet._get_subnet('subnet1')
+
+        self.assertEqual(2, m_load_subnet.call_count)
+
+    @mock.patch('kuryr_kubernetes.controller.drivers.default_subnet.'
+                '_load_subnet')
+    def test_get_subnet_no_cache(self, m_load_subnet):
+        cfg.CONF.set_override('ttl', 0, group='subnet_cache')
+        self.addCleanup(cfg.CONF.clear_override, 'ttl', group='subnet_cache')
+        network = mock.sentinel.network
+        m_load_subnet.return_value = network
+
+        self.assertEqual(network, default_subnet._get_subnet('subnet1'))
+        self.assertEqual(network, default_subnet._get_subnet('subnet1'))
+        self.assertEqual(2, m_load_subnet.call_count)
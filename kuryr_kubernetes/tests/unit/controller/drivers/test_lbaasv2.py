@@ -13,11 +13,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
 import mock
 
 from neutronclient.common import exceptions as n_exc
+from oslo_config import cfg as oslo_cfg
 
 from kuryr_kubernetes.controller.drivers import lbaasv2 as d_lbaasv2
+from kuryr_kubernetes.controller.drivers import utils as d_utils
 from kuryr_kubernetes import exceptions as k_exc
 from kuryr_kubernetes.objects import lbaas as obj_lbaas
 from kuryr_kubernetes.tests import base as test_base
@@ -68,6 +71,154 @@ class TestLBaaSv2Driver(test_base.TestCase):
                           m_driver, endpoints, project_id, subnet_id, ip,
                           sg_ids)
 
+    def _create_populated_loadbalancer(self, loadbalancer, subnet_id,
+                                       targets):
+        loadbalancer.id = '00EE9E11-91C2-41CF-8FD4-7970579E5C4C'
+        return loadbalancer
+
+    def _set_populated_create(self):
+        oslo_cfg.CONF.set_override('populated_loadbalancer_create', True,
+                                   group='lbaasv2')
+        self.addCleanup(oslo_cfg.CONF.clear_override,
+                        'populated_loadbalancer_create', group='lbaasv2')
+
+    def test_ensure_populated_loadbalancer_disabled(self):
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+
+        self.assertIsNone(cls.ensure_populated_loadbalancer(
+            m_driver, mock.sentinel.endpoints, mock.sentinel.project_id,
+            mock.sentinel.subnet_id, mock.sentinel.ip,
+            mock.sentinel.security_groups_ids, mock.sentinel.targets))
+        m_driver._create_populated_loadbalancer.assert_not_called()
+
+    def test_ensure_populated_loadbalancer(self):
+        self._set_populated_create()
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        m_driver._get_member_request.side_effect = functools.partial(
+            cls._get_member_request, m_driver)
+        endpoints = {'metadata': {'namespace': 'TEST_NAMESPACE',
+                                  'name': 'TEST_NAME'}}
+        project_id = 'TEST_PROJECT'
+        subnet_id = 'D3FA400A-F543-4B91-9CD3-047AF0CE42D1'
+        ip = '1.2.3.4'
+        target_ref = {'namespace': 'TEST_NAMESPACE', 'name': 'TEST_POD'}
+        targets = {('TCP', 80): {('10.0.0.5', 8080): target_ref}}
+        listener = obj_lbaas.LBaaSListener(
+            id='A57B7771-6050-4CA8-A63C-443493EC98AB', name='LISTENER')
+        pool = obj_lbaas.LBaaSPool(
+            id='D4F35594-27EB-4F4C-930C-31DD40F53B77', project_id=project_id)
+        m_driver._create_populated_loadbalancer.side_effect = (
+            self._create_populated_loadbalancer)
+        m_driver._find_listener.return_value = listener
+        m_driver._find_pool.return_value = pool
+        m_driver._find_members.return_value = pool
+
+        ret = cls.ensure_populated_loadbalancer(
+            m_driver, endpoints, project_id, subnet_id, ip,
+            mock.sentinel.security_groups_ids, targets)
+
+        loadbalancer = ret.loadbalancer
+        self.assertEqual('TEST_NAMESPACE/TEST_NAME', loadbalancer.name)
+        self.assertEqual(ip, str(loadbalancer.ip))
+        m_driver._create_populated_loadbalancer.assert_called_once_with(
+            loadbalancer, subnet_id, targets)
+        m_driver._wait_for_provisioning.assert_called_once_with(
+            loadbalancer, d_lbaasv2._ACTIVATION_TIMEOUT)
+        lsnr_request = m_driver._find_listener.call_args[0][0]
+        self.assertEqual('TEST_NAMESPACE/TEST_NAME:TCP:80', lsnr_request.name)
+        self.assertEqual(loadbalancer.id, lsnr_request.loadbalancer_id)
+        pool_request = m_driver._find_pool.call_args[0][0]
+        self.assertEqual(listener.id, pool_request.listener_id)
+        self.assertEqual([listener.id], [l.id for l in ret.listeners])
+        self.assertEqual([pool.id], [p.id for p in ret.pools])
+        self.assertEqual([('10.0.0.5', 8080, pool.id)],
+                         [(str(m.ip), m.port, m.pool_id)
+                          for m in ret.members])
+
+    def test_ensure_populated_loadbalancer_existing(self):
+        self._set_populated_create()
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        endpoints = {'metadata': {'namespace': 'TEST_NAMESPACE',
+                                  'name': 'TEST_NAME'}}
+        m_driver._create_populated_loadbalancer.return_value = None
+
+        self.assertIsNone(cls.ensure_populated_loadbalancer(
+            m_driver, endpoints, 'TEST_PROJECT',
+            'D3FA400A-F543-4B91-9CD3-047AF0CE42D1', '1.2.3.4',
+            mock.sentinel.security_groups_ids, {}))
+        m_driver._wait_for_provisioning.assert_not_called()
+
+    def test_ensure_populated_loadbalancer_not_ready(self):
+        self._set_populated_create()
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        endpoints = {'metadata': {'namespace': 'TEST_NAMESPACE',
+                                  'name': 'TEST_NAME'}}
+        m_driver._create_populated_loadbalancer.side_effect = (
+            self._create_populated_loadbalancer)
+        m_driver._find_listener.return_value = None
+
+        self.assertRaises(k_exc.ResourceNotReady,
+                          cls.ensure_populated_loadbalancer, m_driver,
+                          endpoints, 'TEST_PROJECT',
+                          'D3FA400A-F543-4B91-9CD3-047AF0CE42D1', '1.2.3.4',
+                          mock.sentinel.security_groups_ids,
+                          {('TCP', 80): {}})
+
+    def test_create_populated_loadbalancer(self):
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        loadbalancer = obj_lbaas.LBaaSLoadBalancer(
+            name='TEST_NAME', project_id='TEST_PROJECT', ip='1.2.3.4',
+            subnet_id='D3FA400A-F543-4B91-9CD3-047AF0CE42D1')
+        loadbalancer_id = '00EE9E11-91C2-41CF-8FD4-7970579E5C4C'
+        target_ref = {'namespace': 'TEST_NAMESPACE', 'name': 'TEST_POD'}
+        targets = {('TCP', 80): {('10.0.0.5', 8080): target_ref}}
+        neutron.create_loadbalancer.return_value = {
+            'loadbalancer': {'id': loadbalancer_id}}
+
+        ret = cls._create_populated_loadbalancer(
+            m_driver, loadbalancer, loadbalancer.subnet_id, targets)
+
+        self.assertEqual(loadbalancer, ret)
+        self.assertEqual(loadbalancer_id, ret.id)
+        neutron.create_loadbalancer.assert_called_once_with({
+            'loadbalancer': {
+                'name': 'TEST_NAME',
+                'project_id': 'TEST_PROJECT',
+                'tenant_id': 'TEST_PROJECT',
+                'vip_address': '1.2.3.4',
+                'vip_subnet_id': loadbalancer.subnet_id,
+                'listeners': [{
+                    'name': 'TEST_NAME:TCP:80',
+                    'protocol': 'TCP',
+                    'protocol_port': 80,
+                    'default_pool': {
+                        'name': 'TEST_NAME:TCP:80',
+                        'protocol': 'TCP',
+                        'lb_algorithm': 'ROUND_ROBIN',
+                        'members': [{
+                            'name': 'TEST_NAMESPACE/TEST_POD:8080',
+                            'subnet_id': loadbalancer.subnet_id,
+                            'address': '10.0.0.5',
+                            'protocol_port': 8080}]}}]}})
+
+    def test_create_populated_loadbalancer_conflict(self):
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        loadbalancer = obj_lbaas.LBaaSLoadBalancer(
+            name='TEST_NAME', project_id='TEST_PROJECT', ip='1.2.3.4',
+            subnet_id='D3FA400A-F543-4B91-9CD3-047AF0CE42D1')
+        neutron.create_loadbalancer.side_effect = n_exc.Conflict
+
+        self.assertIsNone(cls._create_populated_loadbalancer(
+            m_driver, loadbalancer, loadbalancer.subnet_id, {}))
+
     def test_release_loadbalancer(self):
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
         cls = d_lbaasv2.LBaaSv2Driver
@@ -175,6 +326,28 @@ class TestLBaaSv2Driver(test_base.TestCase):
         expected_resp = mock.sentinel.expected_resp
         endpoints = mock.sentinel.endpoints
         loadbalancer = mock.sentinel.loadbalancer
+        pool = mock.sentinel.pool
+        subnet_id = mock.sentinel.subnet_id
+        ip = mock.sentinel.ip
+        port = mock.sentinel.port
+        target_ref = mock.sentinel.target_ref
+        member = mock.sentinel.member
+        m_driver._get_member_request.return_value = member
+        m_driver._ensure_provisioned.return_value = expected_resp
+
+        resp = cls.ensure_member(m_driver, endpoints, loadbalancer, pool,
+                                 subnet_id, ip, port, target_ref)
+
+        m_driver._get_member_request.assert_called_once_with(
+            pool, subnet_id, ip, port, target_ref)
+        m_driver._ensure_provisioned.assert_called_once_with(
+            loadbalancer, member, m_driver._create_member,
+            m_driver._find_member)
+        self.assertEqual(expected_resp, resp)
+
+    def test_get_member_request(self):
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
         pool = obj_lbaas.LBaaSPool(project_id='TEST_PROJECT',
                                    id='D4F35594-27EB-4F4C-930C-31DD40F53B77')
         subnet_id = 'D3FA400A-F543-4B91-9CD3-047AF0CE42D1'
@@ -183,22 +356,171 @@ class TestLBaaSv2Driver(test_base.TestCase):
         namespace = 'TEST_NAMESPACE'
         name = 'TEST_NAME'
         target_ref = {'namespace': namespace, 'name': name}
-        m_driver._ensure_provisioned.return_value = expected_resp
 
-        resp = cls.ensure_member(m_driver, endpoints, loadbalancer, pool,
-                                 subnet_id, ip, port, target_ref)
+        member = cls._get_member_request(m_driver, pool, subnet_id, ip, port,
+                                         target_ref)
 
-        m_driver._ensure_provisioned.assert_called_once_with(
-            loadbalancer, mock.ANY, m_driver._create_member,
-            m_driver._find_member)
-        member = m_driver._ensure_provisioned.call_args[0][1]
         self.assertEqual("%s/%s:%s" % (namespace, name, port), member.name)
         self.assertEqual(pool.project_id, member.project_id)
         self.assertEqual(pool.id, member.pool_id)
         self.assertEqual(subnet_id, member.subnet_id)
         self.assertEqual(ip, str(member.ip))
         self.assertEqual(port, member.port)
-        self.assertEqual(expected_resp, resp)
+        self.assertFalse(member.obj_attr_is_set('id'))
+
+    _MEMBER_IDS = ['3A70CEC0-392D-4BC1-A27C-06E63A0FD54F',
+                   '4A70CEC0-392D-4BC1-A27C-06E63A0FD54F']
+
+    def _get_member(self, ip, port, member_id=None):
+        member = obj_lbaas.LBaaSMember(
+            name='TEST_NAME', project_id='TEST_PROJECT', ip=ip, port=port,
+            subnet_id='D3FA400A-F543-4B91-9CD3-047AF0CE42D1',
+            pool_id='D4F35594-27EB-4F4C-930C-31DD40F53B77')
+        if member_id:
+            member.id = member_id
+        return member
+
+    @mock.patch('kuryr_kubernetes.controller.drivers.base.LBaaSDriver'
+                '.update_members')
+    def test_update_members_no_batch(self, m_update_members):
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        args = (mock.sentinel.endpoints, mock.sentinel.loadbalancer,
+                mock.sentinel.pool, mock.sentinel.subnet_id,
+                mock.sentinel.members, mock.sentinel.targets)
+
+        ret = cls.update_members(m_driver, *args)
+
+        self.assertEqual(m_update_members.return_value, ret)
+        m_update_members.assert_called_once_with(*args)
+        m_driver._ensure_provisioned.assert_not_called()
+
+    def test_update_members_batch(self):
+        member_ids = self._MEMBER_IDS
+        self.useFixture(k_fix.MockNeutronClient())
+        oslo_cfg.CONF.set_override('batch_member_update', True,
+                                   group='lbaasv2')
+        self.addCleanup(oslo_cfg.CONF.clear_override, 'batch_member_update',
+                        group='lbaasv2')
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        loadbalancer = mock.sentinel.loadbalancer
+        pool = mock.sentinel.pool
+        subnet_id = mock.sentinel.subnet_id
+        kept = self._get_member('1.2.3.4', 1234, member_ids[0])
+        released = self._get_member('1.2.3.5', 1234, member_ids[1])
+        new = self._get_member('1.2.3.6', 1234)
+        target_ref = mock.sentinel.target_ref
+        m_driver._get_member_request.return_value = new
+
+        ret = cls.update_members(m_driver, mock.sentinel.endpoints,
+                                 loadbalancer, pool, subnet_id,
+                                 [kept, released],
+                                 {('1.2.3.4', 1234): target_ref,
+                                  ('1.2.3.6', 1234): target_ref})
+
+        self.assertEqual([kept, new], ret)
+        m_driver._get_member_request.assert_called_once_with(
+            pool, subnet_id, '1.2.3.6', 1234, target_ref)
+        m_driver._ensure_members.assert_called_once_with(
+            loadbalancer, pool, [kept, new])
+
+    def test_ensure_members(self):
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = self._get_driver()
+        loadbalancer = mock.sentinel.loadbalancer
+        pool = mock.sentinel.pool
+        members = [mock.sentinel.member]
+        m_driver._provisioning_timer.return_value = [3, 2, 1]
+
+        cls._ensure_members(m_driver, loadbalancer, pool, members)
+
+        m_driver._wait_for_provisioning.assert_called_once_with(
+            loadbalancer, 3)
+        m_driver._replace_members.assert_called_once_with(pool, members)
+
+    def test_ensure_members_conflict(self):
+        # A Conflict on the replacement (e.g., immutable load balancer) does
+        # not mean the members got replaced, even if they all exist already
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        neutron.lbaas_members_path = '/lbaas/pools/%s/members'
+        neutron.put.side_effect = [n_exc.Conflict, None]
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = self._get_driver()
+        m_driver._replace_members.side_effect = functools.partial(
+            cls._replace_members, m_driver)
+        m_driver._provisioning_timer.return_value = [3, 2, 1]
+        loadbalancer = mock.sentinel.loadbalancer
+        pool = obj_lbaas.LBaaSPool(id='D4F35594-27EB-4F4C-930C-31DD40F53B77')
+        member = self._get_member('1.2.3.4', 1234)
+
+        cls._ensure_members(m_driver, loadbalancer, pool, [member])
+
+        self.assertEqual(2, neutron.put.call_count)
+        m_driver._wait_for_provisioning.assert_has_calls([
+            mock.call(loadbalancer, 3), mock.call(loadbalancer, 2)])
+        m_driver._find_members.assert_called_once_with(pool, [member])
+
+    def test_ensure_members_not_ready(self):
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = self._get_driver()
+        m_driver._provisioning_timer.return_value = [2, 1]
+        m_driver._replace_members.side_effect = n_exc.Conflict
+
+        self.assertRaises(k_exc.ResourceNotReady, cls._ensure_members,
+                          m_driver, mock.sentinel.loadbalancer,
+                          mock.sentinel.pool, [mock.sentinel.member])
+        self.assertEqual(2, m_driver._replace_members.call_count)
+
+    def test_replace_members(self):
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        neutron.lbaas_members_path = '/lbaas/pools/%s/members'
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        pool = obj_lbaas.LBaaSPool(id='D4F35594-27EB-4F4C-930C-31DD40F53B77')
+        member = self._get_member('1.2.3.4', 1234)
+
+        ret = cls._replace_members(m_driver, pool, [member])
+
+        self.assertEqual(m_driver._find_members.return_value, ret)
+        neutron.put.assert_called_once_with(
+            '/lbaas/pools/%s/members' % pool.id, body={'members': [
+                {'name': member.name, 'subnet_id': member.subnet_id,
+                 'address': '1.2.3.4', 'protocol_port': 1234}]})
+        m_driver._find_members.assert_called_once_with(pool, [member])
+
+    def test_find_members(self):
+        member_ids = self._MEMBER_IDS
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        pool = obj_lbaas.LBaaSPool(id='D4F35594-27EB-4F4C-930C-31DD40F53B77')
+        members = [self._get_member('1.2.3.4', 1234),
+                   self._get_member('1.2.3.5', 1234)]
+        neutron.list_lbaas_members.return_value = {'members': [
+            {'id': member_ids[0], 'address': '1.2.3.4', 'protocol_port': 1234},
+            {'id': member_ids[1], 'address': '1.2.3.5',
+             'protocol_port': 1234}]}
+
+        ret = cls._find_members(m_driver, pool, members)
+
+        self.assertEqual(pool, ret)
+        self.assertEqual(member_ids, [m.id for m in members])
+        neutron.list_lbaas_members.assert_called_once_with(pool.id)
+
+    def test_find_members_not_found(self):
+        member_ids = self._MEMBER_IDS
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        pool = obj_lbaas.LBaaSPool(id='D4F35594-27EB-4F4C-930C-31DD40F53B77')
+        members = [self._get_member('1.2.3.4', 1234),
+                   self._get_member('1.2.3.5', 1234)]
+        neutron.list_lbaas_members.return_value = {'members': [
+            {'id': member_ids[0], 'address': '1.2.3.4',
+             'protocol_port': 1234}]}
+
+        self.assertIsNone(cls._find_members(m_driver, pool, members))
 
     def test_release_member(self):
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
@@ -659,36 +981,97 @@ class TestLBaaSv2Driver(test_base.TestCase):
                          m_driver._wait_for_provisioning.call_count)
         self.assertEqual(call_count, m_delete.call_count)
 
+    def test_init(self):
+        driver = d_lbaasv2.LBaaSv2Driver()
+
+        self.assertIsInstance(driver._provisioning_poller,
+                              d_utils.StatusPoller)
+
+    def _get_driver(self):
+        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        m_driver._provisioning_poller = mock.Mock(spec=d_utils.StatusPoller)
+        return m_driver
+
     def test_wait_for_provisioning(self):
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
         cls = d_lbaasv2.LBaaSv2Driver
-        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        m_driver = self._get_driver()
         loadbalancer = mock.Mock()
-        timeout = mock.sentinel.timeout
-        timer = [mock.sentinel.t0, mock.sentinel.t1]
-        m_driver._provisioning_timer.return_value = timer
-        resp = {'loadbalancer': {'provisioning_status': 'ACTIVE'}}
-        neutron.show_loadbalancer.return_value = resp
+        m_driver._provisioning_poller.wait.return_value = 'ACTIVE'
 
-        cls._wait_for_provisioning(m_driver, loadbalancer, timeout)
+        cls._wait_for_provisioning(m_driver, loadbalancer, 10)
 
-        neutron.show_loadbalancer.assert_called_once_with(loadbalancer.id)
+        m_driver._provisioning_poller.wait.assert_called_once_with(
+            loadbalancer.id, ('ACTIVE',), mock.ANY)
+        neutron.show_loadbalancer.assert_not_called()
 
     def test_wait_for_provisioning_not_ready(self):
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
         cls = d_lbaasv2.LBaaSv2Driver
-        m_driver = mock.Mock(spec=d_lbaasv2.LBaaSv2Driver)
+        m_driver = self._get_driver()
         loadbalancer = mock.Mock()
-        timeout = mock.sentinel.timeout
-        timer = [mock.sentinel.t0, mock.sentinel.t1]
-        m_driver._provisioning_timer.return_value = timer
-        resp = {'loadbalancer': {'provisioning_status': 'NOT_ACTIVE'}}
-        neutron.show_loadbalancer.return_value = resp
+        timeout = 10
+        m_driver._provisioning_poller.wait.return_value = 'PENDING_UPDATE'
 
         self.assertRaises(k_exc.ResourceNotReady, cls._wait_for_provisioning,
                           m_driver, loadbalancer, timeout)
 
-        self.assertEqual(len(timer), neutron.show_loadbalancer.call_count)
+        neutron.show_loadbalancer.assert_not_called()
+
+    def test_wait_for_provisioning_not_listed(self):
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = self._get_driver()
+        loadbalancer = mock.Mock()
+        m_driver._provisioning_poller.wait.return_value = None
+
+        self.assertRaises(k_exc.ResourceNotReady, cls._wait_for_provisioning,
+                          m_driver, loadbalancer, 0)
+
+        neutron.show_loadbalancer.assert_called_once_with(loadbalancer.id)
+
+    @mock.patch('time.sleep')
+    def test_wait_for_provisioning_listed_late(self, m_sleep):
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = self._get_driver()
+        loadbalancer = mock.Mock()
+        m_driver._provisioning_poller.wait.side_effect = [None, 'ACTIVE']
+
+        cls._wait_for_provisioning(m_driver, loadbalancer, 10)
+
+        neutron.show_loadbalancer.assert_called_once_with(loadbalancer.id)
+        self.assertEqual(2, m_driver._provisioning_poller.wait.call_count)
+        m_sleep.assert_called_once()
+
+    def test_wait_for_provisioning_not_found(self):
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = self._get_driver()
+        loadbalancer = mock.Mock()
+        m_driver._provisioning_poller.wait.return_value = None
+        neutron.show_loadbalancer.side_effect = n_exc.NotFound
+
+        self.assertRaises(n_exc.NotFound, cls._wait_for_provisioning,
+                          m_driver, loadbalancer, 10)
+
+    @mock.patch('kuryr_kubernetes.controller.drivers.utils.LIST_MAX_IDS', 2)
+    def test_get_loadbalancers_status(self):
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        cls = d_lbaasv2.LBaaSv2Driver
+        m_driver = self._get_driver()
+        neutron.list_loadbalancers.side_effect = [
+            {'loadbalancers': [{'id': 'lb1', 'provisioning_status': 'ACTIVE'},
+                               {'id': 'lb2',
+                                'provisioning_status': 'PENDING_UPDATE'}]},
+            {'loadbalancers': []}]
+
+        ret = cls._get_loadbalancers_status(m_driver, ['lb1', 'lb2', 'lb3'])
+
+        self.assertEqual({'lb1': 'ACTIVE', 'lb2': 'PENDING_UPDATE'}, ret)
+        neutron.list_loadbalancers.assert_has_calls([
+            mock.call(id=['lb1', 'lb2'], fields=['id', 'provisioning_status']),
+            mock.call(id=['lb3'], fields=['id', 'provisioning_status'])])
 
     def test_provisioning_timer(self):
         # REVISIT(ivc): add test if _provisioning_timer is to stay
@@ -11,13 +11,21 @@
 #    under the License.
 
 import ddt
+import eventlet
+import functools
 import mock
-import threading
 
+from kuryr.lib import constants as kl_const
+from kuryr.lib import exceptions as kl_exc
 from kuryr.lib import utils as lib_utils
 from neutronclient.common import exceptions as n_exc
+from os_vif.objects import fixed_ip as osv_fixed_ip
+from os_vif.objects import network as osv_network
+from os_vif.objects import subnet as osv_subnet
+from os_vif.objects import vif as osv_vif
 
 from kuryr_kubernetes.controller.drivers import nested_macvlan_vif
+from kuryr_kubernetes.controller.drivers import utils as d_utils
 from kuryr_kubernetes import exceptions as k_exc
 from kuryr_kubernetes.tests import base as test_base
 from kuryr_kubernetes.tests.unit import kuryr_fixtures as k_fix
@@ -31,9 +39,10 @@ class TestNestedMacvlanPodVIFDriver(test_base.TestCase):
     def test_request_vif(self, m_to_vif):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
+        submit = self._get_address_pairs_submit(m_driver)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        pod = mock.sentinel.pod
+        pod = {'status': {'hostIP': '10.0.0.5'}}
         project_id = mock.sentinel.project_id
         subnets = mock.sentinel.subnets
         security_groups = mock.sentinel.security_groups
@@ -44,12 +53,10 @@ class TestNestedMacvlanPodVIFDriver(test_base.TestCase):
 
         vif = mock.Mock()
         port_request = mock.sentinel.port_request
-        vm_port = self._get_fake_port()
 
         m_to_vif.return_value = vif
         m_driver._get_port_request.return_value = port_request
-        m_driver._get_parent_port.return_value = vm_port
-        m_driver.lock = mock.MagicMock(spec=threading.Lock())
+        m_driver._get_address_pairs.side_effect = cls._get_address_pairs
         neutron.create_port.return_value = container_port
 
         self.assertEqual(vif, cls.request_vif(m_driver, pod, project_id,
@@ -58,9 +65,10 @@ class TestNestedMacvlanPodVIFDriver(test_base.TestCase):
         m_driver._get_port_request.assert_called_once_with(
             pod, project_id, subnets, security_groups)
         neutron.create_port.assert_called_once_with(port_request)
-        m_driver._get_parent_port.assert_called_once_with(neutron, pod)
-        m_driver._add_to_allowed_address_pairs.assert_called_once_with(
-            neutron, vm_port, frozenset([container_ip]), container_mac)
+        submit.assert_called_once_with(
+            '10.0.0.5',
+            ('add',
+             [{'ip_address': container_ip, 'mac_address': container_mac}]))
         m_to_vif.assert_called_once_with(container_port['port'], subnets)
 
     @mock.patch(
@@ -68,9 +76,10 @@ class TestNestedMacvlanPodVIFDriver(test_base.TestCase):
     def test_request_vif_port_create_failed(self, m_to_vif):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
+        submit = self._get_address_pairs_submit(m_driver)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        pod = mock.sentinel.pod
+        pod = {'status': {'hostIP': '10.0.0.5'}}
         project_id = mock.sentinel.project_id
         subnets = mock.sentinel.subnets
         security_groups = mock.sentinel.security_groups
@@ -84,7 +93,7 @@ class TestNestedMacvlanPodVIFDriver(test_base.TestCase):
         m_driver._get_port_request.assert_called_once_with(
             pod, project_id, subnets, security_groups)
         neutron.create_port.assert_called_once_with(port_request)
-        m_driver._add_to_allowed_address_pairs.assert_not_called()
+        submit.assert_not_called()
         m_to_vif.assert_not_called()
 
     @mock.patch(
@@ -92,9 +101,10 @@ class TestNestedMacvlanPodVIFDriver(test_base.TestCase):
     def test_request_vif_parent_not_found(self, m_to_vif):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
+        submit = self._get_address_pairs_submit(m_driver)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        pod = mock.sentinel.pod
+        pod = {'status': {'hostIP': '10.0.0.5'}}
         project_id = mock.sentinel.project_id
         subnets = mock.sentinel.subnets
         security_groups = mock.sentinel.security_groups
@@ -105,26 +115,126 @@ class TestNestedMacvlanPodVIFDriver(test_base.TestCase):
 
         port_request = mock.sentinel.port_request
         m_driver._get_port_request.return_value = port_request
-        m_driver.lock = mock.MagicMock(spec=threading.Lock())
+        m_driver._get_address_pairs.side_effect = cls._get_address_pairs
         neutron.create_port.return_value = container_port
-        m_driver._get_parent_port.side_effect = n_exc.NeutronClientException
+        submit.side_effect = (
+            n_exc.NeutronClientException)
 
         self.assertRaises(n_exc.NeutronClientException, cls.request_vif,
                           m_driver, pod, project_id, subnets, security_groups)
         m_driver._get_port_request.assert_called_once_with(
             pod, project_id, subnets, security_groups)
         neutron.create_port.assert_called_once_with(port_request)
-        m_driver._get_parent_port.assert_called_once_with(neutron, pod)
-        m_driver._add_to_allowed_address_pairs.assert_not_called()
+        submit.assert_called_once()
+        m_to_vif.assert_not_called()
+
+    @mock.patch(
+        'kuryr_kubernetes.os_vif_util.neutron_to_osvif_vif_nested_macvlan')
+    def test_request_vifs(self, m_to_vif):
+        cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        submit = self._get_address_pairs_submit(m_driver)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        pod = {'status': {'hostIP': '10.0.0.5'}}
+        project_id = mock.sentinel.project_id
+        subnets = mock.sentinel.subnets
+        security_groups = mock.sentinel.security_groups
+        port1 = self._get_fake_port('port1', '10.0.1.10',
+                                    'fa:16:3e:00:00:01')['port']
+        port2 = self._get_fake_port('port2', '10.0.1.11',
+                                    'fa:16:3e:00:00:02')['port']
+        port_request = {'port': mock.sentinel.port_request}
+        vif1 = mock.sentinel.vif1
+        vif2 = mock.sentinel.vif2
+
+        m_driver._get_port_request.return_value = port_request
+        m_driver._get_address_pairs.side_effect = cls._get_address_pairs
+        neutron.create_port.return_value = {'ports': [port1, port2]}
+        m_to_vif.side_effect = [vif1, vif2]
+
+        self.assertEqual([vif1, vif2], cls.request_vifs(
+            m_driver, pod, project_id, subnets, security_groups, 2))
+
+        m_driver._get_port_request.assert_called_once_with(
+            pod, project_id, subnets, security_groups, unbound=True)
+        neutron.create_port.assert_called_once_with(
+            {'ports': [mock.sentinel.port_request,
+                       mock.sentinel.port_request]})
+        submit.assert_called_once_with('10.0.0.5', ('add', [
+            {'ip_address': '10.0.1.10', 'mac_address': 'fa:16:3e:00:00:01'},
+            {'ip_address': '10.0.1.11', 'mac_address': 'fa:16:3e:00:00:02'}]))
+        m_to_vif.assert_has_calls([mock.call(port1, subnets),
+                                   mock.call(port2, subnets)])
+
+    @mock.patch(
+        'kuryr_kubernetes.os_vif_util.neutron_to_osvif_vif_nested_macvlan')
+    def test_request_vifs_trunk_ip(self, m_to_vif):
+        cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        submit = self._get_address_pairs_submit(m_driver)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        port = self._get_fake_port('port1', '10.0.1.10')['port']
+        m_driver._get_port_request.return_value = {'port': {}}
+        m_driver._get_address_pairs.side_effect = cls._get_address_pairs
+        neutron.create_port.return_value = {'ports': [port]}
+
+        cls.request_vifs(m_driver, [], mock.sentinel.project_id,
+                         mock.sentinel.subnets, [], 1, trunk_ip='10.0.0.6')
+
+        self.assertEqual('10.0.0.6', submit.call_args[0][0])
+
+    @mock.patch(
+        'kuryr_kubernetes.os_vif_util.neutron_to_osvif_vif_nested_macvlan')
+    def test_request_vifs_port_create_failed(self, m_to_vif):
+        cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        submit = self._get_address_pairs_submit(m_driver)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        pod = {'status': {'hostIP': '10.0.0.5'}}
+        m_driver._get_port_request.return_value = {'port': {}}
+        neutron.create_port.side_effect = n_exc.NeutronClientException
+
+        self.assertRaises(n_exc.NeutronClientException, cls.request_vifs,
+                          m_driver, pod, mock.sentinel.project_id,
+                          mock.sentinel.subnets, [], 2)
+        submit.assert_not_called()
+        m_to_vif.assert_not_called()
+
+    @mock.patch(
+        'kuryr_kubernetes.os_vif_util.neutron_to_osvif_vif_nested_macvlan')
+    def test_request_vifs_update_failed(self, m_to_vif):
+        cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        submit = self._get_address_pairs_submit(m_driver)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        pod = {'status': {'hostIP': '10.0.0.5'}}
+        port1 = self._get_fake_port('port1', '10.0.1.10')['port']
+        port2 = self._get_fake_port('port2', '10.0.1.11')['port']
+        m_driver._get_port_request.return_value = {'port': {}}
+        m_driver._get_address_pairs.side_effect = cls._get_address_pairs
+        submit.side_effect = (
+            n_exc.NeutronClientException)
+        neutron.create_port.return_value = {'ports': [port1, port2]}
+
+        self.assertRaises(n_exc.NeutronClientException, cls.request_vifs,
+                          m_driver, pod, mock.sentinel.project_id,
+                          mock.sentinel.subnets, [], 2)
+        neutron.delete_port.assert_has_calls([mock.call('port1'),
+                                              mock.call('port2')])
         m_to_vif.assert_not_called()
 
     def test_release_vif(self):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
+        submit = self._get_address_pairs_submit(m_driver)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
         port_id = lib_utils.get_hash()
-        pod = mock.sentinel.pod
+        pod = {'status': {'hostIP': '10.0.0.5'}}
         vif = mock.Mock()
         vif.id = port_id
 
@@ -134,24 +244,24 @@ class TestNestedMacvlanPodVIFDriver(test_base.TestCase):
                                              container_mac)
         neutron.show_port.return_value = container_port
 
-        vm_port = self._get_fake_port()
-        m_driver._get_parent_port.return_value = vm_port
-        m_driver.lock = mock.MagicMock(spec=threading.Lock())
+        m_driver._get_address_pairs.side_effect = cls._get_address_pairs
 
         cls.release_vif(m_driver, pod, vif)
 
         neutron.show_port.assert_called_once_with(port_id)
-        m_driver._get_parent_port.assert_called_once_with(neutron, pod)
-        m_driver._remove_from_allowed_address_pairs.assert_called_once_with(
-            neutron, vm_port, frozenset([container_ip]), container_mac)
+        submit.assert_called_once_with(
+            '10.0.0.5',
+            ('remove',
+             [{'ip_address': container_ip, 'mac_address': container_mac}]))
         neutron.delete_port.assert_called_once_with(vif.id)
 
     def test_release_vif_not_found(self):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
+        submit = self._get_address_pairs_submit(m_driver)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        pod = mock.sentinel.pod
+        pod = {'status': {'hostIP': '10.0.0.5'}}
         vif = mock.Mock()
         vif.id = lib_utils.get_hash()
 
@@ -159,16 +269,17 @@ class TestNestedMacvlanPodVIFDriver(test_base.TestCase):
 
         self.assertRaises(n_exc.PortNotFoundClient, cls.release_vif,
                           m_driver, pod, vif)
-        m_driver._remove_from_allowed_address_pairs.assert_not_called()
+        submit.assert_not_called()
         neutron.delete_port.assert_not_called()
 
     def test_release_vif_parent_not_found(self):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
+        submit = self._get_address_pairs_submit(m_driver)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
         port_id = lib_utils.get_hash()
-        pod = mock.sentinel.pod
+        pod = {'status': {'hostIP': '10.0.0.5'}}
         vif = mock.Mock()
         vif.id = port_id
 
@@ -178,23 +289,24 @@ class TestNestedMacvlanPodVIFDriver(test_base.TestCase):
                                              container_mac)
         neutron.show_port.return_value = container_port
 
-        m_driver.lock = mock.MagicMock(spec=threading.Lock())
-        m_driver._get_parent_port.side_effect = n_exc.NeutronClientException
+        m_driver._get_address_pairs.side_effect = cls._get_address_pairs
+        submit.side_effect = (
+            n_exc.NeutronClientException)
 
         self.assertRaises(n_exc.NeutronClientException, cls.release_vif,
                           m_driver, pod, vif)
         neutron.show_port.assert_called_once_with(port_id)
-        m_driver._get_parent_port.assert_called_once_with(neutron, pod)
-        m_driver._remove_from_allowed_address_pairs.assert_not_called()
+        submit.assert_called_once()
         neutron.delete_port.assert_not_called()
 
     def test_release_vif_delete_failed(self):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
+        submit = self._get_address_pairs_submit(m_driver)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
         port_id = lib_utils.get_hash()
-        pod = mock.sentinel.pod
+        pod = {'status': {'hostIP': '10.0.0.5'}}
         vif = mock.Mock()
         vif.id = port_id
 
@@ -205,23 +317,138 @@ class TestNestedMacvlanPodVIFDriver(test_base.TestCase):
         neutron.show_port.return_value = container_port
         neutron.delete_port.side_effect = n_exc.PortNotFoundClient
 
-        vm_port = self._get_fake_port()
-        m_driver._get_parent_port.return_value = vm_port
-        m_driver.lock = mock.MagicMock(spec=threading.Lock())
+        m_driver._get_address_pairs.side_effect = cls._get_address_pairs
 
         cls.release_vif(m_driver, pod, vif)
 
         neutron.show_port.assert_called_once_with(port_id)
-        m_driver._get_parent_port.assert_called_once_with(neutron, pod)
-        m_driver._remove_from_allowed_address_pairs.assert_called_once_with(
-            neutron, vm_port, frozenset([container_ip]), container_mac)
+        submit.assert_called_once_with(
+            '10.0.0.5',
+            ('remove',
+             [{'ip_address': container_ip, 'mac_address': container_mac}]))
         neutron.delete_port.assert_called_once_with(vif.id)
 
+    def test_get_current_parent_port(self):
+        cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        cached_port = {'id': mock.sentinel.port_id}
+        current_port = mock.sentinel.current_port
+        m_driver._get_parent_port_by_host_ip.return_value = cached_port
+        neutron.show_port.return_value = {'port': current_port}
+
+        self.assertEqual(current_port, cls._get_current_parent_port(
+            m_driver, neutron, '10.0.0.5'))
+        m_driver._get_parent_port_by_host_ip.assert_called_once_with(
+            neutron, '10.0.0.5')
+        neutron.show_port.assert_called_once_with(mock.sentinel.port_id)
+        m_driver._invalidate_parent_port.assert_not_called()
+
+    def test_get_current_parent_port_stale_cache(self):
+        cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        current_port = mock.sentinel.current_port
+        m_driver._get_parent_port_by_host_ip.side_effect = [
+            {'id': mock.sentinel.old_port_id},
+            {'id': mock.sentinel.port_id}]
+        neutron.show_port.side_effect = [n_exc.PortNotFoundClient,
+                                         {'port': current_port}]
+
+        self.assertEqual(current_port, cls._get_current_parent_port(
+            m_driver, neutron, '10.0.0.5'))
+        m_driver._invalidate_parent_port.assert_called_once_with('10.0.0.5')
+        neutron.show_port.assert_called_with(mock.sentinel.port_id)
+
+    @mock.patch('kuryr_kubernetes.os_vif_util.osvif_to_neutron_fixed_ips')
+    def test_get_port_request_unbound(self, m_to_fips):
+        cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+
+        project_id = mock.sentinel.project_id
+        subnets = mock.sentinel.subnets
+        security_groups = mock.sentinel.security_groups
+        network_id = mock.sentinel.network_id
+        fixed_ips = mock.sentinel.fixed_ips
+        m_driver._get_network_id.return_value = network_id
+        m_to_fips.return_value = fixed_ips
+
+        expected = {'port': {'project_id': project_id,
+                             'name': 'available-port',
+                             'network_id': network_id,
+                             'fixed_ips': fixed_ips,
+                             'device_owner': kl_const.DEVICE_OWNER,
+                             'admin_state_up': True,
+                             'security_groups': security_groups}}
+
+        self.assertEqual(expected, cls._get_port_request(
+            m_driver, [], project_id, subnets, security_groups,
+            unbound=True))
+
+    def test_detach_vifs(self):
+        cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        submit = self._get_address_pairs_submit(m_driver)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        vif = self._get_fake_vif('fa:16:3e:00:00:01', ['10.0.1.10'])
+
+        cls._detach_vifs(m_driver, neutron, '10.0.0.5', [vif])
+
+        submit.assert_called_once_with(
+            '10.0.0.5',
+            ('remove',
+             [{'ip_address': '10.0.1.10',
+               'mac_address': 'fa:16:3e:00:00:01'}]))
+
+    def test_detach_vifs_no_parent_port(self):
+        cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        submit = self._get_address_pairs_submit(m_driver)
+        submit.side_effect = kl_exc.NoResourceException
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        vif = self._get_fake_vif('fa:16:3e:00:00:01', ['10.0.1.10'])
+
+        cls._detach_vifs(m_driver, neutron, '10.0.0.5', [vif])
+
+        submit.assert_called_once()
+
+    @mock.patch(
+        'kuryr_kubernetes.os_vif_util.neutron_to_osvif_vif_nested_macvlan')
+    def test_get_attached_vifs(self, m_to_vif):
+        cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        port1 = self._get_fake_port('port1', '10.0.1.10',
+                                    'fa:16:3e:00:00:01')['port']
+        port2 = self._get_fake_port('port2', '10.0.1.11',
+                                    'fa:16:3e:00:00:02')['port']
+        vm_port = self._get_fake_port()['port']
+        vm_port['allowed_address_pairs'].append(
+            {'ip_address': '10.0.1.10', 'mac_address': 'fa:16:3e:00:00:01'})
+        m_driver._parent_ports = {'10.0.0.5': vm_port}
+        m_driver._get_address_pairs.side_effect = cls._get_address_pairs
+        port_subnets = mock.sentinel.port_subnets
+        m_driver._get_port_subnets.return_value = port_subnets
+        m_to_vif.return_value = mock.sentinel.vif
+        subnets = mock.sentinel.subnets
+
+        self.assertEqual({'10.0.0.5': [(port1, mock.sentinel.vif)]},
+                         cls._get_attached_vifs(m_driver, neutron,
+                                                [port1, port2], subnets))
+        m_driver._load_parent_ports.assert_called_once_with(neutron)
+        m_driver._get_port_subnets.assert_called_once_with(port1, subnets)
+        m_to_vif.assert_called_once_with(port1, port_subnets)
+
     @ddt.data((False), (True))
     def test_activate_vif(self, active_value):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        pod = mock.sentinel.pod
+        pod = {'status': {'hostIP': '10.0.0.5'}}
         vif = mock.Mock()
         vif.active = active_value
 
@@ -229,55 +456,123 @@ class TestNestedMacvlanPodVIFDriver(test_base.TestCase):
 
         self.assertEqual(vif.active, True)
 
-    @ddt.data((None), ('fa:16:3e:71:cb:80'))
-    def test_add_to_allowed_address_pairs(self, m_mac):
+    def test_get_address_pairs(self):
+        cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
+        port = self._get_fake_port(ip_address='10.0.0.29',
+                                   mac_address='fa:16:3e:71:cb:80')['port']
+        port['fixed_ips'].append({'subnet_id': lib_utils.get_hash(),
+                                  'ip_address': 'fd00::29'})
+
+        self.assertEqual(
+            [{'ip_address': '10.0.0.29', 'mac_address': 'fa:16:3e:71:cb:80'},
+             {'ip_address': 'fd00::29', 'mac_address': 'fa:16:3e:71:cb:80'}],
+            cls._get_address_pairs(port))
+
+    def test_send_address_pairs_updates(self):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        port_id = lib_utils.get_hash()
-        vm_port = self._get_fake_port(port_id)['port']
+        vm_port = self._get_fake_port()['port']
+        m_driver._get_current_parent_port.return_value = vm_port
+        m_driver._remove_address_pairs.return_value = True
+        new_pairs = mock.sentinel.new_pairs
+        old_pairs = mock.sentinel.old_pairs
+
+        self.assertEqual([None, None], cls._send_address_pairs_updates(
+            m_driver, '10.0.0.5', [('add', new_pairs),
+                                   ('remove', old_pairs)]))
+
+        m_driver._get_current_parent_port.assert_called_once_with(
+            neutron, '10.0.0.5')
+        m_driver._add_address_pairs.assert_called_once_with(vm_port,
+                                                            new_pairs)
+        m_driver._remove_address_pairs.assert_called_once_with(vm_port,
+                                                               old_pairs)
+        m_driver._update_port_address_pairs.assert_called_once_with(
+            neutron, vm_port['id'], vm_port['allowed_address_pairs'])
+
+    def test_send_address_pairs_updates_no_update(self):
+        cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        self.useFixture(k_fix.MockNeutronClient())
+
+        m_driver._get_current_parent_port.return_value = (
+            self._get_fake_port()['port'])
+        m_driver._remove_address_pairs.return_value = False
+
+        cls._send_address_pairs_updates(
+            m_driver, '10.0.0.5', [('remove', mock.sentinel.old_pairs)])
+
+        m_driver._update_port_address_pairs.assert_not_called()
+
+    def test_send_address_pairs_updates_coalesced(self):
+        cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        vm_port = self._get_fake_port()['port']
+        old_pair = {'ip_address': '10.0.1.10',
+                    'mac_address': 'fa:16:3e:00:00:01'}
+        new_pair = {'ip_address': '10.0.1.11',
+                    'mac_address': 'fa:16:3e:00:00:02'}
+        vm_port['allowed_address_pairs'].append(old_pair)
+        m_driver._get_current_parent_port.return_value = vm_port
+        m_driver._add_address_pairs.side_effect = functools.partial(
+            cls._add_address_pairs, m_driver)
+        m_driver._remove_address_pairs.side_effect = functools.partial(
+            cls._remove_address_pairs, m_driver)
+        updater = d_utils.RequestsCoalescer(
+            'test', functools.partial(cls._send_address_pairs_updates,
+                                      m_driver), window=0)
+
+        threads = [eventlet.spawn(updater.submit, '10.0.0.5',
+                                  ('add', [new_pair])),
+                   eventlet.spawn(updater.submit, '10.0.0.5',
+                                  ('remove', [old_pair]))]
+        for thread in threads:
+            thread.wait()
+
+        m_driver._update_port_address_pairs.assert_called_once_with(
+            neutron, vm_port['id'], [new_pair])
+
+    def test_add_address_pairs(self):
+        cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+
+        vm_port = self._get_fake_port()['port']
 
-        mac_addr = 'fa:16:3e:1b:30:00' if m_mac else vm_port['mac_address']
         address_pairs = [
             {'ip_address': '10.0.0.30',
-             'mac_address': mac_addr},
+             'mac_address': 'fa:16:3e:1b:30:00'},
             {'ip_address': 'fe80::f816:3eff:fe1c:36a9',
-             'mac_address': mac_addr},
+             'mac_address': 'fa:16:3e:1b:30:00'},
         ]
         vm_port['allowed_address_pairs'].extend(address_pairs)
 
-        ip_addr = '10.0.0.29'
-        address_pairs.append(
-            {'ip_address': ip_addr,
-             'mac_address': m_mac if m_mac else vm_port['mac_address']}
-        )
+        new_pairs = [
+            {'ip_address': '10.0.0.29', 'mac_address': 'fa:16:3e:71:cb:80'},
+            {'ip_address': '10.0.0.28', 'mac_address': 'fa:16:3e:71:cb:81'}]
 
-        cls._add_to_allowed_address_pairs(m_driver, neutron, vm_port,
-                                          frozenset([ip_addr]), m_mac)
+        cls._add_address_pairs(m_driver, vm_port, new_pairs)
 
-        m_driver._update_port_address_pairs.assert_called_once_with(
-            neutron, port_id, address_pairs)
+        self.assertEqual(address_pairs + new_pairs,
+                         vm_port['allowed_address_pairs'])
 
-    def test_add_to_allowed_address_pairs_no_ip_addresses(self):
+    def test_add_address_pairs_no_pairs(self):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        port_id = lib_utils.get_hash()
-        vm_port = self._get_fake_port(port_id)['port']
+        vm_port = self._get_fake_port()['port']
 
         self.assertRaises(k_exc.IntegrityError,
-                          cls._add_to_allowed_address_pairs, m_driver,
-                          neutron, vm_port, frozenset())
+                          cls._add_address_pairs, m_driver, vm_port, [])
 
-    def test_add_to_allowed_address_pairs_same_ip(self):
+    def test_add_address_pairs_same_ip(self):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        port_id = lib_utils.get_hash()
-        vm_port = self._get_fake_port(port_id)['port']
+        vm_port = self._get_fake_port()['port']
         address_pairs = [
             {'ip_address': '10.0.0.30',
              'mac_address': 'fa:16:3e:1b:30:00'},
@@ -286,23 +581,19 @@ class TestNestedMacvlanPodVIFDriver(test_base.TestCase):
         ]
         vm_port['allowed_address_pairs'].extend(address_pairs)
 
-        mac_addr = 'fa:16:3e:71:cb:80'
-        ip_addr = '10.0.0.30'
-        address_pairs.append({'ip_address': ip_addr, 'mac_address': mac_addr})
+        new_pair = {'ip_address': '10.0.0.30',
+                    'mac_address': 'fa:16:3e:71:cb:80'}
+        address_pairs.append(new_pair)
 
-        cls._add_to_allowed_address_pairs(m_driver, neutron, vm_port,
-                                          frozenset([ip_addr]), mac_addr)
+        cls._add_address_pairs(m_driver, vm_port, [new_pair])
 
-        m_driver._update_port_address_pairs.assert_called_once_with(
-            neutron, port_id, address_pairs)
+        self.assertEqual(address_pairs, vm_port['allowed_address_pairs'])
 
-    def test_add_to_allowed_address_pairs_already_present(self):
+    def test_add_address_pairs_already_present(self):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        port_id = lib_utils.get_hash()
-        vm_port = self._get_fake_port(port_id)['port']
+        vm_port = self._get_fake_port()['port']
         address_pairs = [
             {'ip_address': '10.0.0.30',
              'mac_address': 'fa:16:3e:1b:30:00'},
@@ -311,107 +602,87 @@ class TestNestedMacvlanPodVIFDriver(test_base.TestCase):
         ]
         vm_port['allowed_address_pairs'].extend(address_pairs)
 
-        mac_addr = 'fa:16:3e:1b:30:00'
-        ip_addr = '10.0.0.30'
+        new_pair = {'ip_address': '10.0.0.30',
+                    'mac_address': 'fa:16:3e:1b:30:00'}
 
         self.assertRaises(k_exc.AllowedAddressAlreadyPresent,
-                          cls._add_to_allowed_address_pairs, m_driver, neutron,
-                          vm_port, frozenset([ip_addr]), mac_addr)
+                          cls._add_address_pairs, m_driver, vm_port,
+                          [new_pair])
 
-    @ddt.data((None), ('fa:16:3e:71:cb:80'))
-    def test_remove_from_allowed_address_pairs(self, m_mac):
+    def test_remove_address_pairs(self):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        port_id = lib_utils.get_hash()
-        vm_port = self._get_fake_port(port_id)['port']
+        vm_port = self._get_fake_port()['port']
 
-        mac_addr = 'fa:16:3e:1b:30:00' if m_mac else vm_port['mac_address']
         address_pairs = [
             {'ip_address': '10.0.0.30',
-             'mac_address': mac_addr},
+             'mac_address': 'fa:16:3e:1b:30:00'},
             {'ip_address': 'fe80::f816:3eff:fe1c:36a9',
-             'mac_address': mac_addr},
+             'mac_address': 'fa:16:3e:1b:30:00'},
         ]
         vm_port['allowed_address_pairs'].extend(address_pairs)
 
-        ip_addr = '10.0.0.29'
-        vm_port['allowed_address_pairs'].append(
-            {'ip_address': ip_addr,
-             'mac_address': m_mac if m_mac else vm_port['mac_address']}
-        )
-
-        cls._remove_from_allowed_address_pairs(
-            m_driver, neutron, vm_port, frozenset([ip_addr]), m_mac)
+        old_pairs = [
+            {'ip_address': '10.0.0.29', 'mac_address': 'fa:16:3e:71:cb:80'},
+            {'ip_address': '10.0.0.28', 'mac_address': 'fa:16:3e:71:cb:81'}]
+        vm_port['allowed_address_pairs'].extend(old_pairs)
 
-        m_driver._update_port_address_pairs.assert_called_once_with(
-            neutron, port_id, address_pairs)
+        self.assertTrue(cls._remove_address_pairs(m_driver, vm_port,
+                                                  old_pairs))
+        self.assertEqual(address_pairs, vm_port['allowed_address_pairs'])
 
-    def test_remove_from_allowed_address_pairs_no_ip_addresses(self):
+    def test_remove_address_pairs_no_pairs(self):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        port_id = lib_utils.get_hash()
-        vm_port = self._get_fake_port(port_id)['port']
+        vm_port = self._get_fake_port()['port']
 
         self.assertRaises(k_exc.IntegrityError,
-                          cls._remove_from_allowed_address_pairs, m_driver,
-                          neutron, vm_port, frozenset())
+                          cls._remove_address_pairs, m_driver, vm_port, [])
 
-    @ddt.data((None), ('fa:16:3e:71:cb:80'))
-    def test_remove_from_allowed_address_pairs_missing(self, m_mac):
+    def test_remove_address_pairs_missing(self):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        port_id = lib_utils.get_hash()
-        vm_port = self._get_fake_port(port_id)['port']
+        vm_port = self._get_fake_port()['port']
 
-        mac_addr = 'fa:16:3e:1b:30:00' if m_mac else vm_port['mac_address']
         address_pairs = [
             {'ip_address': '10.0.0.30',
-             'mac_address': mac_addr},
+             'mac_address': 'fa:16:3e:1b:30:00'},
             {'ip_address': 'fe80::f816:3eff:fe1c:36a9',
-             'mac_address': mac_addr},
+             'mac_address': 'fa:16:3e:1b:30:00'},
         ]
-        mac_addr = m_mac if m_mac else vm_port['mac_address']
         vm_port['allowed_address_pairs'].extend(address_pairs)
-        vm_port['allowed_address_pairs'].append({'ip_address': '10.0.0.28',
-                                                 'mac_address': mac_addr})
-        ip_addr = ['10.0.0.29', '10.0.0.28']
-
-        cls._remove_from_allowed_address_pairs(
-            m_driver, neutron, vm_port, frozenset(ip_addr), m_mac)
+        old_pair = {'ip_address': '10.0.0.28',
+                    'mac_address': 'fa:16:3e:71:cb:80'}
+        vm_port['allowed_address_pairs'].append(old_pair)
+        missing_pair = {'ip_address': '10.0.0.29',
+                        'mac_address': 'fa:16:3e:71:cb:80'}
 
-        m_driver._update_port_address_pairs.assert_called_once_with(
-            neutron, port_id, address_pairs)
+        self.assertTrue(cls._remove_address_pairs(
+            m_driver, vm_port, [missing_pair, old_pair]))
+        self.assertEqual(address_pairs, vm_port['allowed_address_pairs'])
 
-    @ddt.data((None), ('fa:16:3e:71:cb:80'))
-    def test_remove_from_allowed_address_pairs_no_update(self, m_mac):
+    def test_remove_address_pairs_no_update(self):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        port_id = lib_utils.get_hash()
-        vm_port = self._get_fake_port(port_id)['port']
+        vm_port = self._get_fake_port()['port']
 
-        mac_addr = 'fa:16:3e:1b:30:00' if m_mac else vm_port['mac_address']
         address_pairs = [
             {'ip_address': '10.0.0.30',
-             'mac_address': mac_addr},
+             'mac_address': 'fa:16:3e:1b:30:00'},
             {'ip_address': 'fe80::f816:3eff:fe1c:36a9',
-             'mac_address': mac_addr},
+             'mac_address': 'fa:16:3e:1b:30:00'},
         ]
         vm_port['allowed_address_pairs'].extend(address_pairs)
+        missing_pair = {'ip_address': '10.0.0.29',
+                        'mac_address': 'fa:16:3e:71:cb:80'}
 
-        ip_addr = ['10.0.0.29']
-
-        cls._remove_from_allowed_address_pairs(
-            m_driver, neutron, vm_port, frozenset(ip_addr), m_mac)
-
-        m_driver._update_port_address_pairs.assert_not_called()
+        self.assertFalse(cls._remove_address_pairs(m_driver, vm_port,
+                                                   [missing_pair]))
+        self.assertEqual(address_pairs, vm_port['allowed_address_pairs'])
 
     def test_update_port_address_pairs(self):
         cls = nested_macvlan_vif.NestedMacvlanPodVIFDriver
@@ -444,6 +715,11 @@ class TestNestedMacvlanPodVIFDriver(test_base.TestCase):
             port_id,
             {'port': {'allowed_address_pairs': pairs}})
 
+    def _get_address_pairs_submit(self, m_driver):
+        m_driver._address_pairs_updater = mock.Mock(
+            spec=d_utils.RequestsCoalescer)
+        return m_driver._address_pairs_updater.submit
+
     # TODO(garyloug) consider exending and moving to a parent class
     def _get_fake_port(self, port_id=None, ip_address=None, mac_address=None):
         fake_port = {
@@ -469,6 +745,16 @@ class TestNestedMacvlanPodVIFDriver(test_base.TestCase):
 
         return fake_port
 
+    def _get_fake_vif(self, mac_address, ip_addresses):
+        subnet = osv_subnet.Subnet(
+            cidr='10.0.1.0/24',
+            ips=osv_fixed_ip.FixedIPList(
+                objects=[osv_fixed_ip.FixedIP(address=ip)
+                         for ip in ip_addresses]))
+        network = osv_network.Network(
+            subnets=osv_subnet.SubnetList(objects=[subnet]))
+        return osv_vif.VIFBase(address=mac_address, network=network)
+
     def _get_fake_ports(self, ip_address, mac_address):
         fake_port = self._get_fake_port(ip_address=ip_address,
                                         mac_address=mac_address)
@@ -45,54 +45,125 @@ class TestNestedPodVIFDriver(test_base.TestCase):
         m_driver = mock.Mock(spec=cls)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        node_subnet_id = mock.sentinel.node_subnet_id
-        oslo_cfg.CONF.set_override('worker_nodes_subnet',
-                                   node_subnet_id,
-                                   group='pod_vif_nested')
+        port = mock.sentinel.port
+        m_driver._parent_ports = {'10.0.0.5': port}
 
-        node_fixed_ip = mock.sentinel.node_fixed_ip
+        self.assertEqual(port, cls._get_parent_port_by_host_ip(
+            m_driver, neutron, '10.0.0.5'))
+        m_driver._load_parent_ports.assert_not_called()
+
+    def test_get_parent_port_by_host_ip_cache_miss(self):
+        cls = nested_vif.NestedPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
         port = mock.sentinel.port
-        ports = {'ports': [port]}
-        neutron.list_ports.return_value = ports
+        m_driver._parent_ports = {}
+        m_driver._missing_parent_ports = {}
+
+        def load_parent_ports(neutron):
+            m_driver._parent_ports['10.0.0.5'] = port
+        m_driver._load_parent_ports.side_effect = load_parent_ports
 
         self.assertEqual(port, cls._get_parent_port_by_host_ip(
-            m_driver, neutron, node_fixed_ip))
-        fixed_ips = ['subnet_id=%s' % str(node_subnet_id),
-                     'ip_address=%s' % str(node_fixed_ip)]
-        neutron.list_ports.assert_called_once_with(fixed_ips=fixed_ips)
+            m_driver, neutron, '10.0.0.5'))
+        m_driver._load_parent_ports.assert_called_once_with(neutron)
 
-    def test_get_parent_port_by_host_ip_subnet_id_not_configured(self):
+    @mock.patch('time.time', return_value=1000)
+    def test_get_parent_port_by_host_ip_trunk_not_found(self, m_time):
         cls = nested_vif.NestedPodVIFDriver
         m_driver = mock.Mock(spec=cls)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
-        oslo_cfg.CONF.set_override('worker_nodes_subnet',
-                                   '',
-                                   group='pod_vif_nested')
-        node_fixed_ip = mock.sentinel.node_fixed_ip
-        self.assertRaises(oslo_cfg.RequiredOptError,
-                          cls._get_parent_port_by_host_ip,
-                          m_driver, neutron, node_fixed_ip)
 
-    def test_get_parent_port_by_host_ip_trunk_not_found(self):
+        m_driver._parent_ports = {}
+        m_driver._missing_parent_ports = {}
+
+        self.assertRaises(kl_exc.NoResourceException,
+                          cls._get_parent_port_by_host_ip, m_driver, neutron,
+                          '10.0.0.5')
+        m_driver._load_parent_ports.assert_called_once_with(neutron)
+        self.assertEqual({'10.0.0.5': 1000}, m_driver._missing_parent_ports)
+
+    @mock.patch('time.time')
+    def test_get_parent_port_by_host_ip_recently_missing(self, m_time):
         cls = nested_vif.NestedPodVIFDriver
         m_driver = mock.Mock(spec=cls)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        node_subnet_id = mock.sentinel.node_subnet_id
+        m_driver._parent_ports = {}
+        m_driver._missing_parent_ports = {'10.0.0.5': 1000}
+        m_time.return_value = 1000 + nested_vif.PARENT_PORT_MISS_TTL - 1
+
+        self.assertRaises(kl_exc.NoResourceException,
+                          cls._get_parent_port_by_host_ip, m_driver, neutron,
+                          '10.0.0.5')
+        m_driver._load_parent_ports.assert_not_called()
+
+        m_time.return_value = 1000 + nested_vif.PARENT_PORT_MISS_TTL
 
+        self.assertRaises(kl_exc.NoResourceException,
+                          cls._get_parent_port_by_host_ip, m_driver, neutron,
+                          '10.0.0.5')
+        m_driver._load_parent_ports.assert_called_once_with(neutron)
+
+    def test_load_parent_ports(self):
+        cls = nested_vif.NestedPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        node_subnet_id = 'node_subnet_id'
         oslo_cfg.CONF.set_override('worker_nodes_subnet',
                                    node_subnet_id,
                                    group='pod_vif_nested')
+        port1 = {'id': 'port1',
+                 'fixed_ips': [{'subnet_id': node_subnet_id,
+                                'ip_address': '10.0.0.5'},
+                               {'subnet_id': 'other_subnet_id',
+                                'ip_address': '10.1.0.5'}]}
+        port2 = {'id': 'port2',
+                 'fixed_ips': [{'subnet_id': node_subnet_id,
+                                'ip_address': '10.0.0.6'}]}
+        neutron.list_ports.return_value = {'ports': [port1, port2]}
+        m_driver._parent_ports = {'10.0.0.7': mock.sentinel.stale_port}
+        m_driver._missing_parent_ports = {'10.0.0.6': 1000, '10.0.0.8': 1000}
+
+        cls._load_parent_ports(m_driver, neutron)
+
+        self.assertEqual({'10.0.0.5': port1, '10.0.0.6': port2},
+                         m_driver._parent_ports)
+        self.assertEqual({'10.0.0.8': 1000}, m_driver._missing_parent_ports)
+        neutron.list_ports.assert_called_once_with(
+            fixed_ips=['subnet_id=%s' % node_subnet_id])
+
+    def test_load_parent_ports_subnet_id_not_configured(self):
+        cls = nested_vif.NestedPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        oslo_cfg.CONF.set_override('worker_nodes_subnet',
+                                   '',
+                                   group='pod_vif_nested')
+        self.assertRaises(oslo_cfg.RequiredOptError,
+                          cls._load_parent_ports, m_driver, neutron)
 
-        node_fixed_ip = mock.sentinel.node_fixed_ip
+    def test_invalidate_parent_port(self):
+        cls = nested_vif.NestedPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        port = mock.sentinel.port
+        m_driver._parent_ports = {'10.0.0.5': port, '10.0.0.6': port}
+        m_driver._missing_parent_ports = {'10.0.0.7': 1000}
 
-        ports = {'ports': []}
-        neutron.list_ports.return_value = ports
+        cls._invalidate_parent_port(m_driver, '10.0.0.5')
+        cls._invalidate_parent_port(m_driver, '10.0.0.7')
 
-        self.assertRaises(kl_exc.NoResourceException,
-                          cls._get_parent_port_by_host_ip, m_driver, neutron,
-                          node_fixed_ip)
-        fixed_ips = ['subnet_id=%s' % str(node_subnet_id),
-                     'ip_address=%s' % str(node_fixed_ip)]
-        neutron.list_ports.assert_called_once_with(fixed_ips=fixed_ips)
+        self.assertEqual({'10.0.0.6': port}, m_driver._parent_ports)
+        self.assertEqual({}, m_driver._missing_parent_ports)
+
+    def test_get_port_subnets(self):
+        cls = nested_vif.NestedPodVIFDriver
+        port = {'fixed_ips': [{'subnet_id': 'subnet1',
+                               'ip_address': '10.0.1.10'}]}
+        subnets = {'subnet1': mock.sentinel.subnet1,
+                   'subnet2': mock.sentinel.subnet2}
+
+        self.assertEqual({'subnet1': mock.sentinel.subnet1},
+                         cls._get_port_subnets(port, subnets))
@@ -10,6 +10,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
 import mock
 
 from kuryr.lib import constants as kl_const
@@ -17,6 +18,7 @@ from kuryr.lib import exceptions as kl_exc
 from neutronclient.common import exceptions as n_exc
 
 from kuryr_kubernetes.controller.drivers import nested_vlan_vif
+from kuryr_kubernetes.controller.drivers import utils as d_utils
 from kuryr_kubernetes import exceptions as k_exc
 from kuryr_kubernetes.tests import base as test_base
 from kuryr_kubernetes.tests.unit import kuryr_fixtures as k_fix
@@ -54,8 +56,8 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         neutron.list_ports.return_value = {'ports': [parent_port]}
         neutron.create_port.return_value = {'port': port}
 
-        self.assertEqual(vif, cls.request_vif(m_driver, pod, project_id,
-                                              subnets, security_groups))
+        self.assertEqual(vif, cls._request_vif(m_driver, pod, project_id,
+                                               subnets, security_groups))
 
         m_driver._get_parent_port.assert_called_once_with(neutron, pod)
         m_driver._get_trunk_id.assert_called_once_with(parent_port)
@@ -67,6 +69,58 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
                                                       port_id)
         m_to_vif.assert_called_once_with(port, subnets, vlan_id)
 
+    def test_request_vif_retry(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        m_driver._retry_on_stale_trunk.side_effect = functools.partial(
+            cls._retry_on_stale_trunk, m_driver)
+        m_driver._request_vif.side_effect = [k_exc.K8sNodeTrunkPortFailure,
+                                             mock.sentinel.vif]
+        pod = {'status': {'hostIP': '10.0.0.5'}}
+
+        self.assertEqual(mock.sentinel.vif, cls.request_vif(
+            m_driver, pod, mock.sentinel.project_id, mock.sentinel.subnets,
+            mock.sentinel.security_groups))
+
+        m_driver._invalidate_parent_port.assert_called_once_with('10.0.0.5')
+        self.assertEqual(2, m_driver._request_vif.call_count)
+
+    def test_request_vifs_retry(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        m_driver._retry_on_stale_trunk.side_effect = functools.partial(
+            cls._retry_on_stale_trunk, m_driver)
+        m_driver._request_vifs.side_effect = n_exc.NotFound
+
+        self.assertRaises(n_exc.NotFound, cls.request_vifs, m_driver, [],
+                          mock.sentinel.project_id, mock.sentinel.subnets,
+                          mock.sentinel.security_groups, 2,
+                          trunk_ip='10.0.0.5')
+
+        m_driver._invalidate_parent_port.assert_called_once_with('10.0.0.5')
+        m_driver._request_vifs.assert_has_calls(2 * [mock.call(
+            [], mock.sentinel.project_id, mock.sentinel.subnets,
+            mock.sentinel.security_groups, 2, trunk_ip='10.0.0.5')])
+
+    def test_request_vif_trunk_not_found(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        trunk_id = mock.sentinel.trunk_id
+        m_driver._get_trunk_id.return_value = trunk_id
+        m_driver._vlan_ids_allocators = {trunk_id: mock.sentinel.allocator}
+        neutron.create_port.return_value = {'port': {'id': 'port1'}}
+        m_driver._add_subport.side_effect = n_exc.NotFound
+
+        self.assertRaises(n_exc.NotFound, cls._request_vif, m_driver,
+                          mock.sentinel.pod, mock.sentinel.project_id,
+                          mock.sentinel.subnets,
+                          mock.sentinel.security_groups)
+
+        neutron.delete_port.assert_called_once_with('port1')
+        self.assertEqual({}, m_driver._vlan_ids_allocators)
+
     @mock.patch(
         'kuryr_kubernetes.os_vif_util.neutron_to_osvif_vif_nested_vlan')
     def test_request_vifs(self, m_to_vif):
@@ -101,7 +155,7 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         neutron.create_port.return_value = {'ports': [port, port]}
         m_to_vif.return_value = vif
 
-        self.assertEqual([vif, vif], cls.request_vifs(
+        self.assertEqual([vif, vif], cls._request_vifs(
             m_driver, pod, project_id, subnets, security_groups, num_ports))
 
         m_driver._get_parent_port.assert_called_once_with(neutron, pod)
@@ -113,6 +167,7 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         neutron.trunk_add_subports.assert_called_once_with(
             trunk_id, {'sub_ports': subports_info})
         neutron.delete_port.assert_not_called()
+        m_driver._release_vlan_ids.assert_not_called()
 
         calls = [mock.call(port, subnets, info['segmentation_id'])
                  for info in subports_info]
@@ -139,9 +194,9 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         m_driver._create_subports_info.return_value = (port_request,
                                                        subports_info)
 
-        self.assertEqual([], cls.request_vifs(m_driver, pod, project_id,
-                                              subnets, security_groups,
-                                              num_ports))
+        self.assertEqual([], cls._request_vifs(m_driver, pod, project_id,
+                                               subnets, security_groups,
+                                               num_ports))
 
         m_driver._get_parent_port.assert_called_once_with(neutron, pod)
         m_driver._get_trunk_id.assert_called_once_with(parent_port)
@@ -179,7 +234,7 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         neutron.create_port.side_effect = n_exc.NeutronClientException
 
         self.assertRaises(
-            n_exc.NeutronClientException, cls.request_vifs,
+            n_exc.NeutronClientException, cls._request_vifs,
             m_driver, pod, project_id, subnets, security_groups, num_ports)
 
         m_driver._get_parent_port.assert_called_once_with(neutron, pod)
@@ -188,6 +243,7 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
             pod, project_id, subnets, security_groups,
             trunk_id, num_ports, unbound=True)
         neutron.create_port.assert_called_once_with(bulk_rq)
+        m_driver._release_vlan_ids.assert_called_once_with(trunk_id, [1, 2])
 
     def test_request_vifs_trunk_subports_conflict(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
@@ -220,7 +276,7 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         neutron.create_port.return_value = {'ports': [port, port]}
         neutron.trunk_add_subports.side_effect = n_exc.Conflict
 
-        self.assertRaises(n_exc.Conflict, cls.request_vifs,
+        self.assertRaises(n_exc.Conflict, cls._request_vifs,
                           m_driver, pod, project_id, subnets,
                           security_groups, num_ports)
 
@@ -233,6 +289,34 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         neutron.trunk_add_subports.assert_called_once_with(
             trunk_id, {'sub_ports': subports_info})
         neutron.delete_port.assert_called_with(port['id'])
+        m_driver._release_vlan_ids.assert_called_once_with(trunk_id, [1, 2])
+        m_driver._resync_vlan_ids.assert_called_once_with(trunk_id)
+
+    def test_request_vifs_trunk_not_found(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        trunk_id = mock.sentinel.trunk_id
+        subports_info = [{'segmentation_id': 1,
+                          'port_id': '',
+                          'segmentation_type': 'vlan'}]
+
+        m_driver._get_trunk_id.return_value = trunk_id
+        m_driver._create_subports_info.return_value = (
+            mock.sentinel.port_request, subports_info)
+        m_driver._vlan_ids_allocators = {trunk_id: mock.sentinel.allocator}
+        neutron.create_port.return_value = {'ports': [{'id': 'port1'}]}
+        neutron.trunk_add_subports.side_effect = n_exc.NotFound
+
+        self.assertRaises(n_exc.NotFound, cls._request_vifs, m_driver,
+                          mock.sentinel.pod, mock.sentinel.project_id,
+                          mock.sentinel.subnets,
+                          mock.sentinel.security_groups, 1)
+
+        neutron.delete_port.assert_called_once_with('port1')
+        self.assertEqual({}, m_driver._vlan_ids_allocators)
+        m_driver._release_vlan_ids.assert_not_called()
 
     def test_request_vifs_trunk_subports_exception(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
@@ -265,7 +349,7 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         neutron.create_port.return_value = {'ports': [port, port]}
         neutron.trunk_add_subports.side_effect = n_exc.NeutronClientException
 
-        self.assertRaises(n_exc.NeutronClientException, cls.request_vifs,
+        self.assertRaises(n_exc.NeutronClientException, cls._request_vifs,
                           m_driver, pod, project_id, subnets,
                           security_groups, num_ports)
 
@@ -278,6 +362,8 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         neutron.trunk_add_subports.assert_called_once_with(
             trunk_id, {'sub_ports': subports_info})
         neutron.delete_port.assert_not_called()
+        m_driver._release_vlan_ids.assert_called_once_with(trunk_id, [1, 2])
+        m_driver._resync_vlan_ids.assert_not_called()
 
     def test_release_vif(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
@@ -298,6 +384,8 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         m_driver._remove_subport.assert_called_once_with(
             neutron, trunk_id, vif.id)
         neutron.delete_port.assert_called_once_with(vif.id)
+        m_driver._release_vlan_id.assert_called_once_with(trunk_id,
+                                                          vif.vlan_id)
 
     def test_release_vif_not_found(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
@@ -378,8 +466,7 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         security_groups = mock.sentinel.security_groups
         self._test_get_port_request(m_to_fips, security_groups, unbound=True)
 
-    @mock.patch('kuryr.lib.segmentation_type_drivers.allocate_segmentation_id')
-    def test__create_subports_info(self, m_allocate_seg_id):
+    def test__create_subports_info(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
 
@@ -389,16 +476,14 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         security_groups = mock.sentinel.security_groups
         trunk_id = mock.sentinel.trunk_id
         num_ports = 2
-        in_use_vlan = set([1])
         port = mock.sentinel.port
         subports_info = [{'segmentation_id': i + 2,
                           'port_id': '',
                           'segmentation_type': 'vlan'}
                          for i in range(num_ports)]
 
-        m_driver._get_in_use_vlan_ids_set.return_value = in_use_vlan
         m_driver._get_port_request.return_value = {'port': port}
-        m_allocate_seg_id.side_effect = [2, 3]
+        m_driver._get_vlan_id.side_effect = [2, 3]
 
         port_res, subports_res = cls._create_subports_info(
             m_driver, pod, project_id, subnets, security_groups, trunk_id,
@@ -407,13 +492,12 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         self.assertEqual(port_res, port)
         self.assertEqual(subports_res, subports_info)
 
-        m_driver._get_in_use_vlan_ids_set.assert_called_once_with(trunk_id)
         m_driver._get_port_request.assert_called_once_with(
             pod, project_id, subnets, security_groups, False)
-        self.assertEqual(m_allocate_seg_id.call_count, 2)
+        m_driver._get_vlan_id.assert_has_calls([mock.call(trunk_id),
+                                                mock.call(trunk_id)])
 
-    @mock.patch('kuryr.lib.segmentation_type_drivers.allocate_segmentation_id')
-    def test__create_subports_info_not_enough_vlans(self, m_allocate_seg_id):
+    def test__create_subports_info_not_enough_vlans(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
 
@@ -423,15 +507,13 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         security_groups = mock.sentinel.security_groups
         trunk_id = mock.sentinel.trunk_id
         num_ports = 2
-        in_use_vlan = set([1])
         port = mock.sentinel.port
         subports_info = [{'segmentation_id': 2,
                           'port_id': '',
                           'segmentation_type': 'vlan'}]
 
-        m_driver._get_in_use_vlan_ids_set.return_value = in_use_vlan
         m_driver._get_port_request.return_value = {'port': port}
-        m_allocate_seg_id.side_effect = [
+        m_driver._get_vlan_id.side_effect = [
             2, kl_exc.SegmentationIdAllocationFailure
         ]
 
@@ -442,13 +524,12 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         self.assertEqual(port_res, port)
         self.assertEqual(subports_res, subports_info)
 
-        m_driver._get_in_use_vlan_ids_set.assert_called_once_with(trunk_id)
         m_driver._get_port_request.assert_called_once_with(
             pod, project_id, subnets, security_groups, False)
-        self.assertEqual(m_allocate_seg_id.call_count, 2)
+        m_driver._get_vlan_id.assert_has_calls([mock.call(trunk_id),
+                                                mock.call(trunk_id)])
 
-    @mock.patch('kuryr.lib.segmentation_type_drivers.allocate_segmentation_id')
-    def test__create_subports_info_no_vlans(self, m_allocate_seg_id):
+    def test__create_subports_info_no_vlans(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
 
@@ -458,12 +539,11 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         security_groups = mock.sentinel.security_groups
         trunk_id = mock.sentinel.trunk_id
         num_ports = 2
-        in_use_vlan = set([1])
         port = mock.sentinel.port
 
-        m_driver._get_in_use_vlan_ids_set.return_value = in_use_vlan
         m_driver._get_port_request.return_value = {'port': port}
-        m_allocate_seg_id.side_effect = kl_exc.SegmentationIdAllocationFailure
+        m_driver._get_vlan_id.side_effect = (
+            kl_exc.SegmentationIdAllocationFailure)
 
         port_res, subports_res = cls._create_subports_info(
             m_driver, pod, project_id, subnets, security_groups, trunk_id,
@@ -472,10 +552,9 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         self.assertEqual(port_res, port)
         self.assertEqual(subports_res, [])
 
-        m_driver._get_in_use_vlan_ids_set.assert_called_once_with(trunk_id)
         m_driver._get_port_request.assert_called_once_with(
             pod, project_id, subnets, security_groups, False)
-        self.assertEqual(m_allocate_seg_id.call_count, 1)
+        m_driver._get_vlan_id.assert_called_once_with(trunk_id)
 
     def test_get_trunk_id(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
@@ -493,27 +572,33 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         self.assertRaises(k_exc.K8sNodeTrunkPortFailure,
                           cls._get_trunk_id, m_driver, port)
 
+    def _get_subports_adder(self, m_driver):
+        m_driver._subports_adder = mock.Mock(
+            spec=d_utils.RequestsCoalescer)
+        return m_driver._subports_adder.submit
+
     def test_add_subport(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
+        submit = self._get_subports_adder(m_driver)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
         trunk_id = mock.sentinel.trunk_id
         subport = mock.sentinel.subport
         vlan_id = mock.sentinel.vlan_id
         m_driver._get_vlan_id.return_value = vlan_id
-        subport_dict = [{'segmentation_id': vlan_id,
-                         'port_id': subport,
-                         'segmentation_type': 'vlan'}]
+        subport_info = {'segmentation_id': vlan_id,
+                        'port_id': subport,
+                        'segmentation_type': 'vlan'}
         nested_vlan_vif.DEFAULT_MAX_RETRY_COUNT = 1
         self.assertEqual(vlan_id, cls._add_subport(m_driver,
                          neutron, trunk_id, subport))
         m_driver._get_vlan_id.assert_called_once_with(trunk_id)
-        neutron.trunk_add_subports.assert_called_once_with(
-            trunk_id, {'sub_ports': subport_dict})
+        submit.assert_called_once_with(trunk_id, subport_info)
 
     def test_add_subport_get_vlanid_failure(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
+        submit = self._get_subports_adder(m_driver)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
         trunk_id = mock.sentinel.trunk_id
         subport = mock.sentinel.subport
@@ -524,70 +609,338 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
             m_driver, neutron, trunk_id, subport)
 
         m_driver._get_vlan_id.assert_called_once_with(trunk_id)
+        submit.assert_not_called()
 
     def test_add_subport_with_vlan_id_conflict(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
+        submit = self._get_subports_adder(m_driver)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
         trunk_id = mock.sentinel.trunk_id
         subport = mock.sentinel.subport
         vlan_id = mock.sentinel.vlan_id
         m_driver._get_vlan_id.return_value = vlan_id
-        subport_dict = [{'segmentation_id': vlan_id,
-                         'port_id': subport,
-                         'segmentation_type': 'vlan'}]
-        neutron.trunk_add_subports.side_effect = n_exc.Conflict
+        subport_info = {'segmentation_id': vlan_id,
+                        'port_id': subport,
+                        'segmentation_type': 'vlan'}
+        submit.side_effect = n_exc.Conflict
         nested_vlan_vif.DEFAULT_MAX_RETRY_COUNT = 1
         self.assertRaises(n_exc.Conflict, cls._add_subport, m_driver,
                           neutron, trunk_id, subport)
 
+        submit.assert_called_once_with(trunk_id, subport_info)
+        m_driver._release_vlan_id.assert_called_once_with(trunk_id, vlan_id)
+        m_driver._resync_vlan_ids.assert_called_once_with(trunk_id)
+
+    def test_add_subport_with_vlan_id_conflict_retry(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        submit = self._get_subports_adder(m_driver)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        trunk_id = mock.sentinel.trunk_id
+        subport = mock.sentinel.subport
+        m_driver._get_vlan_id.side_effect = [100, 101]
+        submit.side_effect = [n_exc.Conflict, None]
+        nested_vlan_vif.DEFAULT_MAX_RETRY_COUNT = 2
+
+        self.assertEqual(101, cls._add_subport(m_driver, neutron, trunk_id,
+                                               subport))
+        self.assertEqual(2, submit.call_count)
+        m_driver._release_vlan_id.assert_called_once_with(trunk_id, 100)
+        m_driver._resync_vlan_ids.assert_called_once_with(trunk_id)
+
+    def test_add_subport_exception(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        submit = self._get_subports_adder(m_driver)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        trunk_id = mock.sentinel.trunk_id
+        subport = mock.sentinel.subport
+        m_driver._get_vlan_id.return_value = 100
+        submit.side_effect = n_exc.NeutronClientException
+        nested_vlan_vif.DEFAULT_MAX_RETRY_COUNT = 1
+
+        self.assertRaises(n_exc.NeutronClientException, cls._add_subport,
+                          m_driver, neutron, trunk_id, subport)
+        m_driver._release_vlan_id.assert_called_once_with(trunk_id, 100)
+        m_driver._resync_vlan_ids.assert_not_called()
+
+    def test_send_add_subports(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        trunk_id = mock.sentinel.trunk_id
+        subports_info = [mock.sentinel.subport_info1,
+                         mock.sentinel.subport_info2]
+
+        self.assertEqual([None, None], cls._send_add_subports(
+            m_driver, trunk_id, subports_info))
         neutron.trunk_add_subports.assert_called_once_with(
-            trunk_id, {'sub_ports': subport_dict})
+            trunk_id, {'sub_ports': subports_info})
+
+    def test_detach_vifs(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        trunk_id = mock.sentinel.trunk_id
+        parent_port = mock.sentinel.parent_port
+        vif1 = mock.Mock(id='port1', vlan_id=100)
+        vif2 = mock.Mock(id='port2', vlan_id=101)
+        m_driver._get_parent_port_by_host_ip.return_value = parent_port
+        m_driver._get_trunk_id.return_value = trunk_id
+
+        cls._detach_vifs(m_driver, neutron, '10.0.0.5', [vif1, vif2])
+
+        m_driver._get_parent_port_by_host_ip.assert_called_once_with(
+            neutron, '10.0.0.5')
+        m_driver._remove_subports.assert_called_once_with(
+            neutron, trunk_id, ['port1', 'port2'])
+        m_driver._remove_subport.assert_not_called()
+        m_driver._release_vlan_ids.assert_called_once_with(trunk_id,
+                                                           [100, 101])
+
+    def test_detach_vifs_remove_subports_exception(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        trunk_id = mock.sentinel.trunk_id
+        vif1 = mock.Mock(id='port1', vlan_id=100)
+        vif2 = mock.Mock(id='port2', vlan_id=101)
+        m_driver._get_trunk_id.return_value = trunk_id
+        m_driver._remove_subports.side_effect = n_exc.NeutronClientException
+        m_driver._remove_subport.side_effect = [n_exc.NeutronClientException,
+                                                None]
+
+        cls._detach_vifs(m_driver, neutron, '10.0.0.5', [vif1, vif2])
+
+        m_driver._remove_subport.assert_has_calls([
+            mock.call(neutron, trunk_id, 'port1'),
+            mock.call(neutron, trunk_id, 'port2')])
+        m_driver._release_vlan_ids.assert_called_once_with(trunk_id,
+                                                           [100, 101])
+
+    def test_detach_vifs_no_trunk(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        m_driver._get_trunk_id.side_effect = k_exc.K8sNodeTrunkPortFailure
+
+        cls._detach_vifs(m_driver, neutron, '10.0.0.5',
+                         [mock.Mock(id='port1', vlan_id=100)])
+        m_driver._remove_subports.assert_not_called()
+        m_driver._release_vlan_ids.assert_not_called()
+        m_driver._invalidate_parent_port.assert_called_once_with('10.0.0.5')
+
+    def test_detach_vifs_no_parent_port(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        m_driver._get_parent_port_by_host_ip.side_effect = (
+            kl_exc.NoResourceException)
+
+        cls._detach_vifs(m_driver, neutron, '10.0.0.5',
+                         [mock.Mock(id='port1', vlan_id=100)])
+        m_driver._remove_subports.assert_not_called()
+        m_driver._release_vlan_ids.assert_not_called()
+
+    def test_detach_vifs_trunk_not_found(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        trunk_id = mock.sentinel.trunk_id
+        m_driver._get_trunk_id.return_value = trunk_id
+        m_driver._remove_subports.side_effect = n_exc.NotFound
+        m_driver._vlan_ids_allocators = {trunk_id: mock.sentinel.allocator}
+
+        cls._detach_vifs(m_driver, neutron, '10.0.0.5',
+                         [mock.Mock(id='port1', vlan_id=100)])
+        m_driver._remove_subport.assert_not_called()
+        self.assertEqual({}, m_driver._vlan_ids_allocators)
+        m_driver._invalidate_parent_port.assert_called_once_with('10.0.0.5')
+
+    @mock.patch('kuryr_kubernetes.os_vif_util.'
+                'neutron_to_osvif_vif_nested_vlan')
+    def test_get_attached_vifs(self, m_to_vif):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        port1 = {'id': 'port1'}
+        port2 = {'id': 'port2'}
+        m_driver._parent_ports = {'10.0.0.5': {'id': 'parent1'},
+                                  '10.0.0.6': {'id': 'parent2'}}
+        neutron.list_trunks.return_value = {'trunks': [
+            {'port_id': 'parent1',
+             'sub_ports': [{'port_id': 'port1', 'segmentation_id': 100},
+                           {'port_id': 'other', 'segmentation_id': 101}]},
+            {'port_id': 'unknown_parent',
+             'sub_ports': [{'port_id': 'port2', 'segmentation_id': 100}]}]}
+        port_subnets = mock.sentinel.port_subnets
+        m_driver._get_port_subnets.return_value = port_subnets
+        m_to_vif.return_value = mock.sentinel.vif
+        subnets = mock.sentinel.subnets
+
+        self.assertEqual({'10.0.0.5': [(port1, mock.sentinel.vif)]},
+                         cls._get_attached_vifs(m_driver, neutron,
+                                                [port1, port2], subnets))
+        m_driver._load_parent_ports.assert_called_once_with(neutron)
+        m_driver._get_port_subnets.assert_called_once_with(port1, subnets)
+        m_to_vif.assert_called_once_with(port1, port_subnets, 100)
 
     def test_remove_subport(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
+        m_driver._subports_remover = mock.Mock(
+            spec=d_utils.RequestsCoalescer)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
         trunk_id = mock.sentinel.trunk_id
         subport_id = mock.sentinel.subport_id
-        subportid_dict = [{'port_id': subport_id}]
         cls._remove_subport(m_driver, neutron, trunk_id, subport_id)
 
+        m_driver._subports_remover.submit.assert_called_once_with(
+            trunk_id, subport_id)
+
+    def test_send_remove_subports(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        trunk_id = mock.sentinel.trunk_id
+        subports_id = [mock.sentinel.subport_id1, mock.sentinel.subport_id2]
+
+        self.assertEqual([None, None], cls._send_remove_subports(
+            m_driver, trunk_id, subports_id))
+        m_driver._remove_subports.assert_called_once_with(
+            neutron, trunk_id, subports_id)
+
+    def test_remove_subports(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        trunk_id = mock.sentinel.trunk_id
+        subport_id1 = mock.sentinel.subport_id1
+        subport_id2 = mock.sentinel.subport_id2
+        subportid_dict = [{'port_id': subport_id1},
+                          {'port_id': subport_id2}]
+        cls._remove_subports(m_driver, neutron, trunk_id,
+                             [subport_id1, subport_id2])
+
         neutron.trunk_remove_subports.assert_called_once_with(
             trunk_id, {'sub_ports': subportid_dict})
 
-    @mock.patch('kuryr.lib.segmentation_type_drivers.allocate_segmentation_id')
-    def test_get_vlan_id(self, mock_alloc_seg_id):
+    def test_remove_subports_exception(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        trunk_id = mock.sentinel.trunk_id
+        subport_id = mock.sentinel.subport_id
+        neutron.trunk_remove_subports.side_effect = (
+            n_exc.NeutronClientException)
+
+        self.assertRaises(n_exc.NeutronClientException,
+                          cls._remove_subports, m_driver, neutron, trunk_id,
+                          [subport_id])
+
+    def test_get_vlan_ids_allocator(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        trunk_id = mock.sentinel.trunk_id
+        m_driver._vlan_ids_lock = mock.MagicMock()
+        m_driver._vlan_ids_allocators = {}
+        m_driver._get_in_use_vlan_ids_set.return_value = {100}
+
+        allocator = cls._get_vlan_ids_allocator(m_driver, trunk_id)
+
+        self.assertTrue(allocator.is_in_use(100))
+        self.assertEqual({trunk_id: allocator},
+                         m_driver._vlan_ids_allocators)
+        m_driver._get_in_use_vlan_ids_set.assert_called_once_with(trunk_id)
+
+    def test_get_vlan_ids_allocator_known_trunk(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        trunk_id = mock.sentinel.trunk_id
+        allocator = mock.sentinel.allocator
+        m_driver._vlan_ids_lock = mock.MagicMock()
+        m_driver._vlan_ids_allocators = {trunk_id: allocator}
+
+        self.assertEqual(allocator,
+                         cls._get_vlan_ids_allocator(m_driver, trunk_id))
+        m_driver._get_in_use_vlan_ids_set.assert_not_called()
+
+    def test_get_vlan_id(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        vlanid_set = mock.sentinel.vlanid_set
         trunk_id = mock.sentinel.trunk_id
-        m_driver._get_in_use_vlan_ids_set.return_value = vlanid_set
-        cls._get_vlan_id(m_driver, trunk_id)
+        allocator = mock.Mock(spec=nested_vlan_vif.VlanIdAllocator)
+        allocator.allocate.return_value = 100
+        m_driver._get_vlan_ids_allocator.return_value = allocator
 
-        mock_alloc_seg_id.assert_called_once_with(vlanid_set)
+        self.assertEqual(100, cls._get_vlan_id(m_driver, trunk_id))
+        m_driver._get_vlan_ids_allocator.assert_called_once_with(trunk_id)
 
-    @mock.patch('kuryr.lib.segmentation_type_drivers.allocate_segmentation_id')
-    def test_get_vlan_id_exhausted(self, mock_alloc_seg_id):
+    def test_get_vlan_id_exhausted(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        vlanid_set = mock.sentinel.vlanid_set
         trunk_id = mock.sentinel.trunk_id
-        m_driver._get_in_use_vlan_ids_set.return_value = vlanid_set
-        mock_alloc_seg_id.side_effect = kl_exc.SegmentationIdAllocationFailure
+        allocator = mock.Mock(spec=nested_vlan_vif.VlanIdAllocator)
+        allocator.allocate.side_effect = kl_exc.SegmentationIdAllocationFailure
+        m_driver._get_vlan_ids_allocator.return_value = allocator
+
         self.assertRaises(kl_exc.SegmentationIdAllocationFailure,
                           cls._get_vlan_id, m_driver, trunk_id)
 
-        mock_alloc_seg_id.assert_called_once_with(vlanid_set)
+    def test_release_vlan_id(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        trunk_id = mock.sentinel.trunk_id
+        cls._release_vlan_id(m_driver, trunk_id, 100)
+
+        m_driver._release_vlan_ids.assert_called_once_with(trunk_id, [100])
+
+    def test_release_vlan_ids(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        trunk_id = mock.sentinel.trunk_id
+        allocator = nested_vlan_vif.VlanIdAllocator([100, 101, 102])
+        m_driver._vlan_ids_allocators = {trunk_id: allocator}
+
+        cls._release_vlan_ids(m_driver, trunk_id, [100, 102])
+
+        self.assertFalse(allocator.is_in_use(100))
+        self.assertTrue(allocator.is_in_use(101))
+        self.assertFalse(allocator.is_in_use(102))
 
-    @mock.patch('kuryr.lib.segmentation_type_drivers.release_segmentation_id')
-    def test_release_vlan_id(self, mock_rel_seg_id):
+    def test_release_vlan_ids_unknown_trunk(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        vlanid = mock.sentinel.vlanid
-        cls._release_vlan_id(m_driver, vlanid)
+        m_driver._vlan_ids_allocators = {}
+
+        cls._release_vlan_ids(m_driver, mock.sentinel.trunk_id, [100])
 
-        mock_rel_seg_id.assert_called_once_with(vlanid)
+    def test_resync_vlan_ids(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        trunk_id = mock.sentinel.trunk_id
+        allocator = nested_vlan_vif.VlanIdAllocator([100])
+        m_driver._get_vlan_ids_allocator.return_value = allocator
+        m_driver._get_in_use_vlan_ids_set.return_value = {200}
+
+        cls._resync_vlan_ids(m_driver, trunk_id)
+
+        self.assertTrue(allocator.is_in_use(100))
+        self.assertTrue(allocator.is_in_use(200))
+
+    def test_resync_vlan_ids_exception(self):
+        cls = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        trunk_id = mock.sentinel.trunk_id
+        m_driver._vlan_ids_allocators = {trunk_id: mock.sentinel.allocator}
+        m_driver._get_in_use_vlan_ids_set.side_effect = (
+            n_exc.NeutronClientException)
+
+        cls._resync_vlan_ids(m_driver, trunk_id)
+
+        self.assertEqual({}, m_driver._vlan_ids_allocators)
 
     def test_get_in_use_vlan_ids_set(self):
         cls = nested_vlan_vif.NestedVlanPodVIFDriver
@@ -607,3 +960,57 @@ class TestNestedVlanPodVIFDriver(test_base.TestCase):
         neutron.show_trunk.return_value = trunk
         self.assertEqual(vlan_ids,
                          cls._get_in_use_vlan_ids_set(m_driver, trunk_id))
+
+
+class TestVlanIdAllocator(test_base.TestCase):
+
+    def test_allocate(self):
+        allocator = nested_vlan_vif.VlanIdAllocator([100])
+
+        vlan_id = allocator.allocate()
+
+        self.assertNotEqual(100, vlan_id)
+        self.assertTrue(kl_const.MIN_VLAN_TAG <= vlan_id <=
+                        kl_const.MAX_VLAN_TAG)
+        self.assertTrue(allocator.is_in_use(vlan_id))
+
+    @mock.patch('random.randint')
+    def test_allocate_from_random_start(self, m_randint):
+        allocator = nested_vlan_vif.VlanIdAllocator([100, 101])
+        m_randint.return_value = 100
+
+        self.assertEqual(102, allocator.allocate())
+
+    @mock.patch('random.randint')
+    def test_allocate_wraps_around(self, m_randint):
+        in_use = range(10, kl_const.MAX_VLAN_TAG + 1)
+        allocator = nested_vlan_vif.VlanIdAllocator(in_use)
+        m_randint.return_value = 4000
+
+        self.assertEqual(1, allocator.allocate())
+
+    def test_allocate_all(self):
+        allocator = nested_vlan_vif.VlanIdAllocator()
+
+        vlan_ids = set(allocator.allocate()
+                       for _ in range(kl_const.MAX_VLAN_TAG))
+
+        self.assertEqual(set(range(kl_const.MIN_VLAN_TAG,
+                                   kl_const.MAX_VLAN_TAG + 1)), vlan_ids)
+        self.assertRaises(kl_exc.SegmentationIdAllocationFailure,
+                          allocator.allocate)
+
+    def test_release(self):
+        allocator = nested_vlan_vif.VlanIdAllocator([100])
+
+        allocator.release(100)
+
+        self.assertFalse(allocator.is_in_use(100))
+
+    def test_reserved_ids(self):
+        allocator = nested_vlan_vif.VlanIdAllocator()
+
+        self.assertTrue(allocator.is_in_use(0))
+        self.assertTrue(allocator.is_in_use(kl_const.MAX_VLAN_TAG + 1))
+        self.assertFalse(allocator.is_in_use(kl_const.MIN_VLAN_TAG))
+        self.assertFalse(allocator.is_in_use(kl_const.MAX_VLAN_TAG))
@@ -17,8 +17,10 @@ import mock
 
 from kuryr.lib import constants as kl_const
 from neutronclient.common import exceptions as n_exc
+from oslo_config import cfg as oslo_cfg
 
 from kuryr_kubernetes.controller.drivers import neutron_vif
+from kuryr_kubernetes.controller.drivers import utils as d_utils
 from kuryr_kubernetes import exceptions as k_exc
 from kuryr_kubernetes.tests import base as test_base
 from kuryr_kubernetes.tests.unit import kuryr_fixtures as k_fix
@@ -53,6 +55,45 @@ class NeutronPodVIFDriver(test_base.TestCase):
             pod, project_id, subnets, security_groups)
         neutron.create_port.assert_called_once_with(port_request)
         m_driver._get_vif_plugin.assert_called_once_with(port)
+        m_driver._cache_vif_plugin.assert_called_once_with(port_request,
+                                                           vif_plugin)
+        m_to_vif.assert_called_once_with(vif_plugin, port, subnets)
+
+    @mock.patch('kuryr_kubernetes.os_vif_util.neutron_to_osvif_vif')
+    def test_request_vif_batched(self, m_to_vif):
+        cls = neutron_vif.NeutronPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        ports_creator = mock.Mock(spec=d_utils.RequestsCoalescer)
+        m_driver._ports_creator = ports_creator
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        oslo_cfg.CONF.set_override('port_creation_batch_window',
+                                   0.01,
+                                   group='pod_vif_neutron')
+        self.addCleanup(oslo_cfg.CONF.clear_override,
+                        'port_creation_batch_window',
+                        group='pod_vif_neutron')
+
+        pod = mock.sentinel.pod
+        project_id = mock.sentinel.project_id
+        subnets = mock.sentinel.subnets
+        security_groups = mock.sentinel.security_groups
+        port = mock.sentinel.port
+        port_request = mock.sentinel.port_request
+        key = mock.sentinel.key
+        vif = mock.sentinel.vif
+        vif_plugin = mock.sentinel.vif_plugin
+
+        m_to_vif.return_value = vif
+        m_driver._get_port_request.return_value = port_request
+        m_driver._get_port_request_key.return_value = key
+        m_driver._get_vif_plugin.return_value = vif_plugin
+        ports_creator.submit.return_value = port
+
+        self.assertEqual(vif, cls.request_vif(m_driver, pod, project_id,
+                                              subnets, security_groups))
+
+        ports_creator.submit.assert_called_once_with(key, port_request)
+        neutron.create_port.assert_not_called()
         m_to_vif.assert_called_once_with(vif_plugin, port, subnets)
 
     @mock.patch('kuryr_kubernetes.os_vif_util.neutron_to_osvif_vif')
@@ -89,6 +130,70 @@ class NeutronPodVIFDriver(test_base.TestCase):
                  mock.call(vif_plugin, port, subnets)]
         m_to_vif.assert_has_calls(calls)
 
+    @mock.patch('kuryr_kubernetes.os_vif_util.neutron_to_osvif_vif')
+    def test_request_vifs_unbound(self, m_to_vif):
+        cls = neutron_vif.NeutronPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        m_driver._vif_plugins = {}
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        pod = mock.sentinel.pod
+        project_id = mock.sentinel.project_id
+        subnets = mock.sentinel.subnets
+        security_groups = mock.sentinel.security_groups
+
+        port_request = {'port': {'binding:host_id': 'host1'}}
+        m_driver._get_port_request.return_value = port_request
+        port = mock.sentinel.port
+        single_port = mock.sentinel.single_port
+        vif = mock.sentinel.vif
+
+        neutron.create_port.side_effect = [{'ports': [port, port]},
+                                           {'port': single_port}]
+        m_driver._get_vif_plugin.side_effect = ['unbound', 'ovs']
+        m_to_vif.return_value = vif
+
+        self.assertEqual([vif, vif, vif], cls.request_vifs(
+            m_driver, pod, project_id, subnets, security_groups, 2))
+
+        neutron.create_port.assert_has_calls([
+            mock.call({'ports': [port_request, port_request]}),
+            mock.call(port_request)])
+        m_driver._cache_vif_plugin.assert_called_once_with(port_request,
+                                                           'ovs')
+        m_to_vif.assert_has_calls([mock.call('ovs', port, subnets),
+                                   mock.call('ovs', port, subnets),
+                                   mock.call('ovs', single_port, subnets)])
+
+    @mock.patch('kuryr_kubernetes.os_vif_util.neutron_to_osvif_vif')
+    def test_request_vifs_unbound_cached(self, m_to_vif):
+        cls = neutron_vif.NeutronPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        m_driver._vif_plugins = {'host1': 'ovs'}
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        pod = mock.sentinel.pod
+        project_id = mock.sentinel.project_id
+        subnets = mock.sentinel.subnets
+        security_groups = mock.sentinel.security_groups
+
+        port_request = {'port': {'binding:host_id': 'host1'}}
+        m_driver._get_port_request.return_value = port_request
+        port = mock.sentinel.port
+        vif = mock.sentinel.vif
+
+        neutron.create_port.return_value = {'ports': [port, port]}
+        m_driver._get_vif_plugin.return_value = 'unbound'
+        m_to_vif.return_value = vif
+
+        self.assertEqual([vif, vif], cls.request_vifs(
+            m_driver, pod, project_id, subnets, security_groups, 2))
+
+        neutron.create_port.assert_called_once_with(
+            {'ports': [port_request, port_request]})
+        m_to_vif.assert_has_calls([mock.call('ovs', port, subnets),
+                                   mock.call('ovs', port, subnets)])
+
     @mock.patch('kuryr_kubernetes.os_vif_util.neutron_to_osvif_vif')
     def test_request_vifs_exception(self, m_to_vif):
         cls = neutron_vif.NeutronPodVIFDriver
@@ -145,25 +250,26 @@ class NeutronPodVIFDriver(test_base.TestCase):
     def test_activate_vif(self):
         cls = neutron_vif.NeutronPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        poller = mock.Mock(spec=d_utils.StatusPoller)
+        m_driver._activation_poller = poller
 
         pod = mock.sentinel.pod
         vif = mock.Mock()
         vif.active = False
-        port = mock.MagicMock()
-
-        port.__getitem__.return_value = kl_const.PORT_STATUS_ACTIVE
-        neutron.show_port.return_value = {'port': port}
+        poller.wait.return_value = kl_const.PORT_STATUS_ACTIVE
 
         cls.activate_vif(m_driver, pod, vif)
 
-        neutron.show_port.assert_called_once_with(vif.id)
+        poller.wait.assert_called_once_with(
+            vif.id, (kl_const.PORT_STATUS_ACTIVE,),
+            oslo_cfg.CONF.pod_vif_neutron.port_activation_timeout)
         self.assertTrue(vif.active)
 
     def test_activate_vif_active(self):
         cls = neutron_vif.NeutronPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        poller = mock.Mock(spec=d_utils.StatusPoller)
+        m_driver._activation_poller = poller
 
         pod = mock.sentinel.pod
         vif = mock.Mock()
@@ -171,24 +277,162 @@ class NeutronPodVIFDriver(test_base.TestCase):
 
         cls.activate_vif(m_driver, pod, vif)
 
-        neutron.show_port.assert_not_called()
+        poller.wait.assert_not_called()
 
     def test_activate_vif_not_ready(self):
         cls = neutron_vif.NeutronPodVIFDriver
         m_driver = mock.Mock(spec=cls)
-        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        poller = mock.Mock(spec=d_utils.StatusPoller)
+        m_driver._activation_poller = poller
 
         pod = mock.sentinel.pod
         vif = mock.Mock()
         vif.active = False
-        port = mock.MagicMock()
+        poller.wait.return_value = kl_const.PORT_STATUS_DOWN
+
+        self.assertRaises(k_exc.ResourceNotReady, cls.activate_vif,
+                          m_driver, pod, vif)
+        self.assertFalse(vif.active)
+
+    def test_activate_vif_not_found(self):
+        cls = neutron_vif.NeutronPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        poller = mock.Mock(spec=d_utils.StatusPoller)
+        m_driver._activation_poller = poller
 
-        port.__getitem__.return_value = kl_const.PORT_STATUS_DOWN
-        neutron.show_port.return_value = {'port': port}
+        pod = mock.sentinel.pod
+        vif = mock.Mock()
+        vif.active = False
+        poller.wait.return_value = None
 
         self.assertRaises(k_exc.ResourceNotReady, cls.activate_vif,
                           m_driver, pod, vif)
 
+    @mock.patch('kuryr_kubernetes.controller.drivers.utils.LIST_MAX_IDS', 2)
+    def test_get_ports_status(self):
+        cls = neutron_vif.NeutronPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        neutron.list_ports.side_effect = [
+            {'ports': [{'id': 'port1', 'status': 'ACTIVE'},
+                       {'id': 'port2', 'status': 'DOWN'}]},
+            {'ports': [{'id': 'port3', 'status': 'ACTIVE'}]}]
+
+        self.assertEqual({'port1': 'ACTIVE', 'port2': 'DOWN',
+                          'port3': 'ACTIVE'},
+                         cls._get_ports_status(
+                             m_driver, ['port1', 'port2', 'port3', 'port4']))
+        neutron.list_ports.assert_has_calls([
+            mock.call(id=['port1', 'port2'], fields=['id', 'status']),
+            mock.call(id=['port3', 'port4'], fields=['id', 'status'])])
+
+    def test_get_port_request_key(self):
+        cls = neutron_vif.NeutronPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+
+        port_request = {'port': {'binding:host_id': 'host1',
+                                 'project_id': 'project1',
+                                 'network_id': 'net1',
+                                 'security_groups': ['sg2', 'sg1']}}
+
+        self.assertEqual(('host1', 'project1', 'net1', ('sg1', 'sg2')),
+                         cls._get_port_request_key(m_driver, port_request))
+
+    def test_create_ports_single(self):
+        cls = neutron_vif.NeutronPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        port_request = mock.sentinel.port_request
+        port = mock.sentinel.port
+        neutron.create_port.return_value = {'port': port}
+
+        self.assertEqual([port], cls._create_ports(
+            m_driver, mock.sentinel.key, [port_request]))
+        neutron.create_port.assert_called_once_with(port_request)
+
+    def test_create_ports(self):
+        cls = neutron_vif.NeutronPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        port_requests = [mock.sentinel.port_request1,
+                         mock.sentinel.port_request2]
+        ports = [{'id': 'port1', 'binding:vif_type': 'ovs'},
+                 {'id': 'port2', 'binding:vif_type': 'ovs'}]
+        neutron.create_port.return_value = {'ports': ports}
+        m_driver._get_vif_plugin.return_value = 'ovs'
+
+        self.assertEqual(ports, cls._create_ports(
+            m_driver, ('host1',), port_requests))
+        neutron.create_port.assert_called_once_with({'ports': port_requests})
+        neutron.show_port.assert_not_called()
+
+    def test_create_ports_unbound(self):
+        cls = neutron_vif.NeutronPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        m_driver._vif_plugins = {}
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        port_requests = [mock.sentinel.port_request1,
+                         mock.sentinel.port_request2]
+        ports = [{'id': 'port1', 'binding:vif_type': 'unbound'},
+                 {'id': 'port2', 'binding:vif_type': 'unbound'}]
+        neutron.create_port.return_value = {'ports': ports}
+        bound_port = {'id': 'port1', 'binding:vif_type': 'ovs'}
+        neutron.show_port.return_value = {'port': bound_port}
+        m_driver._get_vif_plugin.side_effect = (
+            lambda port: port['binding:vif_type'])
+
+        ports = cls._create_ports(m_driver, ('host1',), port_requests)
+
+        self.assertEqual(['ovs', 'ovs'],
+                         [p['binding:vif_type'] for p in ports])
+        neutron.show_port.assert_called_once_with('port1')
+
+    def test_create_ports_unbound_cached(self):
+        cls = neutron_vif.NeutronPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        m_driver._vif_plugins = {'host1': 'ovs'}
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        port_requests = [mock.sentinel.port_request1,
+                         mock.sentinel.port_request2]
+        ports = [{'id': 'port1', 'binding:vif_type': 'unbound'},
+                 {'id': 'port2', 'binding:vif_type': 'unbound'}]
+        neutron.create_port.return_value = {'ports': ports}
+        m_driver._get_vif_plugin.side_effect = (
+            lambda port: port['binding:vif_type'])
+
+        ports = cls._create_ports(m_driver, ('host1',), port_requests)
+
+        self.assertEqual(['ovs', 'ovs'],
+                         [p['binding:vif_type'] for p in ports])
+        neutron.show_port.assert_not_called()
+
+    def test_cache_vif_plugin(self):
+        cls = neutron_vif.NeutronPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        m_driver._vif_plugins = {}
+
+        cls._cache_vif_plugin(m_driver,
+                              {'port': {'binding:host_id': 'host1'}}, 'ovs')
+
+        self.assertEqual({'host1': 'ovs'}, m_driver._vif_plugins)
+
+    def test_cache_vif_plugin_not_bound(self):
+        cls = neutron_vif.NeutronPodVIFDriver
+        m_driver = mock.Mock(spec=cls)
+        m_driver._vif_plugins = {}
+
+        for vif_plugin in (None, 'unbound', 'binding_failed'):
+            cls._cache_vif_plugin(
+                m_driver, {'port': {'binding:host_id': 'host1'}}, vif_plugin)
+        cls._cache_vif_plugin(m_driver, {'port': {}}, 'ovs')
+
+        self.assertEqual({}, m_driver._vif_plugins)
+
     def _test_get_port_request(self, m_to_fips, security_groups,
                                unbound=False):
         cls = neutron_vif.NeutronPodVIFDriver
@@ -0,0 +1,307 @@
+# Copyright (c) 2017 Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+import mock
+
+from kuryr_kubernetes.controller.drivers import utils
+from kuryr_kubernetes.tests import base as test_base
+
+
+class TestListByIds(test_base.TestCase):
+
+    @mock.patch('kuryr_kubernetes.controller.drivers.utils.LIST_MAX_IDS', 2)
+    def test_list_by_ids(self):
+        list_func = mock.Mock()
+        list_func.side_effect = [{'ports': [{'id': 'port1'}]},
+                                 {'ports': [{'id': 'port3'}]}]
+
+        self.assertEqual([{'id': 'port1'}, {'id': 'port3'}],
+                         utils.list_by_ids(list_func, 'ports',
+                                           ['port1', 'port2', 'port3'],
+                                           ['id']))
+        list_func.assert_has_calls([
+            mock.call(id=['port1', 'port2'], fields=['id']),
+            mock.call(id=['port3'], fields=['id'])])
+
+
+class TestRequestsCoalescer(test_base.TestCase):
+
+    def _submit_all(self, coalescer, requests):
+        threads = [eventlet.spawn(coalescer.submit, key, item)
+                   for key, item in requests]
+        results = []
+        for thread in threads:
+            try:
+                results.append(thread.wait())
+            except Exception as ex:
+                results.append(ex)
+        return results
+
+    def test_submit(self):
+        batch_func = mock.Mock(return_value=['a'])
+        coalescer = utils.RequestsCoalescer('test', batch_func, window=0)
+
+        self.assertEqual('a', coalescer.submit('key', 1))
+        batch_func.assert_called_once_with('key', [1])
+        self.assertEqual({1: 1}, coalescer.batch_sizes)
+
+    def test_submit_batches(self):
+        batch_func = mock.Mock(
+            side_effect=lambda key, items: [i * 2 for i in items])
+        coalescer = utils.RequestsCoalescer('test', batch_func, window=0)
+
+        results = self._submit_all(
+            coalescer, [('key1', 1), ('key2', 2), ('key1', 3)])
+
+        self.assertEqual([2, 4, 6], results)
+        batch_func.assert_has_calls([mock.call('key1', [1, 3]),
+                                     mock.call('key2', [2])],
+                                    any_order=True)
+        self.assertEqual(2, batch_func.call_count)
+        self.assertEqual({1: 1, 2: 1}, coalescer.batch_sizes)
+
+    def test_submit_during_batch(self):
+        calls = []
+
+        def batch_func(key, items):
+            calls.append(items)
+            if len(calls) == 1:
+                # the requests made while a batch is being sent go to the
+                # next batch, which is sent once this one finishes
+                threads.extend(eventlet.spawn(coalescer.submit, key, i)
+                               for i in (3, 4))
+                eventlet.sleep(0)
+            return items
+
+        coalescer = utils.RequestsCoalescer('test', batch_func, window=0)
+        threads = []
+        self.assertEqual(1, coalescer.submit('key', 1))
+        self.assertEqual([3, 4], [t.wait() for t in threads])
+        self.assertEqual([[1], [3, 4]], calls)
+
+    def test_submit_batch_failure(self):
+        def batch_func(key, items):
+            if len(items) > 1 or items[0] == 2:
+                raise ValueError()
+            return items
+
+        coalescer = utils.RequestsCoalescer('test', batch_func, window=0)
+
+        results = self._submit_all(coalescer,
+                                   [('key', 1), ('key', 2), ('key', 3)])
+
+        self.assertEqual(1, results[0])
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(3, results[2])
+
+    def test_submit_batch_failure_single_func(self):
+        batch_func = mock.Mock(side_effect=ValueError)
+        single_func = mock.Mock(side_effect=lambda key, item: item)
+        coalescer = utils.RequestsCoalescer('test', batch_func, single_func,
+                                            window=0)
+
+        results = self._submit_all(coalescer, [('key', 1), ('key', 2)])
+
+        self.assertEqual([1, 2], results)
+        batch_func.assert_called_once_with('key', [1, 2])
+        single_func.assert_has_calls([mock.call('key', 1),
+                                      mock.call('key', 2)])
+
+    def test_submit_single_failure(self):
+        batch_func = mock.Mock(side_effect=ValueError)
+        coalescer = utils.RequestsCoalescer('test', batch_func, window=0)
+
+        self.assertRaises(ValueError, coalescer.submit, 'key', 1)
+        batch_func.assert_called_once_with('key', [1])
+
+
+class TestStatusPoller(test_base.TestCase):
+
+    def test_wait(self):
+        list_func = mock.Mock(return_value={'id1': 'ACTIVE'})
+        poller = utils.StatusPoller('test', list_func, 0)
+
+        self.assertEqual('ACTIVE', poller.wait('id1', ('ACTIVE',), 1))
+        list_func.assert_called_once_with(['id1'])
+
+    def test_wait_polls_together(self):
+        list_func = mock.Mock(side_effect=[
+            {'id1': 'DOWN', 'id2': 'ACTIVE'},
+            {'id1': 'ACTIVE'}])
+        poller = utils.StatusPoller('test', list_func, 0)
+
+        threads = [eventlet.spawn(poller.wait, resource_id, ('ACTIVE',), 1)
+                   for resource_id in ('id1', 'id2')]
+
+        self.assertEqual(['ACTIVE', 'ACTIVE'], [t.wait() for t in threads])
+        list_func.assert_has_calls([mock.call(['id1', 'id2']),
+                                    mock.call(['id1'])])
+        self.assertEqual(2, list_func.call_count)
+
+    def test_wait_not_found(self):
+        list_func = mock.Mock(return_value={})
+        poller = utils.StatusPoller('test', list_func, 0)
+
+        self.assertIsNone(poller.wait('id1', ('ACTIVE',), 1))
+
+    def test_wait_timeout(self):
+        list_func = mock.Mock(return_value={'id1': 'DOWN'})
+        poller = utils.StatusPoller('test', list_func, 0.01)
+
+        self.assertEqual('DOWN', poller.wait('id1', ('ACTIVE',), 0.05))
+        self.assertEqual({}, poller._waiters)
+
+    def test_wait_list_failure(self):
+        list_func = mock.Mock(side_effect=[ValueError, {'id1': 'ACTIVE'}])
+        poller = utils.StatusPoller('test', list_func, 0)
+
+        self.assertEqual('ACTIVE', poller.wait('id1', ('ACTIVE',), 1))
+        self.assertEqual(2, list_func.call_count)
+
+
+class TestTTLCache(test_base.TestCase):
+
+    def test_get(self):
+        load_func = mock.Mock(side_effect=lambda key: key * 2)
+        cache = utils.TTLCache('test', load_func, 60, 10)
+
+        self.assertEqual(2, cache.get(1))
+        self.assertEqual(2, cache.get(1))
+        self.assertEqual(4, cache.get(2))
+
+        self.assertEqual(2, load_func.call_count)
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(2, cache.misses)
+
+    @mock.patch('time.time')
+    def test_get_expired(self, m_time):
+        load_func = mock.Mock(side_effect=lambda key: key * 2)
+        cache = utils.TTLCache('test', load_func, 60, 10)
+
+        m_time.return_value = 100
+        cache.get(1)
+        m_time.return_value = 161
+        cache.get(1)
+
+        self.assertEqual(2, load_func.call_count)
+
+    def test_get_evicted(self):
+        load_func = mock.Mock(side_effect=lambda key: key * 2)
+        cache = utils.TTLCache('test', load_func, 60, 2)
+
+        cache.get(1)
+        cache.get(2)
+        cache.get(1)
+        cache.get(3)
+        cache.get(1)
+        cache.get(2)
+
+        load_func.assert_has_calls([mock.call(1), mock.call(2),
+                                    mock.call(3), mock.call(2)])
+        self.assertEqual(4, load_func.call_count)
+
+    def test_get_single_flight(self):
+        def load_func(key):
+            eventlet.sleep(0.01)
+            return key * 2
+
+        m_load_func = mock.Mock(side_effect=load_func)
+        cache = utils.TTLCache('test', m_load_func, 60, 10)
+
+        threads = [eventlet.spawn(cache.get, 1) for _ in range(5)]
+
+        self.assertEqual([2] * 5, [t.wait() for t in threads])
+        m_load_func.assert_called_once_with(1)
+        self.assertEqual(4, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_get_single_flight_failure(self):
+        def load_func(key):
+            eventlet.sleep(0.01)
+            raise ValueError()
+
+        cache = utils.TTLCache('test', load_func, 60, 10)
+
+        threads = [eventlet.spawn(cache.get, 1) for _ in range(2)]
+
+        for thread in threads:
+            self.assertRaises(ValueError, thread.wait)
+        self.assertRaises(ValueError, cache.get, 1)
+
+    def test_get_single_flight_timeout(self):
+        m_load_func = mock.Mock(side_effect=lambda key: eventlet.sleep(1))
+        cache = utils.TTLCache('test', m_load_func, 60, 10)
+
+        def get():
+            with eventlet.Timeout(0.01):
+                return cache.get(1)
+
+        threads = [eventlet.spawn(get), eventlet.spawn(cache.get, 1)]
+
+        for thread in threads:
+            self.assertRaises(eventlet.Timeout, thread.wait)
+        m_load_func.side_effect = lambda key: key * 2
+        self.assertEqual(2, cache.get(1))
+        self.assertEqual(2, m_load_func.call_count)
+
+    def test_invalidate(self):
+        load_func = mock.Mock(side_effect=lambda key: key * 2)
+        cache = utils.TTLCache('test', load_func, 60, 10)
+
+        cache.get(1)
+        cache.get(2)
+        cache.invalidate(1)
+        cache.get(1)
+        cache.get(2)
+        self.assertEqual(3, load_func.call_count)
+
+        cache.invalidate()
+        cache.get(1)
+        cache.get(2)
+        self.assertEqual(5, load_func.call_count)
+
+
+class TestCIDRIndex(test_base.TestCase):
+
+    def test_lookup(self):
+        index = utils.CIDRIndex([('10.0.0.0/24', 'a'),
+                                 ('10.0.1.0/24', 'b'),
+                                 ('fd00::/64', 'c')])
+
+        self.assertEqual(['a'], index.lookup('10.0.0.10'))
+        self.assertEqual(['b'], index.lookup('10.0.1.255'))
+        self.assertEqual(['c'], index.lookup('fd00::10'))
+        self.assertEqual([], index.lookup('10.0.2.1'))
+        self.assertEqual([], index.lookup('fd01::10'))
+
+    def test_lookup_overlapping(self):
+        index = utils.CIDRIndex([('10.0.0.0/16', 'a'),
+                                 ('10.0.1.0/24', 'b'),
+                                 ('10.0.1.0/24', 'c')])
+
+        self.assertEqual(['a'], index.lookup('10.0.0.10'))
+        self.assertEqual(['a', 'b', 'c'], sorted(index.lookup('10.0.1.10')))
+
+    def test_lookup_many_cidrs(self):
+        cidrs = [('10.%d.%d.0/24' % (i // 256, i % 256), i)
+                 for i in range(4096)]
+        cidrs.extend(('172.16.%d.0/28' % i, -i) for i in range(1, 256))
+        index = utils.CIDRIndex(cidrs)
+
+        self.assertEqual([0], index.lookup('10.0.0.1'))
+        self.assertEqual([4095], index.lookup('10.15.255.254'))
+        self.assertEqual([-255], index.lookup('172.16.255.1'))
+        self.assertEqual([], index.lookup('10.16.0.1'))
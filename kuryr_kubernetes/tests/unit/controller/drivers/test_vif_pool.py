@@ -14,13 +14,19 @@
 
 import collections
 import ddt
+import eventlet
+import functools
 import mock
 
+from kuryr.lib import constants as kl_const
+from kuryr.lib import exceptions as kl_exc
 from neutronclient.common import exceptions as n_exc
 from oslo_config import cfg as oslo_cfg
+from oslo_serialization import jsonutils
 
 from os_vif.objects import vif as osv_vif
 
+from kuryr_kubernetes import constants
 from kuryr_kubernetes.controller.drivers import nested_vlan_vif
 from kuryr_kubernetes.controller.drivers import neutron_vif
 from kuryr_kubernetes.controller.drivers import vif_pool
@@ -99,6 +105,171 @@ def get_port_obj(port_id=None, device_owner=None, ip_address=None):
     return port_obj
 
 
+class NoopVIFPool(test_base.TestCase):
+
+    @mock.patch('kuryr_kubernetes.controller.drivers.default_subnet.'
+                'invalidate_subnet')
+    def test_request_vif_integrity_error(self, m_invalidate):
+        cls = vif_pool.NoopVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._drv_vif = mock.Mock(spec=neutron_vif.NeutronPodVIFDriver)
+        m_driver._drv_vif.request_vif.side_effect = exceptions.IntegrityError
+
+        pod = get_pod_obj()
+        subnets = {'subnet1': mock.sentinel.network,
+                   'subnet2': mock.sentinel.network}
+
+        self.assertRaises(exceptions.IntegrityError, cls.request_vif,
+                          m_driver, pod, mock.sentinel.project_id, subnets,
+                          mock.sentinel.security_groups)
+        m_invalidate.assert_has_calls([mock.call('subnet1'),
+                                       mock.call('subnet2')], any_order=True)
+
+    def test_release_vif(self):
+        cls = vif_pool.NoopVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._drv_vif = mock.Mock(spec=neutron_vif.NeutronPodVIFDriver)
+
+        pod = get_pod_obj()
+        vif = mock.sentinel.vif
+
+        cls.release_vif(m_driver, pod, vif)
+
+        m_driver._drv_vif.release_vif.assert_called_once_with(pod, vif)
+
+    @mock.patch('eventlet.spawn')
+    def test_release_vif_queued(self, m_eventlet):
+        cls = vif_pool.NoopVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._drv_vif = mock.Mock(spec=neutron_vif.NeutronPodVIFDriver)
+        m_driver._release_queue = eventlet.queue.LightQueue()
+        m_driver._release_workers = []
+        oslo_cfg.CONF.set_override('ports_release_concurrency',
+                                   2,
+                                   group='vif_pool')
+        self.addCleanup(oslo_cfg.CONF.clear_override,
+                        'ports_release_concurrency', group='vif_pool')
+
+        pod = get_pod_obj()
+        vif = mock.Mock()
+
+        cls.release_vif(m_driver, pod, vif)
+        cls.release_vif(m_driver, pod, vif)
+
+        m_driver._drv_vif.release_vif.assert_not_called()
+        self.assertEqual(2, m_eventlet.call_count)
+        self.assertEqual(2, len(m_driver._release_workers))
+        self.assertEqual((pod, vif, 1), m_driver._release_queue.get())
+        self.assertEqual(1, m_driver._release_queue.qsize())
+
+    def test__release_port(self):
+        cls = vif_pool.NoopVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._drv_vif = mock.Mock(spec=neutron_vif.NeutronPodVIFDriver)
+
+        pod = get_pod_obj()
+        vif = mock.sentinel.vif
+
+        cls._release_port(m_driver, pod, vif, 1)
+
+        m_driver._drv_vif.release_vif.assert_called_once_with(pod, vif)
+
+    @mock.patch('eventlet.spawn_after')
+    def test__release_port_retry(self, m_spawn_after):
+        cls = vif_pool.NoopVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._drv_vif = mock.Mock(spec=neutron_vif.NeutronPodVIFDriver)
+        m_driver._release_queue = mock.Mock()
+
+        pod = get_pod_obj()
+        vif = mock.Mock()
+        m_driver._drv_vif.release_vif.side_effect = (
+            n_exc.NeutronClientException)
+
+        cls._release_port(m_driver, pod, vif, 2)
+
+        m_spawn_after.assert_called_once_with(
+            vif_pool.RELEASE_RETRY_INTERVAL * 2,
+            m_driver._release_queue.put, (pod, vif, 3))
+
+    @mock.patch('eventlet.spawn_after')
+    def test__release_port_give_up(self, m_spawn_after):
+        cls = vif_pool.NoopVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._drv_vif = mock.Mock(spec=neutron_vif.NeutronPodVIFDriver)
+
+        pod = get_pod_obj()
+        vif = mock.Mock()
+        m_driver._drv_vif.release_vif.side_effect = (
+            n_exc.NeutronClientException)
+
+        cls._release_port(m_driver, pod, vif, vif_pool.RELEASE_ATTEMPTS)
+
+        m_spawn_after.assert_not_called()
+
+    def _set_default_project(self, project_id):
+        oslo_cfg.CONF.set_override('project', project_id,
+                                   group='neutron_defaults')
+        self.addCleanup(oslo_cfg.CONF.clear_override, 'project',
+                        group='neutron_defaults')
+
+    def test__delete_orphaned_ports(self):
+        cls = vif_pool.NoopVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        kubernetes = self.useFixture(k_fix.MockK8sClient()).client
+        self._set_default_project('project1')
+
+        neutron.list_ports.return_value = {'ports': [
+            {'id': 'port1', 'device_id': 'pod1', 'binding:host_id': 'node1'},
+            {'id': 'port2', 'device_id': 'pod2', 'binding:host_id': 'node1'},
+            {'id': 'port3', 'device_id': '', 'binding:host_id': 'node1'},
+            {'id': 'port4', 'device_id': 'pod4', 'binding:host_id': 'node1'},
+            {'id': 'port5', 'device_id': 'pod5',
+             'binding:host_id': 'other_cluster_node'}]}
+        kubernetes.get.side_effect = [
+            {'items': [{'metadata': {'uid': 'pod1'}}]},
+            {'items': [{'metadata': {'name': 'node1'}}]}]
+        neutron.delete_port.side_effect = [n_exc.PortNotFoundClient, None]
+
+        cls._delete_orphaned_ports(m_driver)
+
+        neutron.list_ports.assert_called_once_with(
+            device_owner=kl_const.DEVICE_OWNER, project_id='project1',
+            fields=['id', 'device_id', 'binding:host_id'])
+        kubernetes.get.assert_has_calls([mock.call('/api/v1/pods'),
+                                         mock.call('/api/v1/nodes')])
+        neutron.delete_port.assert_has_calls([mock.call('port2'),
+                                              mock.call('port4')])
+        self.assertEqual(2, neutron.delete_port.call_count)
+
+    def test__delete_orphaned_ports_no_project(self):
+        cls = vif_pool.NoopVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        self._set_default_project(None)
+
+        cls._delete_orphaned_ports(m_driver)
+
+        neutron.list_ports.assert_not_called()
+        neutron.delete_port.assert_not_called()
+
+    def test__delete_orphaned_ports_k8s_exception(self):
+        cls = vif_pool.NoopVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        kubernetes = self.useFixture(k_fix.MockK8sClient()).client
+        self._set_default_project('project1')
+
+        neutron.list_ports.return_value = {'ports': [
+            {'id': 'port1', 'device_id': 'pod1', 'binding:host_id': 'node1'}]}
+        kubernetes.get.side_effect = exceptions.K8sClientException
+
+        cls._delete_orphaned_ports(m_driver)
+
+        neutron.delete_port.assert_not_called()
+
+
 @ddt.ddt
 class NeutronVIFPool(test_base.TestCase):
 
@@ -155,6 +326,20 @@ class NeutronVIFPool(test_base.TestCase):
         self.assertRaises(KeyError, cls.request_vif, m_driver, pod, project_id,
                           subnets, security_groups)
 
+    def test_populate_pool(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+
+        pod = get_pod_obj()
+        project_id = mock.sentinel.project_id
+        subnets = mock.sentinel.subnets
+        security_groups = ['sg2', 'sg1']
+        pool_key = (pod['status']['hostIP'], project_id, ('sg1', 'sg2'))
+
+        cls.populate_pool(m_driver, pod, project_id, subnets, security_groups)
+        m_driver._populate_pool.assert_called_once_with(pool_key, pod,
+                                                        subnets)
+
     @mock.patch('time.time', return_value=50)
     def test__populate_pool(self, m_time):
         cls = vif_pool.NeutronVIFPool
@@ -176,6 +361,7 @@ class NeutronVIFPool(test_base.TestCase):
         m_driver._existing_vifs = {}
         m_driver._available_ports_pools = {}
         m_driver._last_update = {pool_key: 1}
+        m_driver._populate_semaphore = mock.MagicMock()
 
         oslo_cfg.CONF.set_override('ports_pool_min',
                                    5,
@@ -190,6 +376,28 @@ class NeutronVIFPool(test_base.TestCase):
         m_driver._get_pool_size.assert_called_once()
         m_driver._drv_vif.request_vifs.assert_called_once()
 
+    @mock.patch('kuryr_kubernetes.controller.drivers.default_subnet.'
+                'invalidate_subnet')
+    @mock.patch('time.time', return_value=50)
+    def test__populate_pool_subnet_not_found(self, m_time, m_invalidate):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._drv_vif = mock.MagicMock(
+            spec=neutron_vif.NeutronPodVIFDriver)
+
+        pool_key = (mock.sentinel.host_addr, mock.sentinel.project_id,
+                    (mock.sentinel.security_groups,))
+        subnets = {'subnet1': mock.sentinel.network}
+
+        m_driver._last_update = {}
+        m_driver._populate_semaphore = mock.MagicMock()
+        m_driver._get_pool_size.return_value = 0
+        m_driver._drv_vif.request_vifs.side_effect = n_exc.NotFound
+
+        self.assertRaises(n_exc.NotFound, cls._populate_pool, m_driver,
+                          pool_key, mock.sentinel.pod, subnets)
+        m_invalidate.assert_called_once_with('subnet1')
+
     @mock.patch('time.time', return_value=0)
     def test__populate_pool_no_update(self, m_time):
         cls = vif_pool.NeutronVIFPool
@@ -255,6 +463,7 @@ class NeutronVIFPool(test_base.TestCase):
         m_driver._available_ports_pools = {
             pool_key: collections.deque([port_id])}
         m_driver._existing_vifs = {port_id: port}
+        m_driver._pending_ports_attrs = {}
 
         oslo_cfg.CONF.set_override('ports_pool_min',
                                    5,
@@ -265,14 +474,10 @@ class NeutronVIFPool(test_base.TestCase):
         self.assertEqual(port, cls._get_port_from_pool(
             m_driver, pool_key, pod, subnets))
 
-        neutron.update_port.assert_called_once_with(
-            port_id,
-            {
-                "port": {
-                    'name': pod['metadata']['name'],
-                    'device_id': pod['metadata']['uid']
-                }
-            })
+        self.assertEqual({port_id: m_driver._get_pod_port_attrs.return_value},
+                         m_driver._pending_ports_attrs)
+        m_driver._get_pod_port_attrs.assert_called_once_with(pod)
+        neutron.update_port.assert_not_called()
         m_eventlet.assert_not_called()
 
     @mock.patch('eventlet.spawn')
@@ -291,6 +496,7 @@ class NeutronVIFPool(test_base.TestCase):
         m_driver._available_ports_pools = {
             pool_key: collections.deque([port_id])}
         m_driver._existing_vifs = {port_id: port}
+        m_driver._pending_ports_attrs = {}
 
         oslo_cfg.CONF.set_override('ports_pool_min',
                                    5,
@@ -301,14 +507,10 @@ class NeutronVIFPool(test_base.TestCase):
         self.assertEqual(port, cls._get_port_from_pool(
             m_driver, pool_key, pod, subnets))
 
-        neutron.update_port.assert_called_once_with(
-            port_id,
-            {
-                "port": {
-                    'name': pod['metadata']['name'],
-                    'device_id': pod['metadata']['uid']
-                }
-            })
+        self.assertEqual({port_id: m_driver._get_pod_port_attrs.return_value},
+                         m_driver._pending_ports_attrs)
+        m_driver._get_pod_port_attrs.assert_called_once_with(pod)
+        neutron.update_port.assert_not_called()
         m_eventlet.assert_called_once()
 
     def test__get_port_from_pool_empty_pool(self):
@@ -327,6 +529,41 @@ class NeutronVIFPool(test_base.TestCase):
 
         neutron.update_port.assert_not_called()
 
+    @mock.patch('eventlet.sleep', side_effect=[None, SystemExit])
+    def test_release_vif_pending_pod_attrs(self, m_sleep):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        for method in ('_update_pending_ports_attrs', '_update_port_attrs',
+                       '_recycle_port', '_get_available_port_attrs',
+                       '_get_pod_port_attrs', '_get_pool_size'):
+            getattr(m_driver, method).side_effect = functools.partial(
+                getattr(cls, method), m_driver)
+        oslo_cfg.CONF.set_override('ports_pool_min', 0, group='vif_pool')
+        self.addCleanup(oslo_cfg.CONF.clear_override, 'ports_pool_min',
+                        group='vif_pool')
+
+        pod = get_pod_obj()
+        pool_key = (pod['status']['hostIP'], 'project_id', ('sg1',))
+        vif = osv_vif.VIFOpenVSwitch(id='0fa0e837-d34e-4580-a6c4-04f5f607d93e')
+        m_driver._existing_vifs = {vif.id: vif}
+        m_driver._available_ports_pools = {pool_key: [vif.id]}
+        m_driver._ports_attrs = {vif.id: {'name': 'available-port',
+                                          'device_id': '',
+                                          'security_groups': ['sg1']}}
+        m_driver._pending_ports_attrs = {}
+        m_driver._recyclable_ports = {}
+        m_driver._released_hosts = set()
+
+        cls._get_port_from_pool(m_driver, pool_key, pod, mock.sentinel.subnets)
+        cls.release_vif(m_driver, pod, vif, 'project_id', ['sg1'])
+        self.assertRaises(SystemExit, cls._return_ports_to_pool, m_driver)
+
+        neutron.update_port.assert_not_called()
+        self.assertEqual({pool_key: [vif.id]},
+                         m_driver._available_ports_pools)
+        self.assertEqual({}, m_driver._pending_ports_attrs)
+
     def test_release_vif(self):
         cls = vif_pool.NeutronVIFPool
         m_driver = mock.MagicMock(spec=cls)
@@ -363,15 +600,9 @@ class NeutronVIFPool(test_base.TestCase):
 
         self.assertRaises(SystemExit, cls._return_ports_to_pool, m_driver)
 
-        neutron.update_port.assert_called_once_with(
-            port_id,
-            {
-                "port": {
-                    'name': 'available-port',
-                    'device_id': '',
-                    'security_groups': ['security_group']
-                }
-            })
+        m_driver._update_pending_ports_attrs.assert_called_once_with(neutron)
+        m_driver._recycle_port.assert_called_once_with(neutron, port_id,
+                                                       pool_key)
         neutron.delete_port.assert_not_called()
 
     @mock.patch('eventlet.sleep', side_effect=SystemExit)
@@ -414,19 +645,13 @@ class NeutronVIFPool(test_base.TestCase):
                                    0,
                                    group='vif_pool')
         m_driver._get_pool_size.return_value = pool_length
-        neutron.update_port.side_effect = n_exc.NeutronClientException
+        m_driver._recycle_port.side_effect = n_exc.NeutronClientException
 
         self.assertRaises(SystemExit, cls._return_ports_to_pool, m_driver)
 
-        neutron.update_port.assert_called_once_with(
-            port_id,
-            {
-                "port": {
-                    'name': 'available-port',
-                    'device_id': '',
-                    'security_groups': ['security_group']
-                }
-            })
+        m_driver._update_pending_ports_attrs.assert_called_once_with(neutron)
+        m_driver._recycle_port.assert_called_once_with(neutron, port_id,
+                                                       pool_key)
         neutron.delete_port.assert_not_called()
 
     @mock.patch('eventlet.sleep', side_effect=SystemExit)
@@ -477,29 +702,448 @@ class NeutronVIFPool(test_base.TestCase):
         neutron.update_port.assert_not_called()
         neutron.delete_port.assert_not_called()
 
-    def test__cleanup_precreated_ports(self):
+    @mock.patch('kuryr_kubernetes.os_vif_util.neutron_to_osvif_vif')
+    @mock.patch('kuryr_kubernetes.controller.drivers.default_subnet.'
+                '_get_subnet')
+    def test__recover_precreated_ports(self, m_get_subnet, m_to_osvif):
         cls = vif_pool.NeutronVIFPool
         m_driver = mock.MagicMock(spec=cls)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        port_id = mock.sentinel.port_id
-        port = {'id': port_id}
-        filtered_ports = [port]
-        m_driver._get_ports_by_attrs.return_value = filtered_ports
+        port = get_port_obj(port_id='port1')
+        port2 = get_port_obj(port_id='port2')
+        port_unknown_host = get_port_obj(port_id='port3')
+        port_unknown_host['binding:host_id'] = 'removed-node'
+        port_unbound = get_port_obj(port_id='port4')
+        port_unbound['binding:vif_type'] = 'binding_failed'
+        port_in_use = get_port_obj(port_id='port5')
+        pod = get_pod_obj()
+        m_driver._get_ports_by_attrs.return_value = [
+            port, port2, port_unknown_host, port_unbound, port_in_use]
+        m_driver._get_in_use_ports.return_value = {'port5': pod}
+        m_driver._get_nodes_ips.return_value = {
+            'kuryr-devstack': '192.168.1.2'}
+        m_driver._existing_vifs = {}
+        m_driver._ports_attrs = {}
+        m_driver._available_ports_pools = {}
+        subnet_id = port['fixed_ips'][0]['subnet_id']
+        subnet = mock.sentinel.subnet
+        m_get_subnet.return_value = subnet
+        vif = mock.sentinel.vif
+        m_to_osvif.return_value = vif
+
+        cls._recover_precreated_ports(m_driver)
+
+        pool_key = ('192.168.1.2', port['project_id'],
+                    tuple(port['security_groups']))
+        m_get_subnet.assert_called_once_with(subnet_id)
+        m_to_osvif.assert_called_with('ovs', port2, {subnet_id: subnet})
+        self.assertEqual({pool_key: ['port1', 'port2']},
+                         m_driver._available_ports_pools)
+        self.assertEqual({'port1': vif, 'port2': vif},
+                         m_driver._existing_vifs)
+        self.assertEqual({'name': 'available-port',
+                          'device_id': '',
+                          'security_groups': port['security_groups']},
+                         m_driver._ports_attrs['port1'])
+        neutron.delete_port.assert_has_calls([mock.call('port3'),
+                                              mock.call('port4')])
+        self.assertEqual(2, neutron.delete_port.call_count)
+        m_driver._reclaim_in_use_port.assert_called_once_with(port_in_use,
+                                                              pod)
+
+    def test__recover_precreated_ports_no_ports(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        m_driver._get_ports_by_attrs.return_value = []
 
-        cls._cleanup_precreated_ports(m_driver)
-        neutron.delete_port.assert_called_with(port_id)
+        cls._recover_precreated_ports(m_driver)
 
-    def test__cleanup_precreated_ports_empty(self):
+        m_driver._get_in_use_ports.assert_not_called()
+        m_driver._get_nodes_ips.assert_not_called()
+        neutron.delete_port.assert_not_called()
+
+    def test__recover_precreated_ports_k8s_exception(self):
         cls = vif_pool.NeutronVIFPool
         m_driver = mock.MagicMock(spec=cls)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        filtered_ports = []
-        m_driver._get_ports_by_attrs.return_value = filtered_ports
+        m_driver._get_ports_by_attrs.return_value = [get_port_obj()]
+        m_driver._get_in_use_ports.side_effect = (
+            exceptions.K8sClientException)
+        m_driver._available_ports_pools = {}
+
+        cls._recover_precreated_ports(m_driver)
 
-        cls._cleanup_precreated_ports(m_driver)
         neutron.delete_port.assert_not_called()
+        self.assertEqual({}, m_driver._available_ports_pools)
+
+    def test__get_nodes_ips(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        kubernetes = self.useFixture(k_fix.MockK8sClient()).client
+
+        kubernetes.get.return_value = {'items': [
+            {'metadata': {'name': 'node-1'},
+             'status': {'addresses': [{'type': 'InternalIP',
+                                       'address': '192.168.0.10'}]}},
+            {'metadata': {'name': 'node-2'},
+             'status': {'addresses': [{'type': 'InternalIP',
+                                       'address': '192.168.0.11'}]}}]}
+
+        self.assertEqual({'node-1': '192.168.0.10', 'node-2': '192.168.0.11'},
+                         cls._get_nodes_ips(m_driver))
+        kubernetes.get.assert_called_once_with('/api/v1/nodes')
+
+    def test__get_in_use_ports(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        kubernetes = self.useFixture(k_fix.MockK8sClient()).client
+
+        full = {'versioned_object.data': {'id': 'port1'}}
+        compact = {'format': 1, 'network': 'digest', 'ips': [],
+                   'vif': {'versioned_object.data': {'id': 'port2'}}}
+        pod1 = {'metadata': {'annotations': {
+            constants.K8S_ANNOTATION_VIF: jsonutils.dumps(full)}}}
+        pod2 = {'metadata': {'annotations': {
+            constants.K8S_ANNOTATION_VIF: jsonutils.dumps(compact)}}}
+        pod3 = {'metadata': {}}
+        kubernetes.get.return_value = {'items': [pod1, pod2, pod3]}
+
+        self.assertEqual({'port1': pod1, 'port2': pod2},
+                         cls._get_in_use_ports(m_driver))
+        kubernetes.get.assert_called_once_with('/api/v1/pods')
+
+    def test__reclaim_in_use_port(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._get_pod_port_attrs.side_effect = functools.partial(
+            cls._get_pod_port_attrs, m_driver)
+        m_driver._ports_attrs = {}
+        m_driver._pending_ports_attrs = {}
+        m_driver._available_ports_pools = {}
+
+        port = get_port_obj(port_id='port1')
+        pod = get_pod_obj()
+
+        cls._reclaim_in_use_port(m_driver, port, pod)
+
+        self.assertEqual({'port1': {'name': 'available-port',
+                                    'device_id': ''}},
+                         m_driver._ports_attrs)
+        self.assertEqual({'port1': {'name': pod['metadata']['name'],
+                                    'device_id': pod['metadata']['uid']}},
+                         m_driver._pending_ports_attrs)
+        self.assertEqual({}, m_driver._available_ports_pools)
+
+    def test__update_port_attrs(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        port_id = mock.sentinel.port_id
+        m_driver._ports_attrs = {port_id: {'name': 'available-port',
+                                           'device_id': '',
+                                           'security_groups': ['sg1']}}
+
+        self.assertTrue(cls._update_port_attrs(
+            m_driver, neutron, port_id, {'name': 'pod', 'device_id': 'uid',
+                                         'security_groups': ['sg1']}))
+
+        neutron.update_port.assert_called_once_with(
+            port_id, {'port': {'name': 'pod', 'device_id': 'uid'}})
+        self.assertEqual({'name': 'pod', 'device_id': 'uid',
+                          'security_groups': ['sg1']},
+                         m_driver._ports_attrs[port_id])
+
+    def test__update_port_attrs_unchanged(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        port_id = mock.sentinel.port_id
+        attrs = {'name': 'available-port', 'device_id': ''}
+        m_driver._ports_attrs = {port_id: dict(attrs)}
+
+        self.assertFalse(cls._update_port_attrs(m_driver, neutron, port_id,
+                                                attrs))
+
+        neutron.update_port.assert_not_called()
+
+    def test__update_port_attrs_unknown_port(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        port_id = mock.sentinel.port_id
+        attrs = {'name': 'available-port', 'device_id': ''}
+        m_driver._ports_attrs = {}
+
+        self.assertTrue(cls._update_port_attrs(m_driver, neutron, port_id,
+                                               attrs))
+
+        neutron.update_port.assert_called_once_with(port_id,
+                                                    {'port': attrs})
+        self.assertEqual(attrs, m_driver._ports_attrs[port_id])
+
+    def test__recycle_port(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        m_driver._update_port_attrs.side_effect = functools.partial(
+            cls._update_port_attrs, m_driver)
+
+        pool_key = ('node_ip', 'project_id', tuple(['security_group']))
+        port_id = mock.sentinel.port_id
+        attrs = {'name': 'available-port', 'device_id': '',
+                 'security_groups': ['security_group']}
+
+        m_driver._ports_attrs = {port_id: {'name': 'pod',
+                                           'device_id': 'uid',
+                                           'security_groups': [
+                                               'security_group']}}
+        m_driver._pending_ports_attrs = {}
+        m_driver._available_ports_pools = {}
+        m_driver._get_available_port_attrs.return_value = attrs
+
+        self.assertTrue(cls._recycle_port(m_driver, neutron, port_id,
+                                          pool_key))
+
+        # The port is renamed before being available, so that it is
+        # recovered if the controller restarts right after
+        neutron.update_port.assert_called_once_with(
+            port_id, {'port': {'name': 'available-port', 'device_id': ''}})
+        self.assertEqual({}, m_driver._pending_ports_attrs)
+        self.assertEqual({pool_key: [port_id]},
+                         m_driver._available_ports_pools)
+
+    def test__recycle_port_not_renamed(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        m_driver._update_port_attrs.side_effect = functools.partial(
+            cls._update_port_attrs, m_driver)
+
+        pool_key = ('node_ip', 'project_id', tuple(['security_group']))
+        port_id = mock.sentinel.port_id
+        attrs = {'name': 'available-port', 'device_id': '',
+                 'security_groups': ['security_group']}
+
+        m_driver._ports_attrs = {port_id: dict(attrs)}
+        m_driver._available_ports_pools = {}
+        m_driver._get_available_port_attrs.return_value = attrs
+
+        self.assertFalse(cls._recycle_port(m_driver, neutron, port_id,
+                                           pool_key))
+
+        neutron.update_port.assert_not_called()
+        self.assertEqual({pool_key: [port_id]},
+                         m_driver._available_ports_pools)
+
+    def test__recycle_port_security_groups_changed(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        pool_key = ('node_ip', 'project_id', tuple(['security_group']))
+        port_id = mock.sentinel.port_id
+        attrs = {'name': 'available-port', 'device_id': '',
+                 'security_groups': ['security_group']}
+
+        m_driver._ports_attrs = {port_id: {'name': 'pod',
+                                           'device_id': 'uid',
+                                           'security_groups': ['other_sg']}}
+        m_driver._pending_ports_attrs = {}
+        m_driver._available_ports_pools = {}
+        m_driver._get_available_port_attrs.return_value = attrs
+        m_driver._update_port_attrs.return_value = True
+
+        self.assertTrue(cls._recycle_port(m_driver, neutron, port_id,
+                                          pool_key))
+
+        m_driver._update_port_attrs.assert_called_once_with(neutron,
+                                                            port_id, attrs)
+        self.assertEqual({}, m_driver._pending_ports_attrs)
+        self.assertEqual({pool_key: [port_id]},
+                         m_driver._available_ports_pools)
+
+    def test__recycle_port_exception(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        pool_key = ('node_ip', 'project_id', tuple(['security_group']))
+        port_id = mock.sentinel.port_id
+
+        m_driver._ports_attrs = {}
+        m_driver._available_ports_pools = {}
+        m_driver._get_available_port_attrs.return_value = {
+            'security_groups': ['security_group']}
+        m_driver._update_port_attrs.side_effect = (
+            n_exc.NeutronClientException)
+
+        self.assertRaises(n_exc.NeutronClientException, cls._recycle_port,
+                          m_driver, neutron, port_id, pool_key)
+        self.assertEqual({}, m_driver._available_ports_pools)
+
+    def test__update_pending_ports_attrs(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        port_id = mock.sentinel.port_id
+        attrs = {'name': 'available-port', 'device_id': ''}
+        m_driver._pending_ports_attrs = {port_id: attrs}
+
+        cls._update_pending_ports_attrs(m_driver, neutron)
+
+        m_driver._update_port_attrs.assert_called_once_with(neutron, port_id,
+                                                            attrs)
+        self.assertEqual({}, m_driver._pending_ports_attrs)
+
+    def test__update_pending_ports_attrs_superseded(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        port_id = mock.sentinel.port_id
+        attrs = {'name': 'available-port', 'device_id': ''}
+        new_attrs = {'name': 'pod', 'device_id': 'uid'}
+        m_driver._pending_ports_attrs = {port_id: attrs}
+
+        def _update_port_attrs(neutron, port_id, attrs):
+            m_driver._pending_ports_attrs[port_id] = new_attrs
+        m_driver._update_port_attrs.side_effect = _update_port_attrs
+
+        cls._update_pending_ports_attrs(m_driver, neutron)
+
+        self.assertEqual({port_id: new_attrs}, m_driver._pending_ports_attrs)
+
+    def test__update_pending_ports_attrs_exception(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        port_id = mock.sentinel.port_id
+        attrs = {'name': 'available-port', 'device_id': ''}
+        m_driver._pending_ports_attrs = {port_id: attrs}
+        m_driver._update_port_attrs.side_effect = (
+            n_exc.NeutronClientException)
+
+        cls._update_pending_ports_attrs(m_driver, neutron)
+
+        self.assertEqual({port_id: attrs}, m_driver._pending_ports_attrs)
+
+    def test__update_pending_ports_attrs_port_not_found(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        port_id = mock.sentinel.port_id
+        attrs = {'name': 'available-port', 'device_id': ''}
+        m_driver._pending_ports_attrs = {port_id: attrs}
+        m_driver._ports_attrs = {port_id: attrs}
+        m_driver._update_port_attrs.side_effect = n_exc.PortNotFoundClient
+
+        cls._update_pending_ports_attrs(m_driver, neutron)
+
+        self.assertEqual({}, m_driver._pending_ports_attrs)
+        self.assertEqual({}, m_driver._ports_attrs)
+
+    def test__get_available_port_attrs(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+
+        pool_key = ('node_ip', 'project_id', ('sg1', 'sg2'))
+
+        self.assertEqual({'name': 'available-port',
+                          'device_id': '',
+                          'security_groups': ['sg1', 'sg2']},
+                         cls._get_available_port_attrs(m_driver, pool_key))
+
+    def test__get_pod_port_attrs(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+
+        pod = get_pod_obj()
+
+        self.assertEqual({'name': pod['metadata']['name'],
+                          'device_id': pod['metadata']['uid']},
+                         cls._get_pod_port_attrs(m_driver, pod))
+
+    def test_resume_pools(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+
+        m_driver._released_hosts = {'192.168.1.2', '192.168.1.3'}
+
+        cls.resume_pools(m_driver, '192.168.1.2')
+        self.assertEqual({'192.168.1.3'}, m_driver._released_hosts)
+
+    def test_release_pools(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        pool_key = ('node_ip', 'project_id', ('sg1',))
+        pool_key_2 = ('node_ip', 'project_id', ('sg2',))
+        other_pool_key = ('other_node_ip', 'project_id', ('sg1',))
+        m_driver._released_hosts = set()
+        m_driver._available_ports_pools = {pool_key: ['port1', 'port2'],
+                                           pool_key_2: [],
+                                           other_pool_key: ['port3']}
+        m_driver._last_update = {pool_key: 1, other_pool_key: 1}
+
+        cls.release_pools(m_driver, 'node_ip')
+
+        self.assertEqual({'node_ip'}, m_driver._released_hosts)
+        self.assertEqual({other_pool_key: ['port3']},
+                         m_driver._available_ports_pools)
+        self.assertEqual({other_pool_key: 1}, m_driver._last_update)
+        m_driver._delete_pool_ports.assert_called_once_with(
+            neutron, pool_key, ['port1', 'port2'])
+
+    def test__delete_pool_ports(self):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        pool_key = ('node_ip', 'project_id', ('sg1',))
+        m_driver._existing_vifs = {'port1': mock.sentinel.vif1,
+                                   'port2': mock.sentinel.vif2}
+        neutron.delete_port.side_effect = [None, n_exc.PortNotFoundClient]
+
+        cls._delete_pool_ports(m_driver, neutron, pool_key,
+                               ['port1', 'port2'])
+
+        self.assertEqual({}, m_driver._existing_vifs)
+        neutron.delete_port.assert_has_calls([mock.call('port1'),
+                                              mock.call('port2')])
+        m_driver._forget_port.assert_has_calls([mock.call('port1'),
+                                                mock.call('port2')])
+
+    @mock.patch('eventlet.sleep', side_effect=SystemExit)
+    def test__return_ports_to_pool_released_host(self, m_sleep):
+        cls = vif_pool.NeutronVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+
+        pool_key = ('node_ip', 'project_id', tuple(['security_group']))
+        port_id = mock.sentinel.port_id
+
+        m_driver._recyclable_ports = {port_id: pool_key}
+        m_driver._existing_vifs = {port_id: mock.sentinel.vif}
+        m_driver._released_hosts = {'node_ip'}
+        oslo_cfg.CONF.set_override('ports_pool_max',
+                                   0,
+                                   group='vif_pool')
+
+        self.assertRaises(SystemExit, cls._return_ports_to_pool, m_driver)
+
+        m_driver._recycle_port.assert_not_called()
+        neutron.delete_port.assert_called_once_with(port_id)
 
 
 @ddt.ddt
@@ -601,6 +1245,7 @@ class NestedVIFPool(test_base.TestCase):
         m_driver._existing_vifs = {}
         m_driver._available_ports_pools = {}
         m_driver._last_update = {pool_key: 1}
+        m_driver._populate_semaphore = mock.MagicMock()
 
         oslo_cfg.CONF.set_override('ports_pool_update_frequency',
                                    15,
@@ -680,6 +1325,7 @@ class NestedVIFPool(test_base.TestCase):
         m_driver._available_ports_pools = {
             pool_key: collections.deque([port_id])}
         m_driver._existing_vifs = {port_id: port}
+        m_driver._pending_ports_attrs = {}
 
         oslo_cfg.CONF.set_override('ports_pool_min',
                                    5,
@@ -690,13 +1336,10 @@ class NestedVIFPool(test_base.TestCase):
         self.assertEqual(port, cls._get_port_from_pool(
             m_driver, pool_key, pod, subnets))
 
-        neutron.update_port.assert_called_once_with(
-            port_id,
-            {
-                "port": {
-                    'name': pod['metadata']['name'],
-                }
-            })
+        self.assertEqual({port_id: m_driver._get_pod_port_attrs.return_value},
+                         m_driver._pending_ports_attrs)
+        m_driver._get_pod_port_attrs.assert_called_once_with(pod)
+        neutron.update_port.assert_not_called()
         m_eventlet.assert_not_called()
 
     @mock.patch('eventlet.spawn')
@@ -715,6 +1358,7 @@ class NestedVIFPool(test_base.TestCase):
         m_driver._available_ports_pools = {
             pool_key: collections.deque([port_id])}
         m_driver._existing_vifs = {port_id: port}
+        m_driver._pending_ports_attrs = {}
 
         oslo_cfg.CONF.set_override('ports_pool_min',
                                    5,
@@ -725,13 +1369,10 @@ class NestedVIFPool(test_base.TestCase):
         self.assertEqual(port, cls._get_port_from_pool(
             m_driver, pool_key, pod, subnets))
 
-        neutron.update_port.assert_called_once_with(
-            port_id,
-            {
-                "port": {
-                    'name': pod['metadata']['name'],
-                }
-            })
+        self.assertEqual({port_id: m_driver._get_pod_port_attrs.return_value},
+                         m_driver._pending_ports_attrs)
+        m_driver._get_pod_port_attrs.assert_called_once_with(pod)
+        neutron.update_port.assert_not_called()
         m_eventlet.assert_called_once()
 
     def test__get_port_from_pool_empty_pool(self):
@@ -786,14 +1427,9 @@ class NestedVIFPool(test_base.TestCase):
 
         self.assertRaises(SystemExit, cls._return_ports_to_pool, m_driver)
 
-        neutron.update_port.assert_called_once_with(
-            port_id,
-            {
-                "port": {
-                    'name': 'available-port',
-                    'security_groups': ['security_group']
-                }
-            })
+        m_driver._update_pending_ports_attrs.assert_called_once_with(neutron)
+        m_driver._recycle_port.assert_called_once_with(neutron, port_id,
+                                                       pool_key)
         neutron.delete_port.assert_not_called()
 
     @mock.patch('eventlet.sleep', side_effect=SystemExit)
@@ -810,8 +1446,6 @@ class NestedVIFPool(test_base.TestCase):
         pool_length = 10
         vif = mock.MagicMock()
         vif.vlan_id = mock.sentinel.vlan_id
-        p_port = mock.sentinel.p_port
-        trunk_id = mock.sentinel.trunk_id
 
         m_driver._recyclable_ports = {port_id: pool_key}
         m_driver._available_ports_pools = {}
@@ -820,19 +1454,14 @@ class NestedVIFPool(test_base.TestCase):
                                    10,
                                    group='vif_pool')
         m_driver._get_pool_size.return_value = pool_length
-        m_driver._known_trunk_ids = {}
-        m_driver._drv_vif._get_parent_port_by_host_ip.return_value = p_port
-        m_driver._drv_vif._get_trunk_id.return_value = trunk_id
 
         self.assertRaises(SystemExit, cls._return_ports_to_pool, m_driver)
 
         neutron.update_port.assert_not_called()
         neutron.delete_port.assert_called_once_with(port_id)
-        m_driver._drv_vif._get_parent_port_by_host_ip.assert_called_once()
-        m_driver._drv_vif._get_trunk_id.assert_called_once_with(p_port)
-        m_driver._drv_vif._remove_subport.assert_called_once_with(neutron,
-                                                                  trunk_id,
-                                                                  port_id)
+        m_driver._drv_vif._detach_vifs.assert_called_once_with(
+            neutron, 'node_ip', [vif])
+        self.assertEqual({}, m_driver._existing_vifs)
 
     @mock.patch('eventlet.sleep', side_effect=SystemExit)
     def test__return_ports_to_pool_update_exception(self, m_sleep):
@@ -850,18 +1479,13 @@ class NestedVIFPool(test_base.TestCase):
                                    0,
                                    group='vif_pool')
         m_driver._get_pool_size.return_value = pool_length
-        neutron.update_port.side_effect = n_exc.NeutronClientException
+        m_driver._recycle_port.side_effect = n_exc.NeutronClientException
 
         self.assertRaises(SystemExit, cls._return_ports_to_pool, m_driver)
 
-        neutron.update_port.assert_called_once_with(
-            port_id,
-            {
-                "port": {
-                    'name': 'available-port',
-                    'security_groups': ['security_group']
-                }
-            })
+        m_driver._update_pending_ports_attrs.assert_called_once_with(neutron)
+        m_driver._recycle_port.assert_called_once_with(neutron, port_id,
+                                                       pool_key)
         neutron.delete_port.assert_not_called()
 
     @mock.patch('eventlet.sleep', side_effect=SystemExit)
@@ -878,8 +1502,6 @@ class NestedVIFPool(test_base.TestCase):
         pool_length = 10
         vif = mock.MagicMock()
         vif.vlan_id = mock.sentinel.vlan_id
-        p_port = mock.sentinel.p_port
-        trunk_id = mock.sentinel.trunk_id
 
         m_driver._recyclable_ports = {port_id: pool_key}
         m_driver._available_ports_pools = {}
@@ -889,19 +1511,14 @@ class NestedVIFPool(test_base.TestCase):
                                    group='vif_pool')
         m_driver._get_pool_size.return_value = pool_length
         neutron.delete_port.side_effect = n_exc.PortNotFoundClient
-        m_driver._known_trunk_ids = {}
-        m_driver._drv_vif._get_parent_port_by_host_ip.return_value = p_port
-        m_driver._drv_vif._get_trunk_id.return_value = trunk_id
 
         self.assertRaises(SystemExit, cls._return_ports_to_pool, m_driver)
 
         neutron.update_port.assert_not_called()
-        m_driver._drv_vif._get_parent_port_by_host_ip.assert_called_once()
-        m_driver._drv_vif._get_trunk_id.assert_called_once_with(p_port)
-        m_driver._drv_vif._remove_subport.assert_called_once_with(neutron,
-                                                                  trunk_id,
-                                                                  port_id)
+        m_driver._drv_vif._detach_vifs.assert_called_once_with(
+            neutron, 'node_ip', [vif])
         neutron.delete_port.assert_called_once_with(port_id)
+        self.assertEqual({}, m_driver._recyclable_ports)
 
     @mock.patch('eventlet.sleep', side_effect=SystemExit)
     def test__return_ports_to_pool_delete_key_error(self, m_sleep):
@@ -915,8 +1532,6 @@ class NestedVIFPool(test_base.TestCase):
         pool_key = ('node_ip', 'project_id', tuple(['security_group']))
         port_id = mock.sentinel.port_id
         pool_length = 10
-        p_port = mock.sentinel.p_port
-        trunk_id = mock.sentinel.trunk_id
 
         m_driver._recyclable_ports = {port_id: pool_key}
         m_driver._available_ports_pools = {}
@@ -925,61 +1540,88 @@ class NestedVIFPool(test_base.TestCase):
                                    5,
                                    group='vif_pool')
         m_driver._get_pool_size.return_value = pool_length
-        m_driver._known_trunk_ids = {}
-        m_driver._drv_vif._get_parent_port_by_host_ip.return_value = p_port
-        m_driver._drv_vif._get_trunk_id.return_value = trunk_id
 
         self.assertRaises(SystemExit, cls._return_ports_to_pool, m_driver)
 
         neutron.update_port.assert_not_called()
-        m_driver._drv_vif._get_parent_port_by_host_ip.assert_called_once()
-        m_driver._drv_vif._get_trunk_id.assert_called_once_with(p_port)
-        m_driver._drv_vif._remove_subport.assert_called_once_with(neutron,
-                                                                  trunk_id,
-                                                                  port_id)
+        m_driver._drv_vif._detach_vifs.assert_not_called()
         neutron.delete_port.assert_not_called()
 
-    def test__get_parent_port_ip(self):
+    @mock.patch('eventlet.sleep', side_effect=SystemExit)
+    def test__return_ports_to_pool_detach_exception(self, m_sleep):
         cls = vif_pool.NestedVIFPool
         m_driver = mock.MagicMock(spec=cls)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
+        vif_driver = mock.MagicMock(spec=cls_vif_driver)
+        m_driver._drv_vif = vif_driver
 
+        pool_key = ('node_ip', 'project_id', tuple(['security_group']))
         port_id = mock.sentinel.port_id
-        ip_address = mock.sentinel.ip_address
+        vif = mock.sentinel.vif
 
-        port_obj = get_port_obj(ip_address=ip_address)
-        neutron.show_port.return_value = {'port': port_obj}
+        m_driver._recyclable_ports = {port_id: pool_key}
+        m_driver._available_ports_pools = {}
+        m_driver._existing_vifs = {port_id: vif}
+        oslo_cfg.CONF.set_override('ports_pool_max',
+                                   5,
+                                   group='vif_pool')
+        m_driver._get_pool_size.return_value = 10
+        vif_driver._detach_vifs.side_effect = (
+            exceptions.K8sNodeTrunkPortFailure)
 
-        self.assertEqual(ip_address, cls._get_parent_port_ip(m_driver,
-                                                             port_id))
+        self.assertRaises(SystemExit, cls._return_ports_to_pool, m_driver)
 
-    @mock.patch('kuryr_kubernetes.os_vif_util.'
-                'neutron_to_osvif_vif_nested_vlan')
-    @mock.patch('kuryr_kubernetes.controller.drivers.default_subnet.'
-                '_get_subnet')
-    def test__precreated_ports_recover(self, m_get_subnet, m_to_osvif):
+        neutron.delete_port.assert_not_called()
+        self.assertEqual({port_id: pool_key}, m_driver._recyclable_ports)
+        self.assertEqual({port_id: vif}, m_driver._existing_vifs)
+
+    def test_release_pools(self):
         cls = vif_pool.NestedVIFPool
         m_driver = mock.MagicMock(spec=cls)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        port_id = mock.sentinel.port_id
-        host_addr = mock.sentinel.host_addr
+        pool_key = ('node_ip', 'project_id', ('sg1',))
+        other_pool_key = ('other_node_ip', 'project_id', ('sg1',))
+        m_driver._released_hosts = set()
+        m_driver._available_ports_pools = {pool_key: ['port1'],
+                                           other_pool_key: ['port2']}
+        m_driver._last_update = {}
+        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
+        m_driver._drv_vif = mock.MagicMock(spec=cls_vif_driver)
 
-        m_driver._get_ports_by_attrs.side_effect = [[get_port_obj(
-            port_id=port_id, device_owner='trunk:subport')], []]
-        trunk_id = mock.sentinel.trunk_id
-        trunk_obj = self._get_trunk_obj(port_id=trunk_id, subport_id=port_id)
-        neutron.list_trunks.return_value = {'trunks': [trunk_obj]}
-        m_driver._get_parent_port_ip.return_value = host_addr
+        cls.release_pools(m_driver, 'node_ip')
 
-        m_get_subnet.return_value = mock.sentinel.subnet
-        m_to_osvif.return_value = mock.sentinel.vif
+        self.assertEqual({'node_ip'}, m_driver._released_hosts)
+        m_driver._drv_vif._invalidate_parent_port.assert_called_once_with(
+            'node_ip')
+        m_driver._delete_pool_ports.assert_called_once_with(
+            neutron, pool_key, ['port1'])
 
-        cls._precreated_ports(m_driver, 'recover')
-        neutron.list_trunks.assert_called_once()
-        m_driver._get_parent_port_ip.assert_called_with(trunk_id)
+    def test__delete_pool_ports(self):
+        cls = vif_pool.NestedVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
+        vif_driver = mock.MagicMock(spec=cls_vif_driver)
+        m_driver._drv_vif = vif_driver
+
+        pool_key = ('node_ip', 'project_id', ('sg1',))
+        vif = mock.sentinel.vif
+        m_driver._existing_vifs = {'port1': vif}
 
-    def test__precreated_ports_free(self):
+        cls._delete_pool_ports(m_driver, neutron, pool_key,
+                               ['port1', 'port2'])
+
+        vif_driver._detach_vifs.assert_called_once_with(neutron, 'node_ip',
+                                                        [vif])
+        m_driver._forget_port.assert_has_calls([mock.call('port1'),
+                                                mock.call('port2')])
+        neutron.delete_port.assert_has_calls([mock.call('port1'),
+                                              mock.call('port2')])
+        self.assertEqual({}, m_driver._existing_vifs)
+
+    def test__delete_pool_ports_delete_exception(self):
         cls = vif_pool.NestedVIFPool
         m_driver = mock.MagicMock(spec=cls)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
@@ -987,152 +1629,215 @@ class NestedVIFPool(test_base.TestCase):
         vif_driver = mock.MagicMock(spec=cls_vif_driver)
         m_driver._drv_vif = vif_driver
 
-        port_id = mock.sentinel.port_id
-        host_addr = mock.sentinel.host_addr
+        pool_key = ('node_ip', 'project_id', ('sg1',))
+        m_driver._existing_vifs = {'port1': mock.sentinel.vif1,
+                                   'port2': mock.sentinel.vif2}
+        neutron.delete_port.side_effect = [n_exc.NeutronClientException,
+                                           None]
 
-        subport_obj = get_port_obj(port_id=port_id,
-                                   device_owner='trunk:subport')
-        m_driver._get_ports_by_attrs.side_effect = [[subport_obj], []]
-        trunk_id = mock.sentinel.trunk_id
-        trunk_obj = self._get_trunk_obj(port_id=trunk_id, subport_id=port_id)
-        pool_key = (host_addr, subport_obj['id'],
-                    tuple(subport_obj['security_groups']))
-        m_driver._available_ports_pools = {pool_key: port_id}
+        cls._delete_pool_ports(m_driver, neutron, pool_key,
+                               ['port1', 'port2'])
 
-        neutron.list_trunks.return_value = {'trunks': [trunk_obj]}
-        m_driver._get_parent_port_ip.return_value = host_addr
+        self.assertEqual(2, neutron.delete_port.call_count)
+        self.assertEqual({}, m_driver._existing_vifs)
 
-        cls._precreated_ports(m_driver, 'free')
-        neutron.list_trunks.assert_called_once()
-        m_driver._get_parent_port_ip.assert_called_with(trunk_id)
-        m_driver._drv_vif._remove_subport.assert_called_once()
-        neutron.delete_port.assert_called_once()
-        m_driver._drv_vif._release_vlan_id.assert_called_once()
-
-    @mock.patch('kuryr_kubernetes.os_vif_util.'
-                'neutron_to_osvif_vif_nested_vlan')
-    @mock.patch('kuryr_kubernetes.controller.drivers.default_subnet.'
-                '_get_subnet')
-    def test__precreated_ports_recover_several_trunks(self, m_get_subnet,
-                                                      m_to_osvif):
+    def test__delete_pool_ports_detach_exception(self):
         cls = vif_pool.NestedVIFPool
         m_driver = mock.MagicMock(spec=cls)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
+        vif_driver = mock.MagicMock(spec=cls_vif_driver)
+        m_driver._drv_vif = vif_driver
+
+        pool_key = ('node_ip', 'project_id', ('sg1',))
+        m_driver._existing_vifs = {'port1': mock.sentinel.vif}
+        m_driver._recyclable_ports = {}
+        vif_driver._detach_vifs.side_effect = n_exc.NeutronClientException
+
+        cls._delete_pool_ports(m_driver, neutron, pool_key, ['port1'])
+
+        neutron.delete_port.assert_not_called()
+        m_driver._forget_port.assert_not_called()
+        self.assertEqual({'port1': pool_key}, m_driver._recyclable_ports)
 
-        port_id1 = mock.sentinel.port_id1
-        host_addr1 = mock.sentinel.host_addr1
-        trunk_id1 = mock.sentinel.trunk_id1
+    def test_release_pools_vm_deleted(self):
+        cls = vif_pool.NestedVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        m_driver._delete_pool_ports.side_effect = functools.partial(
+            cls._delete_pool_ports, m_driver)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
+        vif_driver = mock.MagicMock(spec=cls_vif_driver)
+        vif_driver._detach_vifs.side_effect = functools.partial(
+            cls_vif_driver._detach_vifs, vif_driver)
+        vif_driver._get_parent_port_by_host_ip.side_effect = (
+            kl_exc.NoResourceException)
+        m_driver._drv_vif = vif_driver
 
-        port_id2 = mock.sentinel.port_id2
-        host_addr2 = mock.sentinel.host_addr2
-        trunk_id2 = mock.sentinel.trunk_id2
+        pool_key = ('10.0.0.5', 'project_id', ('sg1',))
+        m_driver._available_ports_pools = {
+            pool_key: collections.deque(['port1', 'port2'])}
+        m_driver._existing_vifs = {'port1': mock.sentinel.vif1,
+                                   'port2': mock.sentinel.vif2}
+        m_driver._last_update = {}
+        m_driver._released_hosts = set()
+        m_driver._recyclable_ports = {}
 
-        port1 = get_port_obj(port_id=port_id1, device_owner='trunk:subport')
-        port2 = get_port_obj(port_id=port_id2, device_owner='trunk:subport')
-        m_driver._get_ports_by_attrs.side_effect = [[port1, port2], []]
+        cls.release_pools(m_driver, '10.0.0.5')
 
-        trunk_obj1 = self._get_trunk_obj(port_id=trunk_id1,
-                                         subport_id=port_id1)
-        trunk_obj2 = self._get_trunk_obj(port_id=trunk_id2,
-                                         subport_id=port_id2)
-        neutron.list_trunks.return_value = {'trunks': [trunk_obj1,
-                                                       trunk_obj2]}
-        m_driver._get_parent_port_ip.side_effect = [host_addr1, host_addr2]
+        self.assertEqual({}, m_driver._available_ports_pools)
+        neutron.delete_port.assert_has_calls([mock.call('port1'),
+                                              mock.call('port2')])
+        self.assertEqual({}, m_driver._existing_vifs)
+        self.assertEqual({}, m_driver._recyclable_ports)
 
+    @mock.patch('kuryr_kubernetes.controller.drivers.default_subnet.'
+                '_get_subnet')
+    def test__precreated_ports_recover(self, m_get_subnet):
+        cls = vif_pool.NestedVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
+        vif_driver = mock.MagicMock(spec=cls_vif_driver)
+        m_driver._drv_vif = vif_driver
+
+        port1 = get_port_obj(port_id='port1', device_owner='trunk:subport')
+        port2 = get_port_obj(port_id='port2', device_owner='trunk:subport')
+        port3 = get_port_obj(port_id='port3', device_owner='trunk:subport')
+        port_in_use = get_port_obj(port_id='port4',
+                                   device_owner='trunk:subport')
+        pod = get_pod_obj()
+        m_driver._get_ports_by_attrs.return_value = [port1, port2, port3,
+                                                     port_in_use]
+        m_driver._get_in_use_ports.return_value = {'port4': pod}
+        subnet_id = port1['fixed_ips'][0]['subnet_id']
         subnet = mock.sentinel.subnet
         m_get_subnet.return_value = subnet
-        m_to_osvif.return_value = mock.sentinel.vif
+        vif1 = mock.sentinel.vif1
+        vif2 = mock.sentinel.vif2
+        vif3 = mock.sentinel.vif3
+        vif_driver._get_attached_vifs.return_value = {
+            'host_addr1': [(port1, vif1), (port2, vif2)],
+            'host_addr2': [(port3, vif3)]}
+        m_driver._existing_vifs = {}
+        m_driver._ports_attrs = {}
+        m_driver._available_ports_pools = {}
 
         cls._precreated_ports(m_driver, 'recover')
-        neutron.list_trunks.asser_called_once()
-        m_driver._get_parent_port_ip.assert_has_calls([mock.call(trunk_id1),
-                                                       mock.call(trunk_id2)])
-        calls = [mock.call(port1, {port1['fixed_ips'][0]['subnet_id']: subnet},
-                           trunk_obj1['sub_ports'][0]['segmentation_id']),
-                 mock.call(port2, {port2['fixed_ips'][0]['subnet_id']: subnet},
-                           trunk_obj2['sub_ports'][0]['segmentation_id'])]
-        m_to_osvif.assert_has_calls(calls)
-
-    @mock.patch('kuryr_kubernetes.os_vif_util.'
-                'neutron_to_osvif_vif_nested_vlan')
+
+        m_get_subnet.assert_called_once_with(subnet_id)
+        vif_driver._get_attached_vifs.assert_called_once_with(
+            neutron, [port1, port2, port3], {subnet_id: subnet})
+        self.assertEqual({'port1': vif1, 'port2': vif2, 'port3': vif3},
+                         m_driver._existing_vifs)
+        self.assertEqual({'name': 'available-port',
+                          'security_groups': port1['security_groups']},
+                         m_driver._ports_attrs['port1'])
+        sgs = tuple(port1['security_groups'])
+        self.assertEqual(
+            {('host_addr1', port1['project_id'], sgs): ['port1', 'port2'],
+             ('host_addr2', port1['project_id'], sgs): ['port3']},
+            m_driver._available_ports_pools)
+        m_driver._reclaim_in_use_port.assert_called_once_with(port_in_use,
+                                                              pod)
+
     @mock.patch('kuryr_kubernetes.controller.drivers.default_subnet.'
                 '_get_subnet')
-    def test__precreated_ports_recover_several_subports(self, m_get_subnet,
-                                                        m_to_osvif):
+    def test__precreated_ports_free(self, m_get_subnet):
         cls = vif_pool.NestedVIFPool
         m_driver = mock.MagicMock(spec=cls)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
+        vif_driver = mock.MagicMock(spec=cls_vif_driver)
+        m_driver._drv_vif = vif_driver
 
-        port_id1 = mock.sentinel.port_id1
-        host_addr = mock.sentinel.host_addr
-        trunk_id = mock.sentinel.trunk_id
-
-        port_id2 = mock.sentinel.port_id2
+        port1 = get_port_obj(port_id='port1', device_owner='trunk:subport')
+        port2 = get_port_obj(port_id='port2', device_owner='trunk:subport')
+        port_in_use = get_port_obj(port_id='port3',
+                                   device_owner='trunk:subport')
+        m_driver._get_ports_by_attrs.return_value = [port1, port2,
+                                                     port_in_use]
+        m_driver._get_in_use_ports.return_value = {'port3': get_pod_obj()}
+        vif1 = mock.sentinel.vif1
+        vif2 = mock.sentinel.vif2
+        vif_driver._get_attached_vifs.return_value = {
+            'host_addr1': [(port1, vif1)],
+            'host_addr2': [(port2, vif2)]}
+        pool_key = ('host_addr1', port1['project_id'],
+                    tuple(port1['security_groups']))
+        m_driver._existing_vifs = {'port1': vif1, 'port2': vif2}
+        m_driver._available_ports_pools = {pool_key: ['port1']}
+
+        cls._precreated_ports(m_driver, 'free', trunk_ips=['host_addr1'])
+
+        vif_driver._get_attached_vifs.assert_called_once_with(
+            neutron, [port1, port2], mock.ANY)
+        m_driver._reclaim_in_use_port.assert_not_called()
+        vif_driver._detach_vifs.assert_called_once_with(
+            neutron, 'host_addr1', [vif1])
+        m_driver._forget_port.assert_called_once_with('port1')
+        neutron.delete_port.assert_called_once_with('port1')
+        self.assertEqual({'port2': vif2}, m_driver._existing_vifs)
+        self.assertEqual({pool_key: []}, m_driver._available_ports_pools)
 
-        port1 = get_port_obj(port_id=port_id1, device_owner='trunk:subport')
-        port2 = get_port_obj(port_id=port_id2, device_owner='trunk:subport')
-        m_driver._get_ports_by_attrs.side_effect = [[port1, port2], []]
+    @mock.patch('kuryr_kubernetes.controller.drivers.default_subnet.'
+                '_get_subnet')
+    def test__precreated_ports_free_detach_exception(self, m_get_subnet):
+        cls = vif_pool.NestedVIFPool
+        m_driver = mock.MagicMock(spec=cls)
+        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
+        vif_driver = mock.MagicMock(spec=cls_vif_driver)
+        m_driver._drv_vif = vif_driver
 
-        trunk_obj = self._get_trunk_obj(port_id=trunk_id,
-                                        subport_id=port_id1)
-        trunk_obj['sub_ports'].append({'port_id': port_id2,
-                                       'segmentation_type': 'vlan',
-                                       'segmentation_id': 101})
-        neutron.list_trunks.return_value = {'trunks': [trunk_obj]}
-        m_driver._get_parent_port_ip.return_value = [host_addr]
+        port1 = get_port_obj(port_id='port1', device_owner='trunk:subport')
+        m_driver._get_ports_by_attrs.return_value = [port1]
+        vif_driver._get_attached_vifs.return_value = {
+            'host_addr1': [(port1, mock.sentinel.vif1)]}
+        vif_driver._detach_vifs.side_effect = n_exc.NeutronClientException
 
-        subnet = mock.sentinel.subnet
-        m_get_subnet.return_value = subnet
-        m_to_osvif.return_value = mock.sentinel.vif
+        cls._precreated_ports(m_driver, 'free')
 
-        cls._precreated_ports(m_driver, 'recover')
-        neutron.list_trunks.asser_called_once()
-        m_driver._get_parent_port_ip.assert_called_once_with(trunk_id)
-        calls = [mock.call(port1, {port1['fixed_ips'][0]['subnet_id']: subnet},
-                           trunk_obj['sub_ports'][0]['segmentation_id']),
-                 mock.call(port2, {port2['fixed_ips'][0]['subnet_id']: subnet},
-                           trunk_obj['sub_ports'][1]['segmentation_id'])]
-        m_to_osvif.assert_has_calls(calls)
+        neutron.delete_port.assert_not_called()
+        m_driver._forget_port.assert_not_called()
 
     @ddt.data(('recover'), ('free'))
     def test__precreated_ports_no_ports(self, m_action):
         cls = vif_pool.NestedVIFPool
         m_driver = mock.MagicMock(spec=cls)
-        neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        self.useFixture(k_fix.MockNeutronClient())
+        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
+        vif_driver = mock.MagicMock(spec=cls_vif_driver)
+        m_driver._drv_vif = vif_driver
 
         m_driver._get_ports_by_attrs.return_value = []
 
         cls._precreated_ports(m_driver, m_action)
-        neutron.list_trunks.assert_not_called()
+        vif_driver._get_attached_vifs.assert_not_called()
 
     @ddt.data(('recover'), ('free'))
-    def test__precreated_ports_no_trunks(self, m_action):
+    def test__precreated_ports_k8s_exception(self, m_action):
         cls = vif_pool.NestedVIFPool
         m_driver = mock.MagicMock(spec=cls)
         neutron = self.useFixture(k_fix.MockNeutronClient()).client
+        cls_vif_driver = nested_vlan_vif.NestedVlanPodVIFDriver
+        vif_driver = mock.MagicMock(spec=cls_vif_driver)
+        m_driver._drv_vif = vif_driver
 
-        m_driver._get_ports_by_attrs.side_effect = [[get_port_obj(
-            device_owner='trunk:subport')], []]
-        neutron.list_trunks.return_value = {'trunks': []}
+        m_driver._get_ports_by_attrs.return_value = [get_port_obj()]
+        m_driver._get_in_use_ports.side_effect = (
+            exceptions.K8sClientException)
 
         cls._precreated_ports(m_driver, m_action)
-        neutron.list_trunks.assert_called()
-        m_driver._get_parent_port_ip.assert_not_called()
 
-    @ddt.data(('recover'), ('free'))
-    def test__precreated_ports_exception(self, m_action):
+        vif_driver._get_attached_vifs.assert_not_called()
+        neutron.delete_port.assert_not_called()
+
+    def test__get_pod_port_attrs(self):
         cls = vif_pool.NestedVIFPool
         m_driver = mock.MagicMock(spec=cls)
-        neutron = self.useFixture(k_fix.MockNeutronClient()).client
 
-        port_id = mock.sentinel.port_id
-        m_driver._get_ports_by_attrs.side_effect = [[get_port_obj(
-            port_id=port_id, device_owner='trunk:subport')], []]
-        trunk_id = mock.sentinel.trunk_id
-        trunk_obj = self._get_trunk_obj(port_id=trunk_id)
-        neutron.list_trunks.return_value = {'trunks': [trunk_obj]}
-        m_driver._get_parent_port_ip.side_effect = n_exc.PortNotFoundClient
-
-        self.assertIsNone(cls._precreated_ports(m_driver, m_action))
-        neutron.list_trunks.assert_called()
-        m_driver._get_parent_port_ip.assert_called_with(trunk_id)
+        pod = get_pod_obj()
+
+        self.assertEqual({'name': pod['metadata']['name']},
+                         cls._get_pod_port_attrs(m_driver, pod))
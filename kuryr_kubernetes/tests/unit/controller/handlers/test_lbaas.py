@@ -13,6 +13,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import functools
 import itertools
 import mock
 import os_vif.objects.network as osv_network
@@ -25,6 +27,7 @@ from kuryr_kubernetes.controller.handlers import lbaas as h_lbaas
 from kuryr_kubernetes import exceptions as k_exc
 from kuryr_kubernetes.objects import lbaas as obj_lbaas
 from kuryr_kubernetes.tests import base as test_base
+from kuryr_kubernetes import utils
 
 
 class TestLBaaSSpecHandler(test_base.TestCase):
@@ -159,6 +162,79 @@ class TestLBaaSSpecHandler(test_base.TestCase):
         m_drv_sg.get_security_groups.assert_called_once_with(
             service, project_id)
 
+    def _get_subnets_mapping(self, cidrs):
+        return {'subnet%d' % i: osv_network.Network(
+                    subnets=osv_subnet.SubnetList(objects=[
+                        osv_subnet.Subnet(cidr=cidr)]))
+                for i, cidr in enumerate(cidrs)}
+
+    def _get_spec_handler(self, subnets_mapping):
+        m_handler = mock.Mock(spec=h_lbaas.LBaaSSpecHandler)
+        m_handler._drv_subnets = mock.Mock(spec=drv_base.ServiceSubnetsDriver)
+        m_handler._drv_subnets.get_subnets.return_value = subnets_mapping
+        m_handler._subnets_indexes = collections.OrderedDict()
+        m_handler._get_subnets_index.side_effect = functools.partial(
+            h_lbaas.LBaaSSpecHandler._get_subnets_index, m_handler)
+        return m_handler
+
+    def test_get_subnet_id(self):
+        service = {'metadata': {'selfLink': mock.sentinel.link}}
+        m_handler = self._get_spec_handler(self._get_subnets_mapping(
+            ['10.0.0.0/24', '10.0.1.0/24']))
+
+        ret = h_lbaas.LBaaSSpecHandler._get_subnet_id(
+            m_handler, service, mock.sentinel.project_id, '10.0.1.10')
+
+        self.assertEqual('subnet1', ret)
+        m_handler._drv_subnets.get_subnets.assert_called_once_with(
+            service, mock.sentinel.project_id)
+
+    def test_get_subnet_id_not_found(self):
+        service = {'metadata': {'selfLink': mock.sentinel.link}}
+        m_handler = self._get_spec_handler(self._get_subnets_mapping(
+            ['10.0.0.0/24', '10.0.1.0/24']))
+
+        self.assertRaises(k_exc.IntegrityError,
+                          h_lbaas.LBaaSSpecHandler._get_subnet_id, m_handler,
+                          service, mock.sentinel.project_id, '10.0.2.10')
+
+    def test_get_subnet_id_overlapping(self):
+        service = {'metadata': {'selfLink': mock.sentinel.link}}
+        m_handler = self._get_spec_handler(self._get_subnets_mapping(
+            ['10.0.0.0/16', '10.0.1.0/24']))
+
+        self.assertRaises(k_exc.IntegrityError,
+                          h_lbaas.LBaaSSpecHandler._get_subnet_id, m_handler,
+                          service, mock.sentinel.project_id, '10.0.1.10')
+
+    def test_get_subnets_index_cached(self):
+        subnets_mapping = self._get_subnets_mapping(['10.0.0.0/24'])
+        m_handler = self._get_spec_handler(subnets_mapping)
+
+        index = h_lbaas.LBaaSSpecHandler._get_subnets_index(
+            m_handler, subnets_mapping)
+        same_index = h_lbaas.LBaaSSpecHandler._get_subnets_index(
+            m_handler, self._get_subnets_mapping(['10.0.0.0/24']))
+        other_index = h_lbaas.LBaaSSpecHandler._get_subnets_index(
+            m_handler, self._get_subnets_mapping(['10.0.0.0/24',
+                                                  '10.0.1.0/24']))
+
+        self.assertIs(index, same_index)
+        self.assertIsNot(index, other_index)
+        self.assertEqual(['subnet1'], other_index.lookup('10.0.1.10'))
+
+    @mock.patch('kuryr_kubernetes.controller.handlers.lbaas.'
+                'SUBNETS_INDEXES_SIZE', 1)
+    def test_get_subnets_index_evicted(self):
+        m_handler = self._get_spec_handler(None)
+
+        for cidrs in (['10.0.0.0/24'], ['10.0.0.0/24', '10.0.1.0/24']):
+            h_lbaas.LBaaSSpecHandler._get_subnets_index(
+                m_handler, self._get_subnets_mapping(cidrs))
+
+        self.assertEqual([frozenset(['subnet0', 'subnet1'])],
+                         list(m_handler._subnets_indexes))
+
     def test_has_lbaas_spec_changes(self):
         m_handler = mock.Mock(spec=h_lbaas.LBaaSSpecHandler)
         service = mock.sentinel.service
@@ -374,6 +450,7 @@ class TestLoadBalancerHandler(test_base.TestCase):
         self.assertEqual(mock.sentinel.drv_lbaas, handler._drv_lbaas)
         self.assertEqual(mock.sentinel.drv_project, handler._drv_pod_project)
         self.assertEqual(mock.sentinel.drv_subnets, handler._drv_pod_subnets)
+        self.assertEqual({}, handler._lbaas_states)
 
     def test_on_present(self):
         lbaas_spec = mock.sentinel.lbaas_spec
@@ -395,6 +472,22 @@ class TestLoadBalancerHandler(test_base.TestCase):
             endpoints, lbaas_state, lbaas_spec)
         m_handler._set_lbaas_state.assert_called_once_with(
             endpoints, lbaas_state)
+        m_handler._drop_lbaas_state.assert_not_called()
+
+    def test_on_present_sync_failure(self):
+        endpoints = mock.sentinel.endpoints
+
+        m_handler = mock.Mock(spec=h_lbaas.LoadBalancerHandler)
+        m_handler._should_ignore.return_value = False
+        m_handler._sync_lbaas_members.side_effect = k_exc.ResourceNotReady(
+            endpoints)
+
+        self.assertRaises(k_exc.ResourceNotReady,
+                          h_lbaas.LoadBalancerHandler.on_present,
+                          m_handler, endpoints)
+
+        m_handler._set_lbaas_state.assert_not_called()
+        m_handler._drop_lbaas_state.assert_called_once_with(endpoints)
 
     @mock.patch('kuryr_kubernetes.objects.lbaas'
                 '.LBaaSServiceSpec')
@@ -410,6 +503,7 @@ class TestLoadBalancerHandler(test_base.TestCase):
         h_lbaas.LoadBalancerHandler.on_deleted(m_handler, endpoints)
 
         m_handler._get_lbaas_state.assert_called_once_with(endpoints)
+        m_handler._drop_lbaas_state.assert_called_once_with(endpoints)
         m_handler._sync_lbaas_members.assert_called_once_with(
             endpoints, lbaas_state, empty_spec)
 
@@ -569,14 +663,212 @@ class TestLoadBalancerHandler(test_base.TestCase):
         self.assertEqual(sorted(expected_targets.items()), observed_targets)
         self.assertEqual(expected_ip, str(state.loadbalancer.ip))
 
+    @mock.patch('kuryr_kubernetes.controller.drivers.base'
+                '.PodSubnetsDriver.get_instance')
+    @mock.patch('kuryr_kubernetes.controller.drivers.base'
+                '.PodProjectDriver.get_instance')
+    @mock.patch('kuryr_kubernetes.controller.drivers.base'
+                '.LBaaSDriver.get_instance')
+    def test_sync_lbaas_members_rollout(self, m_get_drv_lbaas,
+                                        m_get_drv_project, m_get_drv_subnets):
+        project_id = uuidutils.generate_uuid()
+        subnet_id = uuidutils.generate_uuid()
+        ip = '1.1.1.1'
+        current_targets = {
+            '1.1.1.101': (1001, 10001),
+            '1.1.1.111': (1001, 10001),
+            '1.1.1.201': (2001, 20001)}
+        expected_targets = {
+            '1.1.1.101': (1001, 10001),
+            '1.1.1.121': (1001, 10001),
+            '1.1.1.131': (1001, 10001),
+            '1.1.1.201': (2001, 20001)}
+        endpoints = self._generate_endpoints(expected_targets)
+        state = self._generate_lbaas_state(
+            ip, current_targets, project_id, subnet_id)
+        kept_ids = {m.id for m in state.members if str(m.ip) != '1.1.1.111'}
+        spec = self._generate_lbaas_spec(ip, expected_targets,
+                                         project_id, subnet_id)
+        m_drv_lbaas = mock.Mock(wraps=FakeLBaaSDriver())
+        m_get_drv_lbaas.return_value = m_drv_lbaas
+
+        handler = h_lbaas.LoadBalancerHandler()
+
+        self.assertTrue(handler._sync_lbaas_members(endpoints, state, spec))
+
+        lsnrs = {lsnr.id: lsnr for lsnr in state.listeners}
+        pools = {pool.id: pool for pool in state.pools}
+        observed_targets = sorted(
+            (str(member.ip), (
+                lsnrs[pools[member.pool_id].listener_id].port,
+                member.port))
+            for member in state.members)
+        self.assertEqual(sorted(expected_targets.items()), observed_targets)
+        # Only the pool of the changed targets is updated, once
+        m_drv_lbaas.update_members.assert_called_once()
+        self.assertEqual(1001, lsnrs[m_drv_lbaas.update_members.call_args[1][
+            'pool'].listener_id].port)
+        self.assertTrue(kept_ids.issubset(m.id for m in state.members))
+        m_drv_lbaas.release_pool.assert_not_called()
+
+    def test_add_populated_loadbalancer(self):
+        project_id = uuidutils.generate_uuid()
+        subnet_id = uuidutils.generate_uuid()
+        targets = {'1.1.1.101': (1001, 10001),
+                   '1.1.1.201': (2001, 20001)}
+        endpoints = self._generate_endpoints(targets)
+        spec = self._generate_lbaas_spec('1.1.1.1', targets, project_id,
+                                         subnet_id)
+        populated_state = self._generate_lbaas_state(
+            '1.1.1.1', targets, project_id, subnet_id)
+        state = obj_lbaas.LBaaSState()
+        m_handler = mock.Mock(spec=h_lbaas.LoadBalancerHandler)
+        m_handler._drv_lbaas = mock.Mock(spec=drv_base.LBaaSDriver)
+        m_handler._drv_lbaas.ensure_populated_loadbalancer.return_value = (
+            populated_state)
+        m_handler._get_targets.side_effect = functools.partial(
+            h_lbaas.LoadBalancerHandler._get_targets, m_handler)
+
+        ret = h_lbaas.LoadBalancerHandler._add_populated_loadbalancer(
+            m_handler, endpoints, state, spec)
+
+        self.assertTrue(ret)
+        self.assertIs(populated_state.loadbalancer, state.loadbalancer)
+        for field in ('listeners', 'pools', 'members'):
+            self.assertEqual([obj.id for obj in getattr(populated_state,
+                                                        field)],
+                             [obj.id for obj in getattr(state, field)])
+        target_ref = {'kind': k_const.K8S_OBJ_POD, 'namespace': 'default'}
+        m_handler._drv_lbaas.ensure_populated_loadbalancer.\
+            assert_called_once_with(
+                endpoints=endpoints, project_id=project_id,
+                subnet_id=subnet_id, ip=spec.ip,
+                security_groups_ids=spec.security_groups_ids,
+                targets={
+                    ('TCP', 1001): {('1.1.1.101', 10001): dict(
+                        target_ref, name='1.1.1.101')},
+                    ('TCP', 2001): {('1.1.1.201', 20001): dict(
+                        target_ref, name='1.1.1.201')}})
+
+    def test_add_populated_loadbalancer_not_created(self):
+        spec = self._generate_lbaas_spec('1.1.1.1', {},
+                                         uuidutils.generate_uuid(),
+                                         uuidutils.generate_uuid())
+        state = obj_lbaas.LBaaSState()
+        m_handler = mock.Mock(spec=h_lbaas.LoadBalancerHandler)
+        m_handler._drv_lbaas = mock.Mock(spec=drv_base.LBaaSDriver)
+        m_handler._drv_lbaas.ensure_populated_loadbalancer.return_value = None
+        m_handler._get_targets.return_value = {}
+
+        self.assertFalse(h_lbaas.LoadBalancerHandler.
+                         _add_populated_loadbalancer(
+                             m_handler, mock.sentinel.endpoints, state, spec))
+        self.assertIsNone(state.loadbalancer)
+
+    def test_add_populated_loadbalancer_existing(self):
+        project_id = uuidutils.generate_uuid()
+        subnet_id = uuidutils.generate_uuid()
+        targets = {'1.1.1.101': (1001, 10001)}
+        spec = self._generate_lbaas_spec('1.1.1.1', targets, project_id,
+                                         subnet_id)
+        state = self._generate_lbaas_state('1.1.1.1', targets, project_id,
+                                           subnet_id)
+        m_handler = mock.Mock(spec=h_lbaas.LoadBalancerHandler)
+        m_handler._drv_lbaas = mock.Mock(spec=drv_base.LBaaSDriver)
+
+        self.assertFalse(h_lbaas.LoadBalancerHandler.
+                         _add_populated_loadbalancer(
+                             m_handler, mock.sentinel.endpoints, state, spec))
+        m_handler._drv_lbaas.ensure_populated_loadbalancer.assert_not_called()
+
     def test_get_lbaas_spec(self):
         self.skipTest("skipping until generalised annotation handling is "
                       "implemented")
 
-    def test_get_lbaas_state(self):
-        self.skipTest("skipping until generalised annotation handling is "
-                      "implemented")
+    def _get_annotated_state(self):
+        return obj_lbaas.LBaaSState(
+            loadbalancer=obj_lbaas.LBaaSLoadBalancer(
+                id=uuidutils.generate_uuid(), project_id='project',
+                name='default/svc', ip='10.0.0.10',
+                subnet_id=uuidutils.generate_uuid()),
+            listeners=[], pools=[], members=[])
+
+    def _get_state_endpoints(self, annotation=None):
+        annotations = {}
+        if annotation is not None:
+            annotations[k_const.K8S_ANNOTATION_LBAAS_STATE] = annotation
+        return {'metadata': {'uid': mock.sentinel.uid,
+                             'selfLink': mock.sentinel.self_link,
+                             'resourceVersion': mock.sentinel.rv,
+                             'annotations': annotations}}
 
-    def test_set_lbaas_state(self):
-        self.skipTest("skipping until generalised annotation handling is "
-                      "implemented")
+    def test_get_lbaas_state(self):
+        state = self._get_annotated_state()
+        annotation = utils.dump_annotation_obj(state)
+        endpoints = self._get_state_endpoints(annotation)
+        handler = mock.Mock(spec=h_lbaas.LoadBalancerHandler)
+        handler._lbaas_states = {}
+
+        first = h_lbaas.LoadBalancerHandler._get_lbaas_state(
+            handler, endpoints)
+        # The cached LBaaSState is used regardless of the annotation
+        second = h_lbaas.LoadBalancerHandler._get_lbaas_state(
+            handler, self._get_state_endpoints('{}'))
+
+        self.assertEqual(state.obj_to_primitive(), first.obj_to_primitive())
+        self.assertIs(first, second)
+        self.assertEqual({mock.sentinel.uid: (first, annotation)},
+                         handler._lbaas_states)
+
+    def test_get_lbaas_state_no_annotation(self):
+        handler = mock.Mock(spec=h_lbaas.LoadBalancerHandler)
+        handler._lbaas_states = {}
+
+        self.assertIsNone(h_lbaas.LoadBalancerHandler._get_lbaas_state(
+            handler, self._get_state_endpoints()))
+        self.assertEqual({}, handler._lbaas_states)
+
+    @mock.patch('kuryr_kubernetes.clients.get_kubernetes_client')
+    def test_set_lbaas_state(self, m_get_k8s):
+        k8s = m_get_k8s.return_value
+        state = self._get_annotated_state()
+        endpoints = self._get_state_endpoints()
+        handler = mock.Mock(spec=h_lbaas.LoadBalancerHandler)
+        handler._lbaas_states = {}
+
+        h_lbaas.LoadBalancerHandler._set_lbaas_state(
+            handler, endpoints, state)
+        # Unchanged LBaaSStates are not annotated again
+        h_lbaas.LoadBalancerHandler._set_lbaas_state(
+            handler, endpoints, state)
+
+        annotation = utils.dump_annotation_obj(state)
+        k8s.annotate.assert_called_once_with(
+            mock.sentinel.self_link,
+            {k_const.K8S_ANNOTATION_LBAAS_STATE: annotation},
+            resource_version=mock.sentinel.rv)
+        self.assertEqual({mock.sentinel.uid: (state, annotation)},
+                         handler._lbaas_states)
+
+    @mock.patch('kuryr_kubernetes.clients.get_kubernetes_client')
+    def test_set_lbaas_state_annotate_failure(self, m_get_k8s):
+        k8s = m_get_k8s.return_value
+        k8s.annotate.side_effect = k_exc.K8sClientException
+        state = obj_lbaas.LBaaSState()
+        handler = mock.Mock(spec=h_lbaas.LoadBalancerHandler)
+        handler._lbaas_states = {mock.sentinel.uid: (state, '{}')}
+
+        self.assertRaises(k_exc.K8sClientException,
+                          h_lbaas.LoadBalancerHandler._set_lbaas_state,
+                          handler, self._get_state_endpoints(), state)
+        self.assertEqual({}, handler._lbaas_states)
+
+    def test_drop_lbaas_state(self):
+        handler = mock.Mock(spec=h_lbaas.LoadBalancerHandler)
+        handler._lbaas_states = {mock.sentinel.uid: mock.sentinel.entry}
+        endpoints = self._get_state_endpoints()
+
+        h_lbaas.LoadBalancerHandler._drop_lbaas_state(handler, endpoints)
+        h_lbaas.LoadBalancerHandler._drop_lbaas_state(handler, endpoints)
+
+        self.assertEqual({}, handler._lbaas_states)
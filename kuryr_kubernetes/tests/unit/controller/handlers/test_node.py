@@ -0,0 +1,211 @@
+# Copyright (c) 2017 Red Hat, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo_config import cfg as oslo_cfg
+
+from kuryr_kubernetes.controller.drivers import base as drivers
+from kuryr_kubernetes.controller.handlers import node as h_node
+from kuryr_kubernetes.tests import base as test_base
+
+
+class TestNodeHandler(test_base.TestCase):
+
+    def setUp(self):
+        super(TestNodeHandler, self).setUp()
+
+        self._project_id = mock.sentinel.project_id
+        self._subnets = mock.sentinel.subnets
+        self._security_groups = mock.sentinel.security_groups
+
+        self._node = {
+            'metadata': {'name': 'node-1'},
+            'spec': {},
+            'status': {'addresses': [
+                {'type': 'Hostname', 'address': 'node-1'},
+                {'type': 'InternalIP', 'address': '192.168.0.10'}]}
+        }
+
+        self._handler = mock.MagicMock(spec=h_node.NodeHandler)
+        self._handler._drv_project = mock.Mock(spec=drivers.PodProjectDriver)
+        self._handler._drv_subnets = mock.Mock(spec=drivers.PodSubnetsDriver)
+        self._handler._drv_sg = mock.Mock(spec=drivers.PodSecurityGroupsDriver)
+        self._handler._drv_vif_pool = mock.MagicMock(
+            spec=drivers.VIFPoolDriver)
+        self._handler._get_node_pod.side_effect = (
+            h_node.NodeHandler._get_node_pod)
+        self._handler._is_unschedulable.side_effect = (
+            h_node.NodeHandler._is_unschedulable)
+        self._handler._is_prewarm_enabled.side_effect = (
+            h_node.NodeHandler._is_prewarm_enabled)
+        self._handler._unschedulable_nodes = set()
+
+        self._get_project = self._handler._drv_project.get_project
+        self._get_subnets = self._handler._drv_subnets.get_subnets
+        self._get_security_groups = self._handler._drv_sg.get_security_groups
+        self._populate_pool = self._handler._drv_vif_pool.populate_pool
+        self._release_pools = self._handler._drv_vif_pool.release_pools
+        self._resume_pools = self._handler._drv_vif_pool.resume_pools
+
+        self._get_project.return_value = self._project_id
+        self._get_subnets.return_value = self._subnets
+        self._get_security_groups.return_value = self._security_groups
+
+    @mock.patch.object(drivers.VIFPoolDriver, 'get_instance')
+    @mock.patch.object(drivers.PodVIFDriver, 'get_instance')
+    @mock.patch.object(drivers.PodSecurityGroupsDriver, 'get_instance')
+    @mock.patch.object(drivers.PodSubnetsDriver, 'get_instance')
+    @mock.patch.object(drivers.PodProjectDriver, 'get_instance')
+    def test_init(self, m_get_project_driver, m_get_subnets_driver,
+                  m_get_sg_driver, m_get_vif_driver, m_get_vif_pool_driver):
+        project_driver = mock.sentinel.project_driver
+        subnets_driver = mock.sentinel.subnets_driver
+        sg_driver = mock.sentinel.sg_driver
+        vif_driver = mock.sentinel.vif_driver
+        vif_pool_driver = mock.Mock(spec=drivers.VIFPoolDriver)
+        m_get_project_driver.return_value = project_driver
+        m_get_subnets_driver.return_value = subnets_driver
+        m_get_sg_driver.return_value = sg_driver
+        m_get_vif_driver.return_value = vif_driver
+        m_get_vif_pool_driver.return_value = vif_pool_driver
+
+        handler = h_node.NodeHandler()
+
+        self.assertEqual(project_driver, handler._drv_project)
+        self.assertEqual(subnets_driver, handler._drv_subnets)
+        self.assertEqual(sg_driver, handler._drv_sg)
+        self.assertEqual(vif_pool_driver, handler._drv_vif_pool)
+        vif_pool_driver.set_vif_driver.assert_called_once_with(vif_driver)
+
+    def test_on_added(self):
+        h_node.NodeHandler.on_added(self._handler, self._node)
+
+        self._handler._populate_pool.assert_called_once_with(self._node)
+        self._handler._release_pools.assert_not_called()
+
+    def test_on_added_unschedulable(self):
+        self._node['spec']['unschedulable'] = True
+
+        h_node.NodeHandler.on_added(self._handler, self._node)
+
+        self._handler._release_pools.assert_called_once_with(self._node)
+        self._handler._populate_pool.assert_not_called()
+        self.assertEqual({'node-1'}, self._handler._unschedulable_nodes)
+
+    def test_on_modified_cordoned(self):
+        self._node['spec']['unschedulable'] = True
+
+        h_node.NodeHandler.on_modified(self._handler, self._node)
+
+        self._handler._release_pools.assert_called_once_with(self._node)
+        self.assertEqual({'node-1'}, self._handler._unschedulable_nodes)
+
+    def test_on_modified_still_cordoned(self):
+        self._node['spec']['unschedulable'] = True
+        self._handler._unschedulable_nodes = {'node-1'}
+
+        h_node.NodeHandler.on_modified(self._handler, self._node)
+
+        self._handler._release_pools.assert_not_called()
+        self._handler._populate_pool.assert_not_called()
+
+    def test_on_modified_uncordoned(self):
+        self._handler._unschedulable_nodes = {'node-1'}
+
+        h_node.NodeHandler.on_modified(self._handler, self._node)
+
+        self._handler._populate_pool.assert_called_once_with(self._node)
+        self.assertEqual(set(), self._handler._unschedulable_nodes)
+
+    def test_on_modified_schedulable(self):
+        h_node.NodeHandler.on_modified(self._handler, self._node)
+
+        self._handler._release_pools.assert_not_called()
+        self._handler._populate_pool.assert_not_called()
+
+    def test_on_deleted(self):
+        self._handler._unschedulable_nodes = {'node-1'}
+
+        h_node.NodeHandler.on_deleted(self._handler, self._node)
+
+        self._handler._release_pools.assert_called_once_with(self._node)
+        self.assertEqual(set(), self._handler._unschedulable_nodes)
+
+    def _set_prewarm(self, prewarm, vif_pool_driver='neutron'):
+        oslo_cfg.CONF.set_override('ports_pool_prewarm', prewarm,
+                                   group='vif_pool')
+        self.addCleanup(oslo_cfg.CONF.clear_override, 'ports_pool_prewarm',
+                        group='vif_pool')
+        oslo_cfg.CONF.set_override('vif_pool_driver', vif_pool_driver,
+                                   group='kubernetes')
+        self.addCleanup(oslo_cfg.CONF.clear_override, 'vif_pool_driver',
+                        group='kubernetes')
+
+    def test_populate_pool(self):
+        self._set_prewarm(True)
+
+        h_node.NodeHandler._populate_pool(self._handler, self._node)
+
+        pod = {'metadata': {'name': 'node-1', 'namespace': '', 'uid': ''},
+               'spec': {'nodeName': 'node-1'},
+               'status': {'hostIP': '192.168.0.10'}}
+        self._resume_pools.assert_called_once_with('192.168.0.10')
+        self._get_project.assert_called_once_with(pod)
+        self._get_security_groups.assert_called_once_with(pod,
+                                                          self._project_id)
+        self._get_subnets.assert_called_once_with(pod, self._project_id)
+        self._populate_pool.assert_called_once_with(
+            pod, self._project_id, self._subnets, self._security_groups)
+
+    def test_populate_pool_prewarm_disabled(self):
+        self._set_prewarm(False)
+
+        h_node.NodeHandler._populate_pool(self._handler, self._node)
+
+        self._resume_pools.assert_called_once_with('192.168.0.10')
+        self._get_project.assert_not_called()
+        self._get_subnets.assert_not_called()
+        self._get_security_groups.assert_not_called()
+        self._populate_pool.assert_not_called()
+
+    def test_populate_pool_noop_pool(self):
+        self._set_prewarm(True, vif_pool_driver='noop')
+
+        h_node.NodeHandler._populate_pool(self._handler, self._node)
+
+        self._get_project.assert_not_called()
+        self._populate_pool.assert_not_called()
+
+    def test_populate_pool_no_internal_ip(self):
+        self._set_prewarm(True)
+        self._node['status']['addresses'] = []
+
+        h_node.NodeHandler._populate_pool(self._handler, self._node)
+
+        self._resume_pools.assert_not_called()
+        self._get_project.assert_not_called()
+        self._populate_pool.assert_not_called()
+
+    def test_release_pools(self):
+        h_node.NodeHandler._release_pools(self._handler, self._node)
+
+        self._release_pools.assert_called_once_with('192.168.0.10')
+
+    def test_release_pools_no_internal_ip(self):
+        self._node['status']['addresses'] = []
+
+        h_node.NodeHandler._release_pools(self._handler, self._node)
+
+        self._release_pools.assert_not_called()
@@ -20,6 +20,7 @@ from kuryr_kubernetes.controller.drivers import base as drivers
 from kuryr_kubernetes.controller.handlers import vif as h_vif
 from kuryr_kubernetes import exceptions as k_exc
 from kuryr_kubernetes.tests import base as test_base
+from kuryr_kubernetes.tests.unit import kuryr_fixtures as k_fix
 
 
 class TestVIFHandler(test_base.TestCase):
@@ -38,7 +39,11 @@ class TestVIFHandler(test_base.TestCase):
         self._pod_link = mock.sentinel.pod_link
         self._pod = {
             'metadata': {'resourceVersion': self._pod_version,
-                         'selfLink': self._pod_link},
+                         'selfLink': self._pod_link,
+                         'namespace': 'default',
+                         'annotations': {
+                             k_const.K8S_ANNOTATION_VIF: self._vif_serialized
+                         }},
             'status': {'phase': k_const.K8S_POD_STATUS_PENDING},
             'spec': {'hostNetwork': False,
                      'nodeName': 'hostname'}
@@ -61,11 +66,13 @@ class TestVIFHandler(test_base.TestCase):
         self._activate_vif = self._handler._drv_vif_pool.activate_vif
         self._get_vif = self._handler._get_vif
         self._set_vif = self._handler._set_vif
+        self._get_vif_pool_attrs = self._handler._get_vif_pool_attrs
         self._is_host_network = self._handler._is_host_network
         self._is_pending_node = self._handler._is_pending_node
 
         self._request_vif.return_value = self._vif
         self._get_vif.return_value = self._vif
+        self._get_vif_pool_attrs.return_value = (None, None)
         self._is_host_network.return_value = False
         self._is_pending_node.return_value = True
         self._get_project.return_value = self._project_id
@@ -158,12 +165,13 @@ class TestVIFHandler(test_base.TestCase):
 
     def test_on_present_activate(self):
         self._vif.active = False
+        vif = self._vif.obj_clone.return_value
 
         h_vif.VIFHandler.on_present(self._handler, self._pod)
 
         self._get_vif.assert_called_once_with(self._pod)
-        self._activate_vif.assert_called_once_with(self._pod, self._vif)
-        self._set_vif.assert_called_once_with(self._pod, self._vif)
+        self._activate_vif.assert_called_once_with(self._pod, vif)
+        self._set_vif.assert_called_once_with(self._pod, vif)
         self._request_vif.assert_not_called()
 
     def test_on_present_create(self):
@@ -174,7 +182,9 @@ class TestVIFHandler(test_base.TestCase):
         self._get_vif.assert_called_once_with(self._pod)
         self._request_vif.assert_called_once_with(
             self._pod, self._project_id, self._subnets, self._security_groups)
-        self._set_vif.assert_called_once_with(self._pod, self._vif)
+        self._set_vif.assert_called_once_with(self._pod, self._vif,
+                                              self._project_id,
+                                              self._security_groups)
         self._activate_vif.assert_not_called()
 
     def test_on_present_rollback(self):
@@ -186,19 +196,39 @@ class TestVIFHandler(test_base.TestCase):
         self._get_vif.assert_called_once_with(self._pod)
         self._request_vif.assert_called_once_with(
             self._pod, self._project_id, self._subnets, self._security_groups)
-        self._set_vif.assert_called_once_with(self._pod, self._vif)
+        self._set_vif.assert_called_once_with(self._pod, self._vif,
+                                              self._project_id,
+                                              self._security_groups)
         self._release_vif.assert_called_once_with(self._pod, self._vif,
                                                   self._project_id,
                                                   self._security_groups)
         self._activate_vif.assert_not_called()
 
-    def test_on_deleted(self):
+    @mock.patch('kuryr_kubernetes.vif_annotation.release_vif')
+    def test_on_deleted(self, m_annot_release_vif):
         h_vif.VIFHandler.on_deleted(self._handler, self._pod)
 
         self._get_vif.assert_called_once_with(self._pod)
         self._release_vif.assert_called_once_with(self._pod, self._vif,
                                                   self._project_id,
                                                   self._security_groups)
+        m_annot_release_vif.assert_called_once_with(self._vif_serialized,
+                                                    'default')
+
+    @mock.patch('kuryr_kubernetes.vif_annotation.release_vif')
+    def test_on_deleted_pool_attrs(self, m_annot_release_vif):
+        project_id = mock.sentinel.annotated_project_id
+        security_groups = mock.sentinel.annotated_security_groups
+        self._get_vif_pool_attrs.return_value = (project_id, security_groups)
+
+        h_vif.VIFHandler.on_deleted(self._handler, self._pod)
+
+        self._get_vif_pool_attrs.assert_called_once_with(self._pod)
+        self._get_project.assert_not_called()
+        self._get_security_groups.assert_not_called()
+        self._release_vif.assert_called_once_with(self._pod, self._vif,
+                                                  project_id,
+                                                  security_groups)
 
     def test_on_deleted_host_network(self):
         self._is_host_network.return_value = True
@@ -215,3 +245,43 @@ class TestVIFHandler(test_base.TestCase):
 
         self._get_vif.assert_called_once_with(self._pod)
         self._release_vif.assert_not_called()
+
+    def test_set_vif(self):
+        k8s = self.useFixture(k_fix.MockK8sClient()).client
+        vif = mock.Mock()
+        vif.obj_to_primitive.return_value = {'vif': 'primitive'}
+
+        h_vif.VIFHandler._set_vif(self._handler, self._pod, vif,
+                                  'project1', ['sg1'])
+
+        k8s.annotate.assert_called_once_with(
+            self._pod_link,
+            {k_const.K8S_ANNOTATION_VIF: '{"vif": "primitive"}',
+             k_const.K8S_ANNOTATION_VIF_POOL:
+                 '{"project_id": "project1", "security_groups": ["sg1"]}'},
+            resource_version=self._pod_version)
+
+    def test_set_vif_none(self):
+        k8s = self.useFixture(k_fix.MockK8sClient()).client
+
+        h_vif.VIFHandler._set_vif(self._handler, self._pod, None)
+
+        k8s.annotate.assert_called_once_with(
+            self._pod_link,
+            {k_const.K8S_ANNOTATION_VIF: None,
+             k_const.K8S_ANNOTATION_VIF_POOL: None},
+            resource_version=self._pod_version)
+
+    def test_get_vif_pool_attrs(self):
+        self._pod['metadata']['annotations'] = {
+            k_const.K8S_ANNOTATION_VIF_POOL:
+                '{"project_id": "project1", "security_groups": ["sg1"]}'}
+
+        self.assertEqual(('project1', ['sg1']),
+                         h_vif.VIFHandler._get_vif_pool_attrs(self._handler,
+                                                              self._pod))
+
+    def test_get_vif_pool_attrs_no_annotation(self):
+        self.assertEqual((None, None),
+                         h_vif.VIFHandler._get_vif_pool_attrs(self._handler,
+                                                              self._pod))
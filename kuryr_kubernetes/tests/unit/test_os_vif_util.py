@@ -384,14 +384,16 @@ class TestOSVIFUtils(test_base.TestCase):
         self.assertEqual(vif_name, ovu._get_vif_name(port))
         m_get_veth_pair_names.assert_called_once_with(port_id)
 
+    @mock.patch('kuryr_kubernetes.os_vif_util._copy_obj')
     @mock.patch('kuryr_kubernetes.os_vif_util._make_vif_subnets')
     @mock.patch('os_vif.objects.subnet.SubnetList')
-    def test_make_vif_network(self, m_mk_subnet_list, m_make_vif_subnets):
+    def test_make_vif_network(self, m_mk_subnet_list, m_make_vif_subnets,
+                              m_copy_obj):
         network_id = mock.sentinel.network_id
         network = mock.Mock()
         orig_network = mock.Mock()
         orig_network.id = network_id
-        orig_network.obj_clone.return_value = network
+        m_copy_obj.return_value = network
         subnet_id = mock.sentinel.subnet_id
         subnets = {subnet_id: orig_network}
         vif_subnets = mock.sentinel.vif_subnets
@@ -402,6 +404,8 @@ class TestOSVIFUtils(test_base.TestCase):
 
         self.assertEqual(network, ovu._make_vif_network(port, subnets))
         self.assertEqual(subnet_list, network.subnets)
+        m_copy_obj.assert_called_once_with(orig_network,
+                                           exclude=('subnets',))
         m_make_vif_subnets.assert_called_once_with(port, subnets)
         m_mk_subnet_list.assert_called_once_with(objects=vif_subnets)
 
@@ -443,13 +447,14 @@ class TestOSVIFUtils(test_base.TestCase):
         self.assertRaises(k_exc.IntegrityError, ovu._make_vif_subnets,
                           port, subnets)
 
+    @mock.patch('kuryr_kubernetes.os_vif_util._copy_obj')
     @mock.patch('os_vif.objects.fixed_ip.FixedIPList')
-    def test_make_vif_subnet(self, m_mk_fixed_ip_list):
+    def test_make_vif_subnet(self, m_mk_fixed_ip_list, m_copy_obj):
         subnet_id = mock.sentinel.subnet_id
         fixed_ip_list = mock.sentinel.fixed_ip_list
         subnet = mock.Mock()
         orig_subnet = mock.Mock()
-        orig_subnet.obj_clone.return_value = subnet
+        m_copy_obj.return_value = subnet
         orig_network = mock.Mock()
         orig_network.subnets.objects = [orig_subnet]
         m_mk_fixed_ip_list.return_value = fixed_ip_list
@@ -458,6 +463,23 @@ class TestOSVIFUtils(test_base.TestCase):
         self.assertEqual(subnet, ovu._make_vif_subnet(subnets, subnet_id))
         self.assertEqual(fixed_ip_list, subnet.ips)
         m_mk_fixed_ip_list.assert_called_once_with(objects=[])
+        m_copy_obj.assert_called_once_with(orig_subnet, exclude=('ips',))
+
+    def test_copy_obj(self):
+        routes = osv_route.RouteList(objects=[
+            osv_route.Route(cidr='10.1.0.0/16', gateway='10.0.0.1')])
+        ips = osv_fixed_ip.FixedIPList(objects=[
+            osv_fixed_ip.FixedIP(address='10.0.0.5')])
+        subnet = osv_subnet.Subnet(cidr='10.0.0.0/16', routes=routes,
+                                   ips=ips)
+
+        copy = ovu._copy_obj(subnet, exclude=('ips',))
+
+        self.assertIsInstance(copy, osv_subnet.Subnet)
+        self.assertEqual(subnet.cidr, copy.cidr)
+        self.assertIs(routes, copy.routes)
+        self.assertFalse(copy.obj_attr_is_set('ips'))
+        self.assertFalse(copy.obj_attr_is_set('gateway'))
 
     def test_make_vif_subnet_invalid(self):
         subnet_id = mock.sentinel.subnet_id
@@ -0,0 +1,72 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+
+from os_vif import objects as obj_vif
+from os_vif.objects import vif as osv_vif
+
+from kuryr_kubernetes.tests import base as test_base
+from kuryr_kubernetes import utils
+
+
+class TestAnnotationsCodec(test_base.TestCase):
+
+    def setUp(self):
+        super(TestAnnotationsCodec, self).setUp()
+        obj_vif.register_all()
+        patcher = mock.patch.dict(utils._annotations_cache, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get_vif(self, port_id):
+        vif = osv_vif.VIFOpenVSwitch(id=port_id, address='fa:16:3e:00:00:01',
+                                     vif_name='tap0', active=False)
+        vif.obj_set_defaults()
+        return vif
+
+    def test_dump_load(self):
+        vif = self._get_vif('4fb1ab55-e7f9-4a8f-9ee8-6be8d0e40a11')
+
+        annotation = utils.dump_annotation_obj(vif)
+        loaded = utils.load_annotation_obj(annotation, osv_vif.VIFBase)
+
+        self.assertIsInstance(loaded, osv_vif.VIFOpenVSwitch)
+        self.assertEqual(vif.obj_to_primitive(), loaded.obj_to_primitive())
+        self.assertEqual(set(), loaded.obj_what_changed())
+
+    def test_load_cached(self):
+        annotation = utils.dump_annotation_obj(
+            self._get_vif('4fb1ab55-e7f9-4a8f-9ee8-6be8d0e40a11'))
+
+        with mock.patch.object(osv_vif.VIFBase, 'obj_from_primitive',
+                               wraps=osv_vif.VIFBase.obj_from_primitive) as m:
+            first = utils.load_annotation_obj(annotation, osv_vif.VIFBase)
+            second = utils.load_annotation_obj(annotation, osv_vif.VIFBase)
+
+        self.assertIs(first, second)
+        m.assert_called_once()
+
+    @mock.patch('kuryr_kubernetes.utils.ANNOTATIONS_CACHE_SIZE', 2)
+    def test_load_evicted(self):
+        annotations = [utils.dump_annotation_obj(self._get_vif(port_id))
+                       for port_id in ('4fb1ab55-e7f9-4a8f-9ee8-6be8d0e40a11',
+                                       '5fb1ab55-e7f9-4a8f-9ee8-6be8d0e40a11',
+                                       '6fb1ab55-e7f9-4a8f-9ee8-6be8d0e40a11')]
+
+        first = utils.load_annotation_obj(annotations[0], osv_vif.VIFBase)
+        for annotation in annotations[1:]:
+            utils.load_annotation_obj(annotation, osv_vif.VIFBase)
+
+        self.assertEqual(2, len(utils._annotations_cache))
+        self.assertIsNot(first, utils.load_annotation_obj(annotations[0],
+                                                          osv_vif.VIFBase))
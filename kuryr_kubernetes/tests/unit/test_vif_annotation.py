@@ -0,0 +1,268 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+
+from os_vif import objects as obj_vif
+from os_vif.objects import fixed_ip as osv_fixed_ip
+from os_vif.objects import network as osv_network
+from os_vif.objects import route as osv_route
+from os_vif.objects import subnet as osv_subnet
+from os_vif.objects import vif as osv_vif
+from oslo_config import cfg as oslo_cfg
+from oslo_serialization import jsonutils
+
+from kuryr_kubernetes import constants as k_const
+from kuryr_kubernetes import exceptions as k_exc
+from kuryr_kubernetes.tests import base as test_base
+from kuryr_kubernetes.tests.unit import kuryr_fixtures as k_fix
+from kuryr_kubernetes import utils
+from kuryr_kubernetes import vif_annotation
+
+
+class TestVIFAnnotation(test_base.TestCase):
+
+    def setUp(self):
+        super(TestVIFAnnotation, self).setUp()
+        obj_vif.register_all()
+        for cache in (utils._annotations_cache,
+                      vif_annotation._networks_cache,
+                      vif_annotation._published_networks):
+            patcher = mock.patch.dict(cache, clear=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for name in ('_gc_namespaces', '_collecting_namespaces'):
+            patcher = mock.patch.object(vif_annotation, name, set())
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self._k8s = self.useFixture(k_fix.MockK8sClient()).client
+
+    def _set_format(self, annotation_format):
+        oslo_cfg.CONF.set_override('vif_annotation_format', annotation_format,
+                                   group='kubernetes')
+        self.addCleanup(oslo_cfg.CONF.clear_override, 'vif_annotation_format',
+                        group='kubernetes')
+
+    def _get_vif(self, ip='10.0.0.5'):
+        subnet = osv_subnet.Subnet(
+            cidr='10.0.0.0/24', gateway='10.0.0.1', dns=['10.0.0.2'],
+            routes=osv_route.RouteList(objects=[
+                osv_route.Route(cidr='192.168.0.0/16', gateway='10.0.0.254')]),
+            ips=osv_fixed_ip.FixedIPList(objects=[
+                osv_fixed_ip.FixedIP(address=ip)]))
+        network = osv_network.Network(
+            id='2cb0a9a8-7d2f-4d8e-9e3b-0f0d2b5b1c4a', label='pods',
+            mtu=1450, subnets=osv_subnet.SubnetList(objects=[subnet]))
+        vif = osv_vif.VIFOpenVSwitch(
+            id='4fb1ab55-e7f9-4a8f-9ee8-6be8d0e40a11',
+            address='fa:16:3e:00:00:01', vif_name='tap0', active=False,
+            network=network)
+        vif.obj_set_defaults()
+        return vif
+
+    def _get_namespace(self):
+        annotations = {}
+        for args, _ in self._k8s.annotate.call_args_list:
+            annotations.update(args[1])
+        return {'metadata': {'name': 'default', 'annotations': annotations}}
+
+    def test_dump_full(self):
+        vif = self._get_vif()
+
+        annotation = vif_annotation.dump_vif(vif, 'default')
+
+        self.assertEqual(utils.dump_annotation_obj(vif), annotation)
+        self._k8s.annotate.assert_not_called()
+
+    def test_dump_load_compact(self):
+        self._set_format('compact')
+        vif = self._get_vif()
+
+        annotation = vif_annotation.dump_vif(vif, 'default')
+        self._k8s.get.return_value = self._get_namespace()
+        vif_annotation._networks_cache.clear()
+        loaded = vif_annotation.load_vif(annotation, 'default')
+
+        self.assertEqual(1, jsonutils.loads(annotation)['format'])
+        self.assertLess(len(annotation), len(utils.dump_annotation_obj(vif)))
+        self.assertEqual(vif.obj_to_primitive(), loaded.obj_to_primitive())
+        self.assertEqual(set(), loaded.obj_what_changed())
+        self._k8s.get.assert_called_once_with(
+            k_const.K8S_API_NAMESPACES + '/default')
+
+    def test_dump_compact_published_once(self):
+        self._set_format('compact')
+
+        first = vif_annotation.dump_vif(self._get_vif('10.0.0.5'), 'default')
+        second = vif_annotation.dump_vif(self._get_vif('10.0.0.6'), 'default')
+
+        self.assertEqual(jsonutils.loads(first)['network'],
+                         jsonutils.loads(second)['network'])
+        self._k8s.annotate.assert_called_once_with(
+            k_const.K8S_API_NAMESPACES + '/default', mock.ANY)
+        name, = self._k8s.annotate.call_args[0][1]
+        self.assertTrue(name.startswith(k_const.K8S_ANNOTATION_NETWORK_PREFIX))
+
+    def test_dump_compact_floating_ips(self):
+        self._set_format('compact')
+        vif = self._get_vif()
+        vif.network.subnets.objects[0].ips.objects[0].floating_ips = [
+            '172.24.4.10']
+
+        annotation = vif_annotation.dump_vif(vif, 'default')
+
+        self.assertEqual(utils.dump_annotation_obj(vif), annotation)
+        self._k8s.annotate.assert_not_called()
+
+    def test_load_full(self):
+        self._set_format('compact')
+        vif = self._get_vif()
+
+        loaded = vif_annotation.load_vif(utils.dump_annotation_obj(vif),
+                                         'default')
+
+        self.assertEqual(vif.obj_to_primitive(), loaded.obj_to_primitive())
+        self._k8s.get.assert_not_called()
+
+    def test_load_compact_cached_network(self):
+        self._set_format('compact')
+        annotation = vif_annotation.dump_vif(self._get_vif('10.0.0.5'),
+                                             'default')
+        self._k8s.get.return_value = self._get_namespace()
+
+        vif_annotation._networks_cache.clear()
+        first = vif_annotation.load_vif(annotation, 'default')
+        second = vif_annotation.load_vif(
+            vif_annotation.dump_vif(self._get_vif('10.0.0.6'), 'default'),
+            'default')
+
+        self._k8s.get.assert_called_once()
+        self.assertIs(first.network.subnets.objects[0].routes,
+                      second.network.subnets.objects[0].routes)
+        self.assertEqual(
+            '10.0.0.6',
+            str(second.network.subnets.objects[0].ips.objects[0].address))
+
+    def test_load_compact_missing_network(self):
+        self._set_format('compact')
+        annotation = vif_annotation.dump_vif(self._get_vif(), 'default')
+        self._k8s.get.return_value = {'metadata': {'name': 'default'}}
+        vif_annotation._networks_cache.clear()
+
+        self.assertRaises(k_exc.ResourceNotReady, vif_annotation.load_vif,
+                          annotation, 'default')
+
+    @mock.patch('eventlet.spawn_after')
+    def test_release_vif(self, m_spawn_after):
+        self._set_format('compact')
+        annotation = vif_annotation.dump_vif(self._get_vif(), 'default')
+
+        vif_annotation.release_vif(annotation, 'default')
+        vif_annotation.release_vif(annotation, 'default')
+
+        m_spawn_after.assert_called_once_with(
+            vif_annotation.NETWORKS_GC_DELAY,
+            vif_annotation._collect_networks, 'default')
+
+    @mock.patch('eventlet.spawn_after')
+    def test_release_vif_full(self, m_spawn_after):
+        annotation = vif_annotation.dump_vif(self._get_vif(), 'default')
+
+        vif_annotation.release_vif(annotation, 'default')
+
+        m_spawn_after.assert_not_called()
+
+    @mock.patch('time.time')
+    def test_collect_networks(self, m_time):
+        prefix = k_const.K8S_ANNOTATION_NETWORK_PREFIX
+        ns_link = k_const.K8S_API_NAMESPACES + '/default'
+        ns = {'metadata': {'resourceVersion': '5', 'annotations': {
+            prefix + 'used': '{}', prefix + 'unused': '{}',
+            prefix + 'recent': '{}', 'other': 'value'}}}
+        pod = {'metadata': {'annotations': {
+            k_const.K8S_ANNOTATION_VIF: jsonutils.dumps(
+                {'format': 1, 'network': 'used'})}}}
+        self._k8s.get.side_effect = [ns, {'items': [pod, {'metadata': {}}]}]
+        vif_annotation._published_networks.update({
+            ('default', 'unused'): 900, ('default', 'recent'): 980})
+        vif_annotation._gc_namespaces.add('default')
+        m_time.return_value = 1000
+
+        vif_annotation._collect_networks('default')
+
+        self._k8s.get.assert_has_calls([mock.call(ns_link),
+                                        mock.call(ns_link + '/pods')])
+        self._k8s.annotate.assert_called_once_with(
+            ns_link, {prefix + 'unused': None}, resource_version='5')
+        self.assertEqual({('default', 'recent'): 980},
+                         vif_annotation._published_networks)
+        self.assertEqual(set(), vif_annotation._gc_namespaces)
+
+    @mock.patch('time.time')
+    def test_collect_networks_published_meanwhile(self, m_time):
+        self._set_format('compact')
+        ns_link = k_const.K8S_API_NAMESPACES + '/default'
+        vif = self._get_vif()
+        m_time.return_value = 900
+        digest = jsonutils.loads(
+            vif_annotation.dump_vif(vif, 'default'))['network']
+        ns = self._get_namespace()
+        ns['metadata']['resourceVersion'] = '5'
+        self._k8s.get.side_effect = [ns, {'items': []}]
+        self._k8s.annotate.reset_mock()
+        m_time.return_value = 1000
+
+        def annotate(path, annotations, resource_version=None):
+            if resource_version:
+                # A pod gets the network while it is being removed
+                vif_annotation.dump_vif(vif, 'default')
+
+        self._k8s.annotate.side_effect = annotate
+
+        vif_annotation._collect_networks('default')
+
+        name = k_const.K8S_ANNOTATION_NETWORK_PREFIX + digest
+        self.assertEqual(
+            mock.call(ns_link, {name: ns['metadata']['annotations'][name]}),
+            self._k8s.annotate.call_args)
+        self.assertEqual({('default', digest): 1000},
+                         vif_annotation._published_networks)
+        self.assertEqual(set(), vif_annotation._collecting_namespaces)
+
+    def test_collect_networks_none_annotated(self):
+        self._k8s.get.return_value = {'metadata': {}}
+
+        vif_annotation._collect_networks('default')
+
+        self._k8s.get.assert_called_once_with(
+            k_const.K8S_API_NAMESPACES + '/default')
+        self._k8s.annotate.assert_not_called()
+
+    def test_collect_networks_namespace_changed(self):
+        prefix = k_const.K8S_ANNOTATION_NETWORK_PREFIX
+        ns = {'metadata': {'resourceVersion': '5',
+                           'annotations': {prefix + 'unused': '{}'}}}
+        self._k8s.get.side_effect = [ns, {'items': []}]
+        self._k8s.annotate.side_effect = k_exc.K8sClientException
+
+        vif_annotation._collect_networks('default')
+
+        self._k8s.annotate.assert_called_once()
+
+    def test_get_vif_id(self):
+        vif = self._get_vif()
+
+        self.assertEqual(vif.id, vif_annotation.get_vif_id(
+            utils.dump_annotation_obj(vif)))
+        self._set_format('compact')
+        self.assertEqual(vif.id, vif_annotation.get_vif_id(
+            vif_annotation.dump_vif(vif, 'default')))
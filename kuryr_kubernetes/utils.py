@@ -10,8 +10,18 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
+import hashlib
+
 from oslo_serialization import jsonutils
 
+from kuryr_kubernetes import constants
+
+# Number of decoded annotations kept by load_annotation_obj
+ANNOTATIONS_CACHE_SIZE = 1024
+
+_annotations_cache = collections.OrderedDict()
+
 
 def utf8_json_decoder(byte_data):
     """Deserializes the bytes into UTF-8 encoded JSON.
@@ -20,3 +30,53 @@ def utf8_json_decoder(byte_data):
     :returns: The UTF-8 encoded JSON represented by Python dictionary format.
     """
     return jsonutils.loads(byte_data.decode('utf8'))
+
+
+def get_node_ip(node):
+    """Returns the internal IP address of a Kubernetes node.
+
+    :param node: dict containing Kubernetes Node object
+    :returns: the node's 'InternalIP' address, or None if it has none.
+    """
+    for address in node.get('status', {}).get('addresses', []):
+        if address['type'] == constants.K8S_NODE_ADDRESS_INTERNAL_IP:
+            return address['address']
+    return None
+
+
+def dump_annotation_obj(obj):
+    """Encodes a versioned object into an annotation.
+
+    :param obj: oslo versioned object (e.g., an os-vif VIF) to encode. Its
+                changes are reset, as the annotation is its saved state.
+    :returns: the JSON string of the object primitive.
+    """
+    obj.obj_reset_changes(recursive=True)
+    return jsonutils.dumps(obj.obj_to_primitive(), sort_keys=True)
+
+
+def load_annotation_obj(annotation, obj_cls, decoder=None):
+    """Decodes an annotation made by dump_annotation_obj.
+
+    As the annotations usually do not change between the events of a
+    resource, the last ANNOTATIONS_CACHE_SIZE decoded objects are cached,
+    keyed by the digest of their annotation, and shared among the callers.
+    Thus, the returned object must not be modified: callers that need to
+    modify it have to work on a copy (obj_clone) instead.
+
+    :param annotation: JSON string of a versioned object primitive.
+    :param obj_cls: versioned object class to decode the primitive with.
+    :param decoder: function decoding the annotation JSON into the object,
+                    for the annotations not holding a plain primitive of
+                    obj_cls. Defaults to obj_cls.obj_from_primitive.
+    :returns: the decoded object.
+    """
+    key = (obj_cls, hashlib.sha1(annotation.encode('utf8')).digest())
+    obj = _annotations_cache.pop(key, None)
+    if obj is None:
+        decoder = decoder or obj_cls.obj_from_primitive
+        obj = decoder(jsonutils.loads(annotation))
+        while len(_annotations_cache) >= ANNOTATIONS_CACHE_SIZE:
+            _annotations_cache.popitem(last=False)
+    _annotations_cache[key] = obj
+    return obj
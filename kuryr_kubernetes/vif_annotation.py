@@ -0,0 +1,304 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Encoding of the pods VIF annotation.
+
+The VIF annotation is written either in the 'full' format, i.e., the
+primitive of the os-vif VIF, or in the 'compact' one, chosen by the
+`vif_annotation_format` option. The compact annotation holds the VIF
+primitive without its network, the digest of the network definition (the
+network and its subnets, without the pod IPs) and the pod IPs of each
+subnet. As the CNI driver cannot reach Neutron, the network definitions are
+annotated on the namespace of the pods, once per namespace and digest, and
+resolved from there (or from a local cache) when reading the annotation.
+Once no pod of the namespace references a network definition any more, it
+is removed from the namespace.
+
+Both formats can always be read, so the pods annotated before switching the
+format keep working.
+"""
+
+import collections
+import eventlet
+import functools
+import hashlib
+import time
+
+from os_vif.objects import fixed_ip as osv_fixed_ip
+from os_vif.objects import network as osv_network
+from os_vif.objects import subnet as osv_subnet
+from os_vif.objects import vif as osv_vif
+from oslo_config import cfg as oslo_cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+
+from kuryr_kubernetes import clients
+from kuryr_kubernetes import constants
+from kuryr_kubernetes import exceptions as k_exc
+from kuryr_kubernetes import os_vif_util as ovu
+from kuryr_kubernetes import utils
+
+LOG = logging.getLogger(__name__)
+
+COMPACT_FORMAT_VERSION = 1
+
+# Number of decoded network definitions kept by _get_network
+NETWORKS_CACHE_SIZE = 256
+# Seconds waited after a pod deletion before removing the network
+# definitions no longer used in its namespace. The definitions used for a
+# pod annotation within that time are kept too.
+NETWORKS_GC_DELAY = 60
+
+_networks_cache = collections.OrderedDict()
+# Time each network definition was last used, by (namespace, digest)
+_published_networks = {}
+_gc_namespaces = set()
+_collecting_namespaces = set()
+
+
+def dump_vif(vif, namespace):
+    """Encodes the VIF of a pod into its annotation.
+
+    With the 'compact' format, the network definition of the VIF is
+    annotated on the pod namespace, if it is not known to be there already.
+
+    :param vif: os-vif VIF object to encode. Its changes are reset.
+    :param namespace: name of the namespace of the pod.
+    :returns: the annotation string.
+    """
+    if (oslo_cfg.CONF.kubernetes.vif_annotation_format != 'compact' or
+            not _is_compactable(vif)):
+        return utils.dump_annotation_obj(vif)
+
+    vif.obj_reset_changes(recursive=True)
+    subnets = vif.network.subnets.objects
+    network = ovu._copy_obj(vif.network, exclude=('subnets',))
+    network.subnets = osv_subnet.SubnetList(
+        objects=[ovu._copy_obj(subnet, exclude=('ips',))
+                 for subnet in subnets])
+    network.obj_reset_changes(recursive=True)
+    network_annotation = jsonutils.dumps(network.obj_to_primitive(),
+                                         sort_keys=True)
+    digest = hashlib.sha1(network_annotation.encode('utf8')).hexdigest()
+    _publish_network(namespace, digest, network_annotation)
+
+    port = ovu._copy_obj(vif, exclude=('network',))
+    port.obj_reset_changes()
+    return jsonutils.dumps({
+        'format': COMPACT_FORMAT_VERSION,
+        'network': digest,
+        'ips': [[ip.address for ip in subnet.ips.objects]
+                if subnet.obj_attr_is_set('ips') else None
+                for subnet in subnets],
+        'vif': port.obj_to_primitive()}, sort_keys=True)
+
+
+def load_vif(annotation, namespace):
+    """Decodes the VIF annotation of a pod, in any of its formats.
+
+    As with utils.load_annotation_obj, the returned VIF is shared among the
+    callers and must not be modified.
+
+    :param annotation: the annotation string.
+    :param namespace: name of the namespace of the pod.
+    :returns: the os-vif VIF object.
+    """
+    return utils.load_annotation_obj(
+        annotation, osv_vif.VIFBase,
+        decoder=functools.partial(_vif_from_primitive, namespace=namespace))
+
+
+def release_vif(annotation, namespace):
+    """Releases the network definition of the VIF of a deleted pod.
+
+    The network definitions of the namespace are garbage collected after
+    NETWORKS_GC_DELAY seconds, so that a single collection handles the pods
+    deleted in the meantime.
+
+    :param annotation: the annotation string of the deleted pod.
+    :param namespace: name of the namespace of the pod.
+    """
+    if 'format' not in jsonutils.loads(annotation):
+        return
+    if namespace not in _gc_namespaces:
+        _gc_namespaces.add(namespace)
+        eventlet.spawn_after(NETWORKS_GC_DELAY, _collect_networks, namespace)
+
+
+def get_vif_id(annotation):
+    """Returns the id of the VIF of an annotation, in any of its formats.
+
+    Unlike load_vif, it does not decode the VIF, so the network definitions
+    of the compact annotations are not resolved.
+
+    :param annotation: the annotation string.
+    :returns: the id of the VIF (i.e., of its Neutron port).
+    """
+    primitive = jsonutils.loads(annotation)
+    if 'format' in primitive:
+        primitive = primitive['vif']
+    return primitive['versioned_object.data']['id']
+
+
+def _is_compactable(vif):
+    # The compact format only keeps the address of the pod IPs
+    if not (vif.obj_attr_is_set('network') and
+            vif.network.obj_attr_is_set('subnets')):
+        return False
+    return all(not ip.obj_attr_is_set('floating_ips')
+               for subnet in vif.network.subnets.objects
+               if subnet.obj_attr_is_set('ips')
+               for ip in subnet.ips.objects)
+
+
+def _vif_from_primitive(primitive, namespace):
+    if 'format' not in primitive:
+        return osv_vif.VIFBase.obj_from_primitive(primitive)
+    if primitive['format'] != COMPACT_FORMAT_VERSION:
+        raise k_exc.IntegrityError(
+            "Unsupported VIF annotation format %s" % primitive['format'])
+
+    vif = osv_vif.VIFBase.obj_from_primitive(primitive['vif'])
+    template = _get_network(namespace, primitive['network'])
+    subnets = []
+    for subnet, ips in zip(template.subnets.objects, primitive['ips']):
+        subnet = ovu._copy_obj(subnet)
+        if ips is not None:
+            subnet.ips = osv_fixed_ip.FixedIPList(
+                objects=[osv_fixed_ip.FixedIP(address=ip) for ip in ips])
+        subnets.append(subnet)
+    vif.network = ovu._copy_obj(template, exclude=('subnets',))
+    vif.network.subnets = osv_subnet.SubnetList(objects=subnets)
+    vif.obj_reset_changes(recursive=True)
+    return vif
+
+
+def _get_network_annotation_name(digest):
+    return constants.K8S_ANNOTATION_NETWORK_PREFIX + digest
+
+
+def _get_namespace_link(namespace):
+    return constants.K8S_API_NAMESPACES + '/' + namespace
+
+
+def _publish_network(namespace, digest, network_annotation):
+    key = (namespace, digest)
+    # The definitions are annotated again while their namespace is garbage
+    # collected, as they may be being removed (see _collect_networks)
+    publish = (key not in _published_networks or
+               namespace in _collecting_namespaces)
+    _published_networks[key] = time.time()
+    if not publish:
+        return
+    LOG.debug("Annotating network %(digest)s on namespace %(ns)s",
+              {'digest': digest, 'ns': namespace})
+    k8s = clients.get_kubernetes_client()
+    try:
+        k8s.annotate(_get_namespace_link(namespace),
+                     {_get_network_annotation_name(digest):
+                      network_annotation})
+    except k_exc.K8sClientException:
+        _published_networks.pop(key, None)
+        raise
+
+
+def _collect_networks(namespace):
+    """Removes the network definitions no pod of the namespace references.
+
+    The namespace is annotated with its resourceVersion, so nothing is
+    removed if it changed since it was read. As publishing a definition
+    that is already there does not change the namespace, the definitions
+    used for pods while being removed are annotated again afterwards.
+    """
+    _gc_namespaces.discard(namespace)
+    _collecting_namespaces.add(namespace)
+    try:
+        _remove_unused_networks(namespace)
+    finally:
+        _collecting_namespaces.discard(namespace)
+
+
+def _remove_unused_networks(namespace):
+    prefix = constants.K8S_ANNOTATION_NETWORK_PREFIX
+    link = _get_namespace_link(namespace)
+    k8s = clients.get_kubernetes_client()
+    try:
+        ns = k8s.get(link)
+        annotations = ns['metadata'].get('annotations', {})
+        digests = set(name[len(prefix):] for name in annotations
+                      if name.startswith(prefix))
+        if not digests:
+            return
+        pods = k8s.get(link + '/pods')
+    except k_exc.K8sClientException:
+        LOG.warning("Error getting the pods of namespace %s, its unused "
+                    "network definitions are not removed.", namespace)
+        return
+
+    for pod in pods.get('items', []):
+        annotation = pod['metadata'].get('annotations', {}).get(
+            constants.K8S_ANNOTATION_VIF)
+        if annotation:
+            digests.discard(jsonutils.loads(annotation).get('network'))
+    now = time.time()
+    digests = [digest for digest in digests
+               if now - _published_networks.get((namespace, digest), 0) >=
+               NETWORKS_GC_DELAY]
+    if not digests:
+        return
+
+    LOG.debug("Removing unused networks %(digests)s from namespace %(ns)s",
+              {'digests': digests, 'ns': namespace})
+    try:
+        k8s.annotate(link, {_get_network_annotation_name(digest): None
+                            for digest in digests},
+                     resource_version=ns['metadata']['resourceVersion'])
+    except k_exc.K8sClientException:
+        LOG.debug("Namespace %s changed, its unused network definitions "
+                  "are removed on the next pod deletion.", namespace)
+        return
+
+    for digest in digests:
+        key = (namespace, digest)
+        if _published_networks.get(key, 0) < now:
+            _published_networks.pop(key, None)
+            continue
+        name = _get_network_annotation_name(digest)
+        try:
+            k8s.annotate(link, {name: annotations[name]})
+        except k_exc.K8sClientException:
+            LOG.warning("Error annotating network %(digest)s back on "
+                        "namespace %(ns)s", {'digest': digest,
+                                             'ns': namespace})
+            _published_networks.pop(key, None)
+
+
+def _get_network(namespace, digest):
+    # The network definitions are identified by their digest, so the same
+    # decoded (and not to be modified) definition is shared by every
+    # namespace
+    network = _networks_cache.pop(digest, None)
+    if network is None:
+        k8s = clients.get_kubernetes_client()
+        ns = k8s.get(_get_namespace_link(namespace))
+        annotations = ns['metadata'].get('annotations', {})
+        try:
+            network_annotation = annotations[
+                _get_network_annotation_name(digest)]
+        except KeyError:
+            raise k_exc.ResourceNotReady(ns)
+        network = osv_network.Network.obj_from_primitive(
+            jsonutils.loads(network_annotation))
+        while len(_networks_cache) >= NETWORKS_CACHE_SIZE:
+            _networks_cache.popitem(last=False)
+    _networks_cache[digest] = network
+    return network